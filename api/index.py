@@ -1,9 +1,14 @@
+import time
+
+# Cold-start timings are measured from here
+_MODULE_STARTED = time.perf_counter()
+
 import os
-import re
 import tempfile
 import logging
 import sys
-from urllib.parse import urlparse, parse_qs
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging first - write to stderr so Vercel can see it
 logging.basicConfig(
@@ -15,19 +20,21 @@ logger = logging.getLogger(__name__)
 
 # Import Flask first (most critical)
 try:
-    from flask import Flask, render_template, request, jsonify, send_file
-    logger.info("Flask imported successfully")
+    from flask import Flask, Response, render_template, request, jsonify, stream_with_context, url_for
+    logger.debug("Flask imported successfully")
 except ImportError as e:
     logger.error(f"Flask import error: {str(e)}")
     raise
 
 try:
     from flask_cors import CORS
-    logger.info("flask-cors imported successfully")
+    logger.debug("flask-cors imported successfully")
 except ImportError as e:
     logger.error(f"flask-cors import error: {str(e)}")
     raise
 
+_FLASK_IMPORTED = time.perf_counter()
+
 # Lazy-load yt_dlp - don't import it at module level to avoid initialization issues
 yt_dlp = None
 def get_yt_dlp():
@@ -35,7 +42,8 @@ def get_yt_dlp():
     global yt_dlp
     if yt_dlp is None:
         try:
-            import yt_dlp as ytdlp
+            with startup.step('import_yt_dlp'):
+                import yt_dlp as ytdlp
             yt_dlp = ytdlp
             logger.info("yt-dlp imported successfully")
         except ImportError as e:
@@ -47,22 +55,45 @@ def get_yt_dlp():
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 
-logger.info(f"BASE_DIR: {BASE_DIR}")
-logger.info(f"PROJECT_ROOT: {PROJECT_ROOT}")
+# Make the shared fralix package importable from the project root
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from fralix.assets import AssetManifest
+from fralix.audio import AudioPool, PostprocessBusy, PostprocessError, audio_target, download_selector
+from fralix.bandwidth import BULK, INTERACTIVE, BandwidthManager
+from fralix.batch import FLAT_PLAYLIST_OPTIONS, BatchAnalyzer, batch_settings, ndjson, playlist_entries
+from fralix.bulk import BulkProgress, bulk_settings, unique_names, zip_stream
+from fralix.cache import MetadataCache
+from fralix.coldstart import PLATFORM_EXTRACTORS, ExtractorSet, StartupTimer, coldstart_settings
+from fralix.fileserve import offload_settings, serve_artifact, serve_asset, serve_thumbnail
+from fralix.formats import format_settings, preset_request, preset_selector, rank_formats, smallest_format
+from fralix.jobs import FINISHED, JobError, JobManager, QueueFull, completed_job, job_headers, job_http_status
+from fralix.metrics import Metrics, instrument_app, register_service_collectors
+from fralix.profiling import PROFILE_HEADER, Profiler, profile_app
+from fralix.ratelimit import PlatformGuard, PlatformThrottled, blocked_message, is_bot_detection
+from fralix.resume import PartialDownloads
+from fralix.singleflight import SingleFlight
+from fralix.store import ArtifactStore, artifact_key, artifact_result, download_name
+from fralix.streaming import MediaStream, StreamError, content_disposition, stream_settings, streamable_format
+from fralix.thumbnails import ThumbnailCache, ThumbnailError
+from fralix.urls import parse_video_url, video_key
+from fralix.ydl_pool import YDLPool
+
+# Durations of the cold-start steps, reported on /debug and /metrics
+startup = StartupTimer()
+startup.record('import_flask', _FLASK_IMPORTED - _MODULE_STARTED)
 
-# Initialize Flask app
+# Initialize Flask app (paths and their existence are reported by /debug, not logged here)
 try:
     static_path = os.path.join(PROJECT_ROOT, 'static')
     template_path = os.path.join(PROJECT_ROOT, 'templates')
     
-    logger.info(f"Static folder: {static_path}, exists: {os.path.exists(static_path)}")
-    logger.info(f"Template folder: {template_path}, exists: {os.path.exists(template_path)}")
-    
     app = Flask(__name__, 
                 static_folder=static_path,
                 template_folder=template_path)
     CORS(app)
-    logger.info("Flask app initialized successfully")
+    logger.debug("Flask app initialized successfully")
 except Exception as e:
     logger.error(f"Flask app initialization error: {str(e)}")
     raise
@@ -73,60 +104,161 @@ except Exception as e:
 DOWNLOADS_DIR = os.path.join(tempfile.gettempdir(), 'downloads')
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+# Vercel's /tmp is small (512 MB), so keep the download store well below it
+artifact_store = ArtifactStore.from_env(DOWNLOADS_DIR, default_quota=256 * 1024 ** 2)
 
-def detect_platform(url):
-    """Detect which platform the URL belongs to"""
-    url_lower = url.lower()
-    
-    if 'youtube.com' in url_lower or 'youtu.be' in url_lower:
-        return 'youtube'
-    elif 'linkedin.com' in url_lower:
-        return 'linkedin'
-    elif 'twitter.com' in url_lower or 'x.com' in url_lower:
-        return 'twitter'
-    elif 'instagram.com' in url_lower:
-        return 'instagram'
-    else:
-        return 'unknown'
+# Unfinished downloads stay in /tmp so a retry on a warm instance continues them
+partial_downloads = PartialDownloads.from_env(os.path.join(DOWNLOADS_DIR, '.partial'))
+
+# Resized preview thumbnails served by /api/thumbnail, kept small like everything in /tmp
+thumbnail_cache = ThumbnailCache.from_env(os.path.join(tempfile.gettempdir(), 'cache', 'thumbnails'),
+                                          default_quota=16 * 1024 ** 2)
+
+# Fingerprinted, precompressed CSS/JS built by `python -m fralix.assets`; plain files until then
+static_assets = AssetManifest(app.static_folder)
+
+# Optionally let nginx (X-Accel-Redirect) or Apache (X-Sendfile) push the file bytes
+file_offload = offload_settings()
+app.config['USE_X_SENDFILE'] = file_offload['offload'] == 'sendfile'
+
+# Metadata cache lives in /tmp too; it survives between invocations of a warm instance
+metadata_cache = MetadataCache.from_env(os.path.join(tempfile.gettempdir(), 'cache'))
+
+# Serverless functions are frozen once they respond, so jobs run inline here
+# by default; the response still has the same job shape as app.py
+download_jobs = JobManager.from_env(os.path.join(tempfile.gettempdir(), 'cache', 'jobs'), inline=True)
+
+# Outbound extraction rate limits and bot-detection circuit breakers
+platform_guard = PlatformGuard.from_env(os.path.join(tempfile.gettempdir(), 'cache'))
+
+# YoutubeDL instances register only the supported platforms' extractors
+# unless YTDLP_EXTRACTORS=all; COLDSTART_PREWARM loads them after the first response
+coldstart_config = coldstart_settings()
+extractor_set = ExtractorSet.from_settings(coldstart_config, startup)
+
+# Warm YoutubeDL instances survive between invocations of a warm function
+ydl_pool = YDLPool.from_env(lambda options: extractor_set.build(get_yt_dlp(), options))
+
+# Identical analyze requests in flight at the same time share one extraction
+analyze_flight = SingleFlight()
+
+# Size and parallelism limits of /api/analyze/batch
+batch_config = batch_settings()
+
+# Item parallelism of bulk downloads and fragment concurrency of every download
+bulk_config = bulk_settings()
+
+# Formats offered by /api/analyze; adaptive video+audio pairs only when ffmpeg can merge them
+format_config = format_settings()
+
+# ffmpeg conversions of audio-only downloads, on a process pool apart from the request handlers
+audio_pool = AudioPool.from_env()
+
+# Upstream (yt-dlp) and downstream (file serving) caps, shared fairly by the transfers of an instance
+bandwidth = BandwidthManager.from_env(os.path.join(tempfile.gettempdir(), 'cache'))
+
+# Prometheus metrics at /metrics (per warm instance)
+metrics = Metrics.from_env(os.path.join(tempfile.gettempdir(), 'cache'))
+instrument_app(app, metrics)
+register_service_collectors(metrics, download_jobs, analyze_flight, ydl_pool, metadata_cache, artifact_store, platform_guard)
+metrics.collector(bandwidth.samples)
+metrics.collector(audio_pool.samples)
+startup.attach(metrics)
+
+# Sampled request profiles (PROFILE_SAMPLE_RATE or PROFILE_TOKEN) of this instance, listed at /api/profiles
+profiler = Profiler.from_env(os.path.join(tempfile.gettempdir(), 'cache'))
+profile_app(app, profiler)
+metrics.on_phase(profiler.record_phase)
+
+# Options of every metadata extraction (also part of the metadata cache key)
+VIDEO_INFO_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': False,
+}
+
+
+@app.before_request
+def _time_first_request():
+    if not startup.done('first_request'):
+        request.environ['fralix.started'] = time.perf_counter()
+
+
+@app.teardown_request
+def _after_first_request(exc):
+    started = request.environ.pop('fralix.started', None)
+    if started is None:
+        return
+    startup.record('first_request', time.perf_counter() - started)
+    if coldstart_config['prewarm']:
+        threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+
+def prewarm():
+    """Import yt-dlp and build one pooled YoutubeDL per platform with its extractors loaded"""
+    try:
+        with startup.step('prewarm'):
+            get_yt_dlp()
+            for platform, keys in PLATFORM_EXTRACTORS.items():
+                with ydl_pool.checkout((platform,), lambda: dict(VIDEO_INFO_OPTIONS)) as ydl:
+                    for key in keys:
+                        ydl.get_info_extractor(key)
+    except Exception as e:
+        logger.warning(f"Pre-warming failed: {str(e)}")
 
 
 def get_video_info(url, platform):
     """Get video information without downloading"""
+    ydl_opts = VIDEO_INFO_OPTIONS
+    
+    cache_key = metadata_cache.make_key(platform, video_key(url, platform), ydl_opts)
+    cached = metadata_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Metadata cache hit for {cache_key}")
+        return cached
+    
+    # Concurrent requests for the same video share a single extraction
+    return analyze_flight.do(cache_key, extract_video_info, url, platform, ydl_opts, cache_key)
+
+
+def proxied_thumbnail(platform, url, source):
+    """/api/thumbnail URL of a video's preview, or the platform's own URL when it is not proxied"""
+    thumb_id = thumbnail_cache.register(platform, video_key(url, platform), source)
+    return f'/api/thumbnail/{thumb_id}' if thumb_id else (source or '')
+
+
+def extract_video_info(url, platform, ydl_opts, cache_key):
+    """Extract video information with yt-dlp and cache it"""
     try:
-        ytdlp = get_yt_dlp()  # Lazy load yt-dlp
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
-        
-        with ytdlp.YoutubeDL(ydl_opts) as ydl:
+        # Rate limited per platform; fails fast while the platform's circuit is open
+        with platform_guard.guard(platform), metrics.time('extract', platform=platform), \
+                ydl_pool.checkout((platform,), lambda: dict(ydl_opts)) as ydl:
             info = ydl.extract_info(url, download=False)
-            
-            formats = []
-            if 'formats' in info:
-                for fmt in info['formats']:
-                    if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':  # Video with audio
-                        formats.append({
-                            'format_id': fmt.get('format_id'),
-                            'ext': fmt.get('ext', 'mp4'),
-                            'resolution': fmt.get('resolution', 'unknown'),
-                            'quality': fmt.get('quality', 0),
-                            'filesize': fmt.get('filesize', 0),
-                        })
-            
-            return {
-                'title': info.get('title', 'Unknown'),
-                'thumbnail': info.get('thumbnail', ''),
-                'duration': info.get('duration', 0),
-                'formats': formats[:10],  # Limit to 10 formats
-                'platform': platform
-            }
+        
+        formats = rank_formats(info, format_config['merge'], format_config['limit'])
+        
+        video_info = {
+            'title': info.get('title', 'Unknown'),
+            'thumbnail': proxied_thumbnail(platform, url, info.get('thumbnail')),
+            'thumbnail_source': info.get('thumbnail', ''),
+            'duration': info.get('duration', 0),
+            'formats': formats,
+            'audio_formats': audio_pool.formats(info),
+            'platform': platform
+        }
+        metadata_cache.set(cache_key, video_info)
+        return video_info
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
         raise
 
 
+@app.template_global()
+def asset_url(name):
+    """URL of a static asset under its fingerprinted name when it has been built"""
+    return url_for('static', filename=static_assets.resolve(name))
+
+
 @app.route('/')
 def index():
     """Render the main page"""
@@ -141,6 +273,52 @@ def health():
     """Health check endpoint"""
     return jsonify({'status': 'ok', 'message': 'Server is running'}), 200
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics of this instance"""
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def profile_access_error():
+    """Error response when profiles may not be read by this request, else None"""
+    if not profiler.enabled:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER), request.remote_addr,
+                               request.headers.get('X-Forwarded-For')):
+        if profiler.token is None:
+            return jsonify({'error': 'Profiles are only served to localhost unless PROFILE_TOKEN is set'}), 403
+        return jsonify({'error': f'{PROFILE_HEADER} header with the profiling token required'}), 403
+    return None
+
+
+@app.route('/api/profiles')
+def list_profiles():
+    """List recent request profiles of this instance with their timing breakdown, newest first"""
+    error = profile_access_error()
+    if error is not None:
+        return error
+    return jsonify({'profiler': profiler.stats(), 'profiles': profiler.recent()})
+
+
+@app.route('/api/profiles/<profile_id>')
+def profile_detail(profile_id):
+    """Return one profile, or its collapsed stacks for flamegraph tools with ?format=collapsed"""
+    error = profile_access_error()
+    if error is not None:
+        return error
+    if request.args.get('format') == 'collapsed':
+        path = profiler.collapsed_path(profile_id)
+        if path is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        with open(path) as f:
+            return Response(f.read(), mimetype='text/plain')
+    summary = profiler.load(profile_id)
+    if summary is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(summary)
+
 @app.route('/debug')
 def debug():
     """Debug endpoint to check system status"""
@@ -157,6 +335,8 @@ def debug():
             'static_path': static_path,
             'template_path': template_path,
             'yt_dlp_loaded': yt_dlp is not None,
+            'extractors': extractor_set.stats(),
+            'startup': startup.stats(),
             'flask_loaded': 'Flask' in globals(),
             'downloads_dir': DOWNLOADS_DIR,
             'downloads_dir_exists': os.path.exists(DOWNLOADS_DIR)
@@ -176,21 +356,200 @@ def analyze_video():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        platform = detect_platform(url)
-        if platform == 'unknown':
+        parsed = parse_video_url(url)
+        if parsed.platform == 'unknown':
             return jsonify({'error': 'Unsupported platform. Please use YouTube, LinkedIn, X (Twitter), or Instagram.'}), 400
         
-        video_info = get_video_info(url, platform)
+        try:
+            height, codec = preset_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        video_info = get_video_info(parsed.canonical_url, parsed.platform)
+        if height or codec:
+            # Smallest file meeting the requested resolution/codec
+            recommended = smallest_format(video_info['formats'], height, codec)
+            video_info = dict(video_info, recommended=recommended['format_id'] if recommended else None)
         return jsonify(video_info)
         
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         logger.error(f"Error analyzing video: {str(e)}")
         return jsonify({'error': f'Failed to analyze video: {str(e)}'}), 500
 
 
+def expand_playlist(url, platform):
+    """List the entries of a playlist or channel without extracting each video"""
+    options = dict({'quiet': True, 'no_warnings': True}, playlistend=batch_config['max_urls'], **FLAT_PLAYLIST_OPTIONS)
+    with platform_guard.guard(platform), metrics.time('playlist', platform=platform), \
+            ydl_pool.checkout((platform, 'flat'), lambda: options) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many URLs and playlists concurrently, streaming NDJSON as each one finishes"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    
+    if not urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(urls) > batch_config['max_urls']:
+        return jsonify({'error': f"At most {batch_config['max_urls']} URLs per batch"}), 413
+    
+    # Clients may ask for less parallelism than the configured cap, never more
+    try:
+        parallelism = min(int(data.get('parallelism') or batch_config['parallelism']), batch_config['parallelism'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'parallelism must be an integer'}), 400
+    
+    analyzer = BatchAnalyzer(
+        get_video_info, expand_playlist, platform_guard,
+        **dict(batch_config, parallelism=max(parallelism, 1))
+    )
+    return Response(
+        (ndjson(record) for record in analyzer.run(urls)),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Report metadata cache hit/miss counters"""
+    stats = metadata_cache.stats()
+    stats['coalescing'] = dict(analyze_flight.stats(), downloads_deduplicated=download_jobs.deduplicated)
+    stats['downloads'] = artifact_store.stats()
+    stats['partial_downloads'] = partial_downloads.stats()
+    stats['thumbnails'] = thumbnail_cache.stats()
+    stats['ydl_pool'] = ydl_pool.stats()
+    return jsonify(stats)
+
+
+def convert_audio(filename, target, codec, staging_dir, platform):
+    """Remux or transcode a downloaded audio stream on the audio pool, counting the outcome"""
+    try:
+        with metrics.time('postprocess', platform=platform):
+            converted = audio_pool.convert(filename, target, codec, staging_dir)
+    except PostprocessBusy:
+        metrics.inc('fralix_postprocess_total', target=target, result='busy')
+        raise
+    except PostprocessError:
+        metrics.inc('fralix_postprocess_total', target=target, result='error')
+        raise
+    if audio_pool.ffmpeg:
+        metrics.inc('fralix_postprocess_total', target=target, result='done')
+    return converted
+
+
+def request_client():
+    """Client of the current request for per-client bandwidth quotas"""
+    return bandwidth.client(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+
+def perform_download(url, platform, format_id, key, progress_hook=None, client=None, priority=INTERACTIVE):
+    """Download a video into the artifact store and return the stored file's details"""
+    # Download next to whatever an earlier attempt left behind, then publish atomically
+    partial = partial_downloads.start(key, url, format_id)
+    staging_dir = partial['path']
+    audio = audio_target(format_id)
+    if partial['resumed_bytes']:
+        metrics.inc('fralix_download_resumed_bytes_total', partial['resumed_bytes'], platform=platform)
+    # Paced to this download's share of the upstream bandwidth
+    transfer = bandwidth.upstream.open(client, priority)
+    try:
+        # Configure download options
+        ytdlp = get_yt_dlp()  # Lazy load yt-dlp
+        ydl_opts = {
+            'format': download_selector(format_id),
+            'outtmpl': os.path.join(staging_dir, 'media.%(ext)s'),
+            'quiet': False,
+            # Continue .part files and fragments of an earlier attempt
+            'continuedl': True,
+            # Fetch DASH/HLS fragments in parallel instead of one at a time
+            'concurrent_fragment_downloads': bulk_config['fragments'],
+            # Adaptive pairs (e.g. 137+140) end up in MP4 when the codecs allow it
+            'merge_output_format': 'mp4/mkv',
+        }
+        if audio is not None:
+            # The container fixup is ffmpeg work too; the audio pool's remux covers it
+            ydl_opts['fixup'] = 'never'
+        ydl_opts['progress_hooks'] = [partial_downloads.progress_hook(partial), bandwidth.download_hook(transfer)]
+        if progress_hook is not None:
+            ydl_opts['progress_hooks'].append(progress_hook)
+        
+        with platform_guard.guard(platform), metrics.time('download', platform=platform), \
+                extractor_set.build(ytdlp, ydl_opts) as ydl:
+            started = time.perf_counter()
+            info = ydl.extract_info(url, download=True)
+            filename = ydl.prepare_filename(info)
+            elapsed = time.perf_counter() - started
+        
+        # Merged formats may end up with a different extension
+        if not os.path.exists(filename):
+            filename = artifact_store.find_output(staging_dir)
+        
+        if filename and audio is not None:
+            filename = convert_audio(filename, audio, info.get('acodec'), staging_dir, platform)
+        
+        if filename:
+            with metrics.time('publish', platform=platform):
+                artifact = artifact_store.publish(key, filename, info.get('title', 'Unknown'))
+            partial_downloads.finish(partial)
+            if artifact is not None:
+                metrics.record_download(artifact['size'], elapsed, platform=platform)
+                return artifact_result(artifact)
+        raise JobError('Download failed - file not found')
+                
+    except JobError as e:
+        partial_downloads.fail(partial, e)
+        raise
+    except PlatformThrottled as e:
+        raise JobError(str(e), 503, e.retry_after)
+    except PostprocessError as e:
+        partial_downloads.fail(partial, e)
+        raise JobError(str(e), 503 if isinstance(e, PostprocessBusy) else 500)
+    except Exception as e:
+        logger.error(f"Error downloading video: {str(e)}")
+        partial_downloads.fail(partial, e)
+        if is_bot_detection(str(e)):
+            raise JobError(blocked_message(platform), 503, platform_guard.retry_after(platform))
+        raise JobError(f'Download failed: {str(e)}')
+    finally:
+        partial_downloads.release(partial)
+        transfer.close()
+
+
+@app.route('/api/bandwidth')
+def bandwidth_status():
+    """Report bandwidth caps, active transfers and their current rates"""
+    return jsonify(bandwidth.stats())
+
+
+@app.route('/api/platform-status')
+def platform_status():
+    """Report rate limiter and circuit breaker state per platform"""
+    return jsonify(platform_guard.stats())
+
+
+def smallest_format_id(parsed, height, codec):
+    """Resolve the smallest-file preset, exactly when the video was analyzed recently"""
+    cached = metadata_cache.get(metadata_cache.make_key(parsed.platform, parsed.key, VIDEO_INFO_OPTIONS))
+    if cached is not None:
+        fmt = smallest_format(cached['formats'], height, codec)
+        if fmt is not None:
+            return fmt['format_id']
+    # Let yt-dlp apply the same preset while downloading
+    return preset_selector(height, codec, format_config['merge'])
+
+
 @app.route('/api/download', methods=['POST'])
 def download_video():
-    """Download video with specified format"""
+    """Queue a download and return its job ID"""
     try:
         data = request.json
         url = data.get('url', '').strip()
@@ -199,50 +558,287 @@ def download_video():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         
-        platform = detect_platform(url)
-        if platform == 'unknown':
+        parsed = parse_video_url(url)
+        if parsed.platform == 'unknown':
             return jsonify({'error': 'Unsupported platform'}), 400
         
-        # Configure download options
-        ytdlp = get_yt_dlp()  # Lazy load yt-dlp
-        ydl_opts = {
-            'format': format_id if format_id != 'best' else 'best[ext=mp4]/best',
-            'outtmpl': os.path.join(DOWNLOADS_DIR, '%(title)s.%(ext)s'),
-            'quiet': False,
-        }
+        if format_id == 'smallest':
+            try:
+                format_id = smallest_format_id(parsed, *preset_request(data))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        try:
+            # 'audio' and 'audio:m4a' are the same download
+            format_id = audio_pool.format_id(format_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        with ytdlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            
-            # Clean filename
-            safe_filename = re.sub(r'[<>:"/\\|?*]', '', os.path.basename(filename))
-            filepath = os.path.join(DOWNLOADS_DIR, safe_filename)
-            
-            if os.path.exists(filename):
-                if filename != filepath:
-                    os.rename(filename, filepath)
-                return jsonify({
-                    'success': True,
-                    'filename': safe_filename,
-                    'filepath': filepath,
-                    'title': info.get('title', 'Unknown')
-                })
-            else:
-                return jsonify({'error': 'Download failed - file not found'}), 500
+        # Serve straight from the store when this video and format was already downloaded
+        key = artifact_key(parsed.platform, parsed.key, format_id)
+        artifact = artifact_store.lookup(key)
+        if artifact is not None:
+            return jsonify(completed_job(artifact_result(artifact)))
+        
+        # Fail fast instead of running work for a platform that is blocking us
+        platform_guard.check(parsed.platform)
+        if audio_target(format_id) is not None and audio_pool.busy():
+            return jsonify({'error': 'Too many audio conversions in progress, please try again shortly'}), 503
+        
+        # Requests for the same video and format join the job already running
+        job = download_jobs.submit(perform_download, parsed.canonical_url, parsed.platform, format_id, key, key=key,
+                                   client=request_client())
+        job['status_url'] = f"/api/jobs/{job['job_id']}"
+        job['events_url'] = f"/api/jobs/{job['job_id']}/events"
+        return jsonify(job), job_http_status(job), job_headers(job)
                 
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error downloading video: {str(e)}")
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 
+def perform_bulk_download(targets, format_id, progress_hook=None, client=None):
+    """Download several videos (expanding playlists) in parallel into the artifact store"""
+    videos = []
+    for url, platform, video_id in targets:
+        if video_id is None:
+            # Possibly a playlist or channel: download its entries instead
+            try:
+                entries = playlist_entries(expand_playlist(url, platform))
+            except PlatformThrottled as e:
+                raise JobError(str(e), 503, e.retry_after)
+            except Exception as e:
+                raise JobError(f'Could not list playlist: {str(e)}', 502)
+            if entries:
+                for entry_url in entries:
+                    parsed = parse_video_url(entry_url)
+                    if parsed.platform != 'unknown':
+                        videos.append((parsed.canonical_url, parsed.platform, parsed.key))
+                continue
+            video_id = url
+        videos.append((url, platform, video_id))
+    
+    unique = []
+    for video in videos:
+        if video not in unique:
+            unique.append(video)
+    videos = unique[:bulk_config['max_items']]
+    if not videos:
+        raise JobError('No videos found to download', 404)
+    
+    progress = BulkProgress(progress_hook, len(videos))
+    
+    def download_one(index, url, platform, video_id):
+        key = artifact_key(platform, video_id, format_id)
+        artifact = artifact_store.lookup(key)
+        if artifact is not None:
+            result = artifact_result(artifact)
+        else:
+            result = perform_download(url, platform, format_id, key, progress_hook=progress.item_hook(index),
+                                      client=client, priority=BULK)
+        progress.item_done(index, result['filesize'])
+        return result
+    
+    items = [None] * len(videos)
+    errors = []
+    with ThreadPoolExecutor(max_workers=bulk_config['parallelism'], thread_name_prefix='bulk-item') as executor:
+        futures = {executor.submit(download_one, index, *video): index for index, video in enumerate(videos)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+                items[index] = {
+                    'url': videos[index][0],
+                    'title': result['title'],
+                    'filename': result['filename'],
+                    'filesize': result['filesize'],
+                }
+            except Exception as e:
+                # One failed video does not fail the bundle
+                progress.item_done(index)
+                errors.append(e)
+                items[index] = {'url': videos[index][0], 'error': str(e)}
+    
+    downloaded = [item for item in items if 'filename' in item]
+    if not downloaded:
+        first = errors[0]
+        raise JobError(str(first), getattr(first, 'status', 500), getattr(first, 'retry_after', None))
+    return {
+        'success': True,
+        'items': items,
+        'downloaded': len(downloaded),
+        'failed': len(items) - len(downloaded),
+        'filesize': sum(item['filesize'] for item in downloaded),
+    }
+
+
+@app.route('/api/download/bulk', methods=['POST'])
+def bulk_download():
+    """Queue a download of several videos or playlists, served as one ZIP"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    format_id = data.get('format_id', 'best')
+    if format_id == 'smallest':
+        try:
+            format_id = preset_selector(*preset_request(data), merge=format_config['merge'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    try:
+        format_id = audio_pool.format_id(format_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if not urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(urls) > bulk_config['max_items']:
+        return jsonify({'error': f"At most {bulk_config['max_items']} URLs per bulk download"}), 413
+    
+    targets = []
+    for url in urls:
+        parsed = parse_video_url(url)
+        if parsed.platform == 'unknown':
+            return jsonify({'error': f'Unsupported platform: {url}'}), 400
+        targets.append((parsed.canonical_url, parsed.platform, parsed.video_id))
+    
+    try:
+        for platform in sorted({target[1] for target in targets}):
+            platform_guard.check(platform)
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    
+    try:
+        # The same list of URLs and format joins the bulk job already running
+        key = f"bulk:{format_id}:" + '|'.join(target[0] for target in targets)
+        job = download_jobs.submit(perform_bulk_download, targets, format_id, key=key, client=request_client())
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    job['status_url'] = f"/api/jobs/{job['job_id']}"
+    job['events_url'] = f"/api/jobs/{job['job_id']}/events"
+    job['zip_url'] = f"/api/download-zip/{job['job_id']}"
+    return jsonify(job), job_http_status(job), job_headers(job)
+
+
+@app.route('/api/download-zip/<job_id>')
+def download_zip(job_id):
+    """Stream the videos of a finished bulk job as one ZIP archive"""
+    job = download_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['state'] != FINISHED:
+        return jsonify({'error': 'Bulk download is not finished yet'}), 409
+    if 'items' not in job['result']:
+        return jsonify({'error': 'Not a bulk download job'}), 404
+    
+    artifacts = [artifact_store.resolve(item['filename']) for item in job['result']['items'] if item.get('filename')]
+    artifacts = [artifact for artifact in artifacts if artifact is not None]
+    if not artifacts:
+        return jsonify({'error': 'The downloaded files are no longer available'}), 410
+    
+    # Open every file now: an artifact evicted while the archive streams stays readable
+    names = unique_names([artifact['download_name'] for artifact in artifacts])
+    entries = [(name, open(artifact['path'], 'rb'), artifact['created']) for name, artifact in zip(names, artifacts)]
+    headers = {
+        'Content-Disposition': content_disposition(f"videos-{len(entries)}.zip"),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    response = Response(zip_stream(entries), mimetype='application/zip', headers=headers, direct_passthrough=True)
+    response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client(), BULK))
+    return metrics.track_response(response, 'zip', count_body=True, platform='bulk')
+
+
+def open_stream(url, platform, format_id, client=None):
+    """Resolve a single-file format and open it for pass-through streaming"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'format': download_selector(format_id),
+    }
+    
+    # yt-dlp builds the format selector at construction, so pool per format
+    with platform_guard.guard(platform), metrics.time('stream_open', platform=platform):
+        with ydl_pool.checkout((platform, ydl_opts['format']), lambda: dict(ydl_opts)) as ydl:
+            info = ydl.extract_info(url, download=False)
+        
+        media_url, headers = streamable_format(info)
+        return info, MediaStream(media_url, headers, transfer=bandwidth.upstream.open(client), **stream_settings())
+
+
+@app.route('/api/stream')
+def stream_video():
+    """Stream a single-file format straight to the browser without storing it"""
+    url = request.args.get('url', '').strip()
+    format_id = request.args.get('format_id', 'best')
+    
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    
+    parsed = parse_video_url(url)
+    if parsed.platform == 'unknown':
+        return jsonify({'error': 'Unsupported platform'}), 400
+    
+    try:
+        info, stream = open_stream(parsed.canonical_url, parsed.platform, format_id, request_client())
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        logger.error(f"Error opening stream: {str(e)}")
+        return jsonify({'error': f'Stream failed: {str(e)}'}), 500
+    
+    headers = {
+        'Content-Disposition': content_disposition(
+            download_name(info.get('title', 'Unknown'), f"video.{info.get('ext', 'mp4')}")
+        ),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    if stream.content_length is not None:
+        headers['Content-Length'] = str(stream.content_length)
+    # The stream itself as the body: servers close it even when it is never iterated (disconnect, HEAD)
+    response = Response(stream, mimetype=stream.content_type, headers=headers, direct_passthrough=True)
+    response.call_on_close(stream.close)
+    response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client()))
+    return metrics.track_response(response, 'stream', count_body=True, platform=parsed.platform)
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Report the progress of a download job"""
+    job = download_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the progress of a download job as Server-Sent Events"""
+    return Response(
+        stream_with_context(download_jobs.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/download-file/<filename>')
 def download_file(filename):
     """Serve downloaded file"""
     try:
-        filepath = os.path.join(DOWNLOADS_DIR, filename)
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True)
+        artifact = artifact_store.resolve(filename)
+        if artifact is not None:
+            response = serve_artifact(artifact, **file_offload)
+            response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client()))
+            # Timed until the last byte has left: send_file streams after this returns
+            return metrics.track_response(response, 'serve', platform=artifact['key'].split(':', 1)[0])
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -250,13 +846,40 @@ def download_file(filename):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/static/dist/<path:filename>')
+def built_asset(filename):
+    """Serve a fingerprinted asset, brotli or gzip encoded when accepted, cached for a year"""
+    response = serve_asset(static_assets.dist_dir, filename, request.accept_encodings)
+    if response is None:
+        return jsonify({'error': 'File not found'}), 404
+    return response
+
+
+@app.route('/api/thumbnail/<thumbnail_id>')
+def thumbnail(thumbnail_id):
+    """Serve a video's resized preview thumbnail, fetching it on first use"""
+    entry = thumbnail_cache.lookup(thumbnail_id)
+    if entry is None:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    if entry['path'] is None:
+        try:
+            with metrics.time('thumbnail', platform=entry['platform']):
+                entry = thumbnail_cache.fetch(entry)
+        except ThumbnailError as e:
+            logger.warning(f"Thumbnail {thumbnail_id}: {str(e)}")
+            metrics.inc('fralix_thumbnail_requests_total', result='error')
+            return jsonify({'error': str(e)}), 502
+        metrics.inc('fralix_thumbnail_requests_total', result='fetched')
+    else:
+        metrics.inc('fralix_thumbnail_requests_total', result='hit')
+    return serve_thumbnail(entry, thumbnail_cache.max_age)
+
+
 # Vercel serverless function handler
 # Export the Flask app - Vercel Python runtime will use this
 # The handler variable is what Vercel looks for
-logger.info("Setting handler = app")
 handler = app
-logger.info("Handler set successfully")
 
-# Log that module loaded successfully
-logger.info("Module api/index.py loaded successfully")
+startup.record('module', time.perf_counter() - _MODULE_STARTED)
+logger.info(f"Module api/index.py loaded in {startup.stats()['module']:.3f}s")
 
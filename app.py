@@ -1,11 +1,32 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context, url_for
 from flask_cors import CORS
 import yt_dlp
 import os
-import re
-import tempfile
-from urllib.parse import urlparse, parse_qs
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from fralix.assets import AssetManifest
+from fralix.audio import AudioPool, PostprocessBusy, PostprocessError, audio_target, download_selector
+from fralix.bandwidth import BACKGROUND, BULK, INTERACTIVE, BandwidthManager
+from fralix.batch import FLAT_PLAYLIST_OPTIONS, BatchAnalyzer, batch_settings, ndjson, playlist_entries
+from fralix.bulk import BulkProgress, bulk_settings, unique_names, zip_stream
+from fralix.cache import MetadataCache
+from fralix.fileserve import offload_settings, serve_artifact, serve_asset, serve_thumbnail
+from fralix.formats import format_settings, likely_format, preset_request, preset_selector, rank_formats, smallest_format
+from fralix.jobs import FINISHED, JobError, JobManager, QueueFull, completed_job, job_headers, job_http_status
+from fralix.metrics import Metrics, instrument_app, register_service_collectors
+from fralix.prefetch import PrefetchCancelled, Prefetcher
+from fralix.profiling import PROFILE_HEADER, Profiler, profile_app
+from fralix.ratelimit import PlatformGuard, PlatformThrottled, blocked_message, is_bot_detection
+from fralix.resume import PartialDownloads
+from fralix.singleflight import SingleFlight
+from fralix.store import ArtifactStore, artifact_key, artifact_result, download_name
+from fralix.streaming import MediaStream, StreamError, content_disposition, stream_settings, streamable_format
+from fralix.thumbnails import ThumbnailCache, ThumbnailError
+from fralix.urls import parse_video_url, video_key
+from fralix.workqueue import WorkQueue
+from fralix.ydl_pool import YDLPool
 
 app = Flask(__name__)
 CORS(app)
@@ -18,21 +39,72 @@ logger = logging.getLogger(__name__)
 DOWNLOADS_DIR = os.path.join(os.getcwd(), 'downloads')
 os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
+# Finished downloads, keyed by video and format and bounded by a disk quota
+artifact_store = ArtifactStore.from_env(DOWNLOADS_DIR, default_quota=5 * 1024 ** 3)
 
-def detect_platform(url):
-    """Detect which platform the URL belongs to"""
-    url_lower = url.lower()
-    
-    if 'youtube.com' in url_lower or 'youtu.be' in url_lower:
-        return 'youtube'
-    elif 'linkedin.com' in url_lower:
-        return 'linkedin'
-    elif 'twitter.com' in url_lower or 'x.com' in url_lower:
-        return 'twitter'
-    elif 'instagram.com' in url_lower:
-        return 'instagram'
-    else:
-        return 'unknown'
+# Unfinished downloads, resumed by the next attempt at the same video and format
+partial_downloads = PartialDownloads.from_env(os.path.join(DOWNLOADS_DIR, '.partial'))
+
+# Resized preview thumbnails served by /api/thumbnail instead of the platforms' full-size ones
+thumbnail_cache = ThumbnailCache.from_env(os.path.join(os.getcwd(), 'cache', 'thumbnails'), default_quota=64 * 1024 ** 2)
+
+# Fingerprinted, precompressed CSS/JS built by `python -m fralix.assets`; plain files until then
+static_assets = AssetManifest(app.static_folder)
+
+# Optionally let nginx (X-Accel-Redirect) or Apache (X-Sendfile) push the file bytes
+file_offload = offload_settings()
+app.config['USE_X_SENDFILE'] = file_offload['offload'] == 'sendfile'
+
+# Extraction results shared by all gunicorn workers
+metadata_cache = MetadataCache.from_env(os.path.join(os.getcwd(), 'cache'))
+
+# Durable queue consumed by worker.py processes (WORKER_QUEUE); None runs downloads in this process
+job_queue = WorkQueue.from_env(os.path.join(os.getcwd(), 'cache', 'queue'))
+
+# Downloads run on a bounded background pool, or on the worker tier; /api/download only enqueues them
+download_jobs = JobManager.from_env(os.path.join(os.getcwd(), 'cache', 'jobs'), queue=job_queue)
+
+# Speculative downloads of the likely format right after an analysis (PREFETCH), joined by /api/download
+prefetcher = Prefetcher.from_env(os.path.join(os.getcwd(), 'cache'), download_jobs.state_dir, job_queue)
+
+# Outbound extraction rate limits and bot-detection circuit breakers, shared by all workers
+platform_guard = PlatformGuard.from_env(os.path.join(os.getcwd(), 'cache'))
+
+# Warm YoutubeDL instances reused across extractions in this worker
+ydl_pool = YDLPool.from_env(lambda options: yt_dlp.YoutubeDL(options))
+
+# Identical analyze requests in flight at the same time share one extraction
+analyze_flight = SingleFlight()
+
+# Size and parallelism limits of /api/analyze/batch
+batch_config = batch_settings()
+
+# Item parallelism of bulk downloads and fragment concurrency of every download
+bulk_config = bulk_settings()
+
+# Formats offered by /api/analyze; adaptive video+audio pairs only when ffmpeg can merge them
+format_config = format_settings()
+
+# ffmpeg conversions of audio-only downloads, on a process pool apart from the web workers
+audio_pool = AudioPool.from_env()
+
+# Upstream (yt-dlp) and downstream (file serving) caps, shared fairly by transfers and workers
+bandwidth = BandwidthManager.from_env(os.path.join(os.getcwd(), 'cache'))
+
+# Prometheus metrics at /metrics, aggregated over all gunicorn workers
+metrics = Metrics.from_env(os.path.join(os.getcwd(), 'cache'))
+instrument_app(app, metrics)
+register_service_collectors(metrics, download_jobs, analyze_flight, ydl_pool, metadata_cache, artifact_store, platform_guard)
+metrics.collector(bandwidth.samples)
+metrics.collector(audio_pool.samples)
+metrics.collector(prefetcher.samples, shared=True)
+if job_queue is not None:
+    metrics.collector(job_queue.samples, shared=True)
+
+# Sampled request profiles (PROFILE_SAMPLE_RATE or PROFILE_TOKEN), listed at /api/profiles
+profiler = Profiler.from_env(os.path.join(os.getcwd(), 'cache'))
+profile_app(app, profiler)
+metrics.on_phase(profiler.record_phase)
 
 
 def get_ytdlp_options(platform='youtube'):
@@ -47,6 +119,8 @@ def get_ytdlp_options(platform='youtube'):
         'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     ]
     
+    cookie_file = os.path.join(os.getcwd(), 'cookies.txt')
+    
     options = {
         'quiet': True,
         'no_warnings': True,
@@ -55,7 +129,7 @@ def get_ytdlp_options(platform='youtube'):
         'user_agent': random.choice(user_agents),
         'referer': 'https://www.youtube.com/',
         # Try to use cookies from browser if available (optional)
-        'cookiefile': os.path.join(os.getcwd(), 'cookies.txt') if os.path.exists(os.path.join(os.getcwd(), 'cookies.txt')) else None,
+        'cookiefile': cookie_file if os.path.exists(cookie_file) else None,
         # Additional headers to appear more like a browser
         'http_headers': {
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
@@ -86,57 +160,62 @@ def get_ytdlp_options(platform='youtube'):
 
 def get_video_info(url, platform):
     """Get video information without downloading"""
-    import time
+    cache_key = metadata_cache.make_key(platform, video_key(url, platform), get_ytdlp_options(platform))
+    cached = metadata_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Metadata cache hit for {cache_key}")
+        return cached
     
+    # Concurrent requests for the same video share a single extraction
+    return analyze_flight.do(cache_key, extract_video_info, url, platform, cache_key)
+
+
+def proxied_thumbnail(platform, url, source):
+    """/api/thumbnail URL of a video's preview, or the platform's own URL when it is not proxied"""
+    thumb_id = thumbnail_cache.register(platform, video_key(url, platform), source)
+    return f'/api/thumbnail/{thumb_id}' if thumb_id else (source or '')
+
+
+def extract_video_info(url, platform, cache_key):
+    """Extract video information with yt-dlp and cache it"""
     max_retries = 2
-    retry_delay = 2  # seconds
     
     for attempt in range(max_retries):
         try:
-            ydl_opts = get_ytdlp_options(platform)
+            # Rate limited per platform; fails fast while the platform's circuit is open
+            with platform_guard.guard(platform), metrics.time('extract', platform=platform):
+                # Warm instance from the pool; a failed attempt discards it so the retry starts fresh
+                with ydl_pool.checkout((platform,), lambda: get_ytdlp_options(platform)) as ydl:
+                    info = ydl.extract_info(url, download=False)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                formats = []
-                if 'formats' in info:
-                    for fmt in info['formats']:
-                        if fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none':  # Video with audio
-                            formats.append({
-                                'format_id': fmt.get('format_id'),
-                                'ext': fmt.get('ext', 'mp4'),
-                                'resolution': fmt.get('resolution', 'unknown'),
-                                'quality': fmt.get('quality', 0),
-                                'filesize': fmt.get('filesize', 0),
-                            })
-                
-                return {
-                    'title': info.get('title', 'Unknown'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': info.get('duration', 0),
-                    'formats': formats[:10],  # Limit to 10 formats
-                    'platform': platform
-                }
+            formats = rank_formats(info, format_config['merge'], format_config['limit'])
+            
+            video_info = {
+                'title': info.get('title', 'Unknown'),
+                'thumbnail': proxied_thumbnail(platform, url, info.get('thumbnail')),
+                'thumbnail_source': info.get('thumbnail', ''),
+                'duration': info.get('duration', 0),
+                'formats': formats,
+                'audio_formats': audio_pool.formats(info),
+                'platform': platform
+            }
+            metadata_cache.set(cache_key, video_info)
+            return video_info
+        except PlatformThrottled:
+            raise
         except Exception as e:
             error_msg = str(e)
             logger.error(f"Error getting video info (attempt {attempt + 1}/{max_retries}): {error_msg}")
             
-            # Check for YouTube bot detection error
-            if 'bot' in error_msg.lower() or 'cookies' in error_msg.lower() or 'Sign in to confirm' in error_msg:
+            # Check for bot detection error
+            if is_bot_detection(error_msg):
                 if attempt < max_retries - 1:
-                    # Wait before retry
-                    logger.info(f"Bot detection triggered, retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                    # Retry at once with a fresh client; the circuit breaker stops this if blocking persists
+                    logger.info("Bot detection triggered, retrying with a fresh client...")
+                    metrics.inc('fralix_extraction_retries_total', platform=platform, operation='analyze')
                     continue
                 else:
-                    # Final attempt failed
-                    raise Exception(
-                        "YouTube is blocking automated access. "
-                        "This is a known limitation. Solutions:\n"
-                        "1. Try again in a few minutes\n"
-                        "2. Some videos may require authentication\n"
-                        "3. YouTube's bot detection is very aggressive"
-                    )
+                    raise PlatformThrottled(blocked_message(platform), platform_guard.retry_after(platform))
             # For other errors, raise immediately
             raise
     
@@ -144,120 +223,678 @@ def get_video_info(url, platform):
     raise Exception("Failed to get video info after retries")
 
 
+@app.template_global()
+def asset_url(name):
+    """URL of a static asset under its fingerprinted name when it has been built"""
+    return url_for('static', filename=static_assets.resolve(name))
+
+
 @app.route('/')
 def index():
     """Render the main page"""
     return render_template('index.html')
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_video():
-    """Analyze video URL and return information"""
+def analyze_request(data, client=None):
+    """Analyze the video in a request body for client; returns (body, status, headers) for Flask or asgi.py"""
     try:
-        data = request.json
         url = data.get('url', '').strip()
         
         if not url:
-            return jsonify({'error': 'URL is required'}), 400
+            return {'error': 'URL is required'}, 400, {}
+        
+        parsed = parse_video_url(url)
+        if parsed.platform == 'unknown':
+            return {'error': 'Unsupported platform. Please use YouTube, LinkedIn, X (Twitter), or Instagram.'}, 400, {}
         
-        platform = detect_platform(url)
-        if platform == 'unknown':
-            return jsonify({'error': 'Unsupported platform. Please use YouTube, LinkedIn, X (Twitter), or Instagram.'}), 400
+        try:
+            height, codec = preset_request(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400, {}
         
-        video_info = get_video_info(url, platform)
-        return jsonify(video_info)
+        video_info = get_video_info(parsed.canonical_url, parsed.platform)
+        if height or codec:
+            # Smallest file meeting the requested resolution/codec
+            recommended = smallest_format(video_info['formats'], height, codec)
+            video_info = dict(video_info, recommended=recommended['format_id'] if recommended else None)
+        if prefetcher.enabled:
+            prefetch = start_prefetch(parsed, video_info, client)
+            if prefetch is not None:
+                video_info = dict(video_info, prefetch=prefetch)
+        return video_info, 200, {}
         
+    except PlatformThrottled as e:
+        return {'error': str(e)}, 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error analyzing video: {error_msg}")
         
         # Check for YouTube bot detection error
-        if 'bot' in error_msg.lower() or 'cookies' in error_msg.lower() or 'Sign in to confirm' in error_msg:
-            return jsonify({
+        if is_bot_detection(error_msg):
+            return {
                 'error': 'YouTube is temporarily blocking automated access. Please try again in a few minutes.'
-            }), 503  # Service Unavailable
+            }, 503, {}  # Service Unavailable
         
-        return jsonify({'error': f'Failed to analyze video: {error_msg}'}), 500
+        return {'error': f'Failed to analyze video: {error_msg}'}, 500, {}
 
 
-@app.route('/api/download', methods=['POST'])
-def download_video():
-    """Download video with specified format"""
-    data = request.json
+@app.route('/api/analyze', methods=['POST'])
+def analyze_video():
+    """Analyze video URL and return information"""
+    body, status, headers = analyze_request(request.get_json(silent=True) or {}, request_client())
+    return jsonify(body), status, headers
+
+
+def expand_playlist(url, platform):
+    """List the entries of a playlist or channel without extracting each video"""
+    options = dict(get_ytdlp_options(platform), playlistend=batch_config['max_urls'], **FLAT_PLAYLIST_OPTIONS)
+    with platform_guard.guard(platform), metrics.time('playlist', platform=platform):
+        with ydl_pool.checkout((platform, 'flat'), lambda: options) as ydl:
+            return ydl.extract_info(url, download=False)
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many URLs and playlists concurrently, streaming NDJSON as each one finishes"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    
+    if not urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(urls) > batch_config['max_urls']:
+        return jsonify({'error': f"At most {batch_config['max_urls']} URLs per batch"}), 413
+    
+    # Clients may ask for less parallelism than the configured cap, never more
+    try:
+        parallelism = min(int(data.get('parallelism') or batch_config['parallelism']), batch_config['parallelism'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'parallelism must be an integer'}), 400
+    
+    analyzer = BatchAnalyzer(
+        get_video_info, expand_playlist, platform_guard,
+        **dict(batch_config, parallelism=max(parallelism, 1))
+    )
+    return Response(
+        (ndjson(record) for record in analyzer.run(urls)),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Report metadata cache hit/miss counters"""
+    stats = metadata_cache.stats()
+    stats['coalescing'] = dict(analyze_flight.stats(), downloads_deduplicated=download_jobs.deduplicated)
+    stats['downloads'] = artifact_store.stats()
+    stats['partial_downloads'] = partial_downloads.stats()
+    stats['thumbnails'] = thumbnail_cache.stats()
+    stats['ydl_pool'] = ydl_pool.stats()
+    stats['prefetch'] = prefetcher.stats()
+    if job_queue is not None:
+        stats['queue'] = job_queue.stats()
+    return jsonify(stats)
+
+
+def request_client():
+    """Client of the current request for per-client bandwidth quotas"""
+    return bandwidth.client(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+
+def convert_audio(filename, target, codec, staging_dir, platform):
+    """Remux or transcode a downloaded audio stream on the audio pool, counting the outcome"""
+    try:
+        with metrics.time('postprocess', platform=platform):
+            converted = audio_pool.convert(filename, target, codec, staging_dir)
+    except PostprocessBusy:
+        metrics.inc('fralix_postprocess_total', target=target, result='busy')
+        raise
+    except PostprocessError:
+        metrics.inc('fralix_postprocess_total', target=target, result='error')
+        raise
+    if audio_pool.ffmpeg:
+        metrics.inc('fralix_postprocess_total', target=target, result='done')
+    return converted
+
+
+def perform_download(url, platform, format_id, key, progress_hook=None, client=None, priority=INTERACTIVE,
+                     prefetch_id=None):
+    """Download a video into the artifact store and return the stored file's details"""
+    max_retries = 2
+    
+    # Every attempt continues whatever an earlier one (or a dead worker) left
+    # behind for this video and format; the result is published atomically
+    partial = partial_downloads.start(key, url, format_id)
+    staging_dir = partial['path']
+    audio = audio_target(format_id)
+    if partial['resumed_bytes']:
+        metrics.inc('fralix_download_resumed_bytes_total', partial['resumed_bytes'], platform=platform)
+    # Paced to this download's share of the upstream bandwidth
+    transfer = bandwidth.upstream.open(client, priority)
+    try:
+        for attempt in range(max_retries):
+            try:
+                # Configure download options with bot detection bypass
+                ydl_opts = get_ytdlp_options(platform)
+                ydl_opts.update({
+                    'format': download_selector(format_id),
+                    'outtmpl': os.path.join(staging_dir, 'media.%(ext)s'),
+                    'quiet': False,
+                    # Continue .part files and fragments of an earlier attempt
+                    'continuedl': True,
+                    # Fetch DASH/HLS fragments in parallel instead of one at a time
+                    'concurrent_fragment_downloads': bulk_config['fragments'],
+                    # Adaptive pairs (e.g. 137+140) end up in MP4 when the codecs allow it
+                    'merge_output_format': 'mp4/mkv',
+                })
+                if audio is not None:
+                    # The container fixup is ffmpeg work too; the audio pool's remux covers it
+                    ydl_opts['fixup'] = 'never'
+                ydl_opts['progress_hooks'] = [partial_downloads.progress_hook(partial), bandwidth.download_hook(transfer)]
+                if progress_hook is not None:
+                    ydl_opts['progress_hooks'].append(progress_hook)
+                if prefetch_id is not None:
+                    ydl_opts['progress_hooks'].append(prefetcher.progress_hook(prefetch_id, transfer))
+                
+                # Rate limited per platform; fails fast while the platform's circuit is open
+                # A cancelled prefetch stopped on our side: not an answer that may close a half-open circuit
+                with platform_guard.guard(platform, neutral=(PrefetchCancelled,)), \
+                        metrics.time('download', platform=platform):
+                    started = time.perf_counter()
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        info = ydl.extract_info(url, download=True)
+                        filename = ydl.prepare_filename(info)
+                    elapsed = time.perf_counter() - started
+                
+                # Merged formats may end up with a different extension
+                if not os.path.exists(filename):
+                    filename = artifact_store.find_output(staging_dir)
+                
+                if filename and audio is not None:
+                    filename = convert_audio(filename, audio, info.get('acodec'), staging_dir, platform)
+                
+                if filename:
+                    with metrics.time('publish', platform=platform):
+                        artifact = artifact_store.publish(key, filename, info.get('title', 'Unknown'))
+                    partial_downloads.finish(partial)
+                    if artifact is not None:
+                        metrics.record_download(artifact['size'], elapsed, platform=platform)
+                        return artifact_result(artifact)
+                raise JobError('Download failed - file not found')
+                        
+            except JobError:
+                raise
+            except PlatformThrottled as e:
+                raise JobError(str(e), 503, e.retry_after)
+            except PostprocessBusy as e:
+                raise JobError(str(e), 503)
+            except PostprocessError as e:
+                raise JobError(str(e))
+            except PrefetchCancelled as e:
+                raise JobError(str(e), 409)
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"Error downloading video (attempt {attempt + 1}/{max_retries}): {error_msg}")
+                
+                # Check for bot detection error
+                if is_bot_detection(error_msg):
+                    if attempt < max_retries - 1:
+                        # Retry at once with a fresh client; the circuit breaker stops this if blocking persists
+                        logger.info("Bot detection triggered, retrying with a fresh client...")
+                        metrics.inc('fralix_extraction_retries_total', platform=platform, operation='download')
+                        continue
+                    else:
+                        raise JobError(
+                            blocked_message(platform),
+                            503,  # Service Unavailable
+                            platform_guard.retry_after(platform)
+                        )
+                
+                # For other errors, fail immediately
+                raise JobError(f'Download failed: {error_msg}')
+    except JobError as e:
+        # The files stay for the next attempt
+        partial_downloads.fail(partial, e)
+        raise
+    finally:
+        partial_downloads.release(partial)
+        transfer.close()
+    
+    # Should not reach here
+    raise JobError('Download failed after retries')
+
+
+def perform_prefetch(url, platform, format_id, key, prefetch_id, progress_hook=None, client=None):
+    """Download the likely format of an analyzed video before the user picks it"""
+    try:
+        result = perform_download(url, platform, format_id, key, progress_hook, client, BACKGROUND, prefetch_id)
+    except JobError:
+        prefetcher.finished(prefetch_id, success=False)
+        raise
+    prefetcher.finished(prefetch_id, success=True)
+    metrics.inc('fralix_prefetch_total', result='done')
+    return result
+
+
+def start_prefetch(parsed, video_info, client=None):
+    """Start prefetching the format the user most likely picks; returns {'job_id', 'format_id'} or None"""
+    fmt = None
+    if video_info.get('recommended'):
+        fmt = next((f for f in video_info['formats'] if f['format_id'] == video_info['recommended']), None)
+        if fmt is not None and not 0 < (fmt.get('filesize') or 0) <= prefetcher.max_bytes:
+            fmt = None
+    if fmt is None:
+        fmt = likely_format(video_info['formats'], prefetcher.max_bytes)
+    if fmt is None:
+        return None
+    key = artifact_key(parsed.platform, parsed.key, fmt['format_id'])
+    if artifact_store.lookup(key) is not None:
+        return None
+    try:
+        # Guesses are the first thing to give up while a platform is throttling us
+        platform_guard.check(parsed.platform)
+    except PlatformThrottled:
+        return None
+    prefetch = prefetcher.start(fmt, key, f"{parsed.platform}:{parsed.key}", lambda prefetch_id: prefetcher.jobs.submit(
+        perform_prefetch, parsed.canonical_url, parsed.platform, fmt['format_id'], key, prefetch_id,
+        key=key, client=client
+    ))
+    metrics.inc('fralix_prefetch_total', result='started' if prefetch is not None else 'skipped')
+    return prefetch
+
+
+@app.route('/api/prefetch/<job_id>/cancel', methods=['POST'])
+def cancel_prefetch(job_id):
+    """Stop a prefetch the user did not want (the format modal was closed)"""
+    cancelled = prefetcher.cancel(job_id)
+    if cancelled:
+        metrics.inc('fralix_prefetch_total', result='cancelled')
+    return jsonify({'job_id': job_id, 'cancelled': cancelled})
+
+
+@app.route('/api/bandwidth')
+def bandwidth_status():
+    """Report bandwidth caps, active transfers and their current rates"""
+    return jsonify(bandwidth.stats())
+
+
+@app.route('/api/platform-status')
+def platform_status():
+    """Report rate limiter and circuit breaker state per platform"""
+    return jsonify(platform_guard.stats())
+
+
+def smallest_format_id(parsed, height, codec):
+    """Resolve the smallest-file preset, exactly when the video was analyzed recently"""
+    cached = metadata_cache.get(metadata_cache.make_key(parsed.platform, parsed.key, get_ytdlp_options(parsed.platform)))
+    if cached is not None:
+        fmt = smallest_format(cached['formats'], height, codec)
+        if fmt is not None:
+            return fmt['format_id']
+    # Let yt-dlp apply the same preset while downloading
+    return preset_selector(height, codec, format_config['merge'])
+
+
+def download_request(data, client=None):
+    """Queue the download in a request body for client; returns (body, status, headers)"""
     url = data.get('url', '').strip()
     format_id = data.get('format_id', 'best')
     
     if not url:
-        return jsonify({'error': 'URL is required'}), 400
+        return {'error': 'URL is required'}, 400, {}
     
-    platform = detect_platform(url)
-    if platform == 'unknown':
-        return jsonify({'error': 'Unsupported platform'}), 400
+    parsed = parse_video_url(url)
+    if parsed.platform == 'unknown':
+        return {'error': 'Unsupported platform'}, 400, {}
     
-    # Configure download options with bot detection bypass
-    import time
+    if format_id == 'smallest':
+        try:
+            format_id = smallest_format_id(parsed, *preset_request(data))
+        except ValueError as e:
+            return {'error': str(e)}, 400, {}
+    try:
+        # 'audio' and 'audio:m4a' are the same download
+        format_id = audio_pool.format_id(format_id)
+    except ValueError as e:
+        return {'error': str(e)}, 400, {}
     
-    max_retries = 2
-    retry_delay = 2
+    # Serve straight from the store when this video and format was already downloaded
+    key = artifact_key(parsed.platform, parsed.key, format_id)
+    if prefetcher.enabled:
+        # The guess was right (the prefetch now runs at full priority) or wrong (its download stops)
+        if prefetcher.adopt(key):
+            metrics.inc('fralix_prefetch_total', result='adopted')
+        cancelled = prefetcher.cancel_others(f"{parsed.platform}:{parsed.key}", key)
+        if cancelled:
+            metrics.inc('fralix_prefetch_total', cancelled, result='cancelled')
+    artifact = artifact_store.lookup(key)
+    if artifact is not None:
+        return completed_job(artifact_result(artifact)), 200, {}
     
-    for attempt in range(max_retries):
+    try:
+        # Fail fast instead of queueing work for a platform that is blocking us
+        platform_guard.check(parsed.platform)
+    except PlatformThrottled as e:
+        return {'error': str(e)}, 503, {'Retry-After': str(e.retry_after)}
+    if audio_target(format_id) is not None and audio_pool.busy():
+        return {'error': 'Too many audio conversions in progress, please try again shortly'}, 503, {}
+    
+    try:
+        # Requests for the same video and format join the job already running
+        job = download_jobs.submit(
+            perform_download, parsed.canonical_url, parsed.platform, format_id, key,
+            key=key, client=client
+        )
+    except QueueFull as e:
+        return {'error': str(e)}, 503, {}
+    
+    job['status_url'] = f"/api/jobs/{job['job_id']}"
+    job['events_url'] = f"/api/jobs/{job['job_id']}/events"
+    return job, job_http_status(job), job_headers(job)
+
+
+@app.route('/api/download', methods=['POST'])
+def download_video():
+    """Queue a download and return its job ID"""
+    body, status, headers = download_request(request.get_json(silent=True) or {}, request_client())
+    return jsonify(body), status, headers
+
+
+def perform_bulk_download(targets, format_id, progress_hook=None, client=None):
+    """Download several videos (expanding playlists) in parallel into the artifact store"""
+    videos = []
+    for url, platform, video_id in targets:
+        if video_id is None:
+            # Possibly a playlist or channel: download its entries instead
+            try:
+                entries = playlist_entries(expand_playlist(url, platform))
+            except PlatformThrottled as e:
+                raise JobError(str(e), 503, e.retry_after)
+            except Exception as e:
+                raise JobError(f'Could not list playlist: {str(e)}', 502)
+            if entries:
+                for entry_url in entries:
+                    parsed = parse_video_url(entry_url)
+                    if parsed.platform != 'unknown':
+                        videos.append((parsed.canonical_url, parsed.platform, parsed.key))
+                continue
+            video_id = url
+        videos.append((url, platform, video_id))
+    
+    unique = []
+    for video in videos:
+        if video not in unique:
+            unique.append(video)
+    videos = unique[:bulk_config['max_items']]
+    if not videos:
+        raise JobError('No videos found to download', 404)
+    
+    progress = BulkProgress(progress_hook, len(videos))
+    
+    def download_one(index, url, platform, video_id):
+        key = artifact_key(platform, video_id, format_id)
+        artifact = artifact_store.lookup(key)
+        if artifact is not None:
+            result = artifact_result(artifact)
+        else:
+            result = perform_download(url, platform, format_id, key, progress_hook=progress.item_hook(index),
+                                      client=client, priority=BULK)
+        progress.item_done(index, result['filesize'])
+        return result
+    
+    items = [None] * len(videos)
+    errors = []
+    with ThreadPoolExecutor(max_workers=bulk_config['parallelism'], thread_name_prefix='bulk-item') as executor:
+        futures = {executor.submit(download_one, index, *video): index for index, video in enumerate(videos)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+                items[index] = {
+                    'url': videos[index][0],
+                    'title': result['title'],
+                    'filename': result['filename'],
+                    'filesize': result['filesize'],
+                }
+            except Exception as e:
+                # One failed video does not fail the bundle
+                progress.item_done(index)
+                errors.append(e)
+                items[index] = {'url': videos[index][0], 'error': str(e)}
+    
+    downloaded = [item for item in items if 'filename' in item]
+    if not downloaded:
+        first = errors[0]
+        raise JobError(str(first), getattr(first, 'status', 500), getattr(first, 'retry_after', None))
+    return {
+        'success': True,
+        'items': items,
+        'downloaded': len(downloaded),
+        'failed': len(items) - len(downloaded),
+        'filesize': sum(item['filesize'] for item in downloaded),
+    }
+
+
+@app.route('/api/download/bulk', methods=['POST'])
+def bulk_download():
+    """Queue a download of several videos or playlists, served as one ZIP"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()]
+    format_id = data.get('format_id', 'best')
+    if format_id == 'smallest':
         try:
-            ydl_opts = get_ytdlp_options(platform)
-            ydl_opts.update({
-                'format': format_id if format_id != 'best' else 'best[ext=mp4]/best',
-                'outtmpl': os.path.join(DOWNLOADS_DIR, '%(title)s.%(ext)s'),
-                'quiet': False,
-            })
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                # Clean filename
-                safe_filename = re.sub(r'[<>:"/\\|?*]', '', os.path.basename(filename))
-                filepath = os.path.join(DOWNLOADS_DIR, safe_filename)
-                
-                if os.path.exists(filename):
-                    if filename != filepath:
-                        os.rename(filename, filepath)
-                    return jsonify({
-                        'success': True,
-                        'filename': safe_filename,
-                        'filepath': filepath,
-                        'title': info.get('title', 'Unknown')
-                    })
-                else:
-                    return jsonify({'error': 'Download failed - file not found'}), 500
-                    
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Error downloading video (attempt {attempt + 1}/{max_retries}): {error_msg}")
-            
-            # Check for YouTube bot detection error
-            if 'bot' in error_msg.lower() or 'cookies' in error_msg.lower() or 'sign in to confirm' in error_msg.lower():
-                if attempt < max_retries - 1:
-                    logger.info(f"Bot detection triggered, retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    return jsonify({
-                        'error': 'YouTube is blocking automated access. Please try again in a few minutes or use a different video.'
-                    }), 503  # Service Unavailable
-            
-            # For other errors, return immediately
-            return jsonify({'error': f'Download failed: {error_msg}'}), 500
+            format_id = preset_selector(*preset_request(data), merge=format_config['merge'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    try:
+        format_id = audio_pool.format_id(format_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Should not reach here
-    return jsonify({'error': 'Download failed after retries'}), 500
+    if not urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(urls) > bulk_config['max_items']:
+        return jsonify({'error': f"At most {bulk_config['max_items']} URLs per bulk download"}), 413
+    
+    targets = []
+    for url in urls:
+        parsed = parse_video_url(url)
+        if parsed.platform == 'unknown':
+            return jsonify({'error': f'Unsupported platform: {url}'}), 400
+        targets.append((parsed.canonical_url, parsed.platform, parsed.video_id))
+    
+    try:
+        for platform in sorted({target[1] for target in targets}):
+            platform_guard.check(platform)
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    
+    try:
+        # The same list of URLs and format joins the bulk job already running
+        key = f"bulk:{format_id}:" + '|'.join(target[0] for target in targets)
+        job = download_jobs.submit(perform_bulk_download, targets, format_id, key=key, client=request_client())
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    job['status_url'] = f"/api/jobs/{job['job_id']}"
+    job['events_url'] = f"/api/jobs/{job['job_id']}/events"
+    job['zip_url'] = f"/api/download-zip/{job['job_id']}"
+    return jsonify(job), job_http_status(job), job_headers(job)
+
+
+@app.route('/api/download-zip/<job_id>')
+def download_zip(job_id):
+    """Stream the videos of a finished bulk job as one ZIP archive"""
+    job = download_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['state'] != FINISHED:
+        return jsonify({'error': 'Bulk download is not finished yet'}), 409
+    if 'items' not in job['result']:
+        return jsonify({'error': 'Not a bulk download job'}), 404
+    
+    artifacts = [artifact_store.resolve(item['filename']) for item in job['result']['items'] if item.get('filename')]
+    artifacts = [artifact for artifact in artifacts if artifact is not None]
+    if not artifacts:
+        return jsonify({'error': 'The downloaded files are no longer available'}), 410
+    
+    # Open every file now: an artifact evicted while the archive streams stays readable
+    names = unique_names([artifact['download_name'] for artifact in artifacts])
+    entries = [(name, open(artifact['path'], 'rb'), artifact['created']) for name, artifact in zip(names, artifacts)]
+    headers = {
+        'Content-Disposition': content_disposition(f"videos-{len(entries)}.zip"),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    response = Response(zip_stream(entries), mimetype='application/zip', headers=headers, direct_passthrough=True)
+    response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client(), BULK))
+    return metrics.track_response(response, 'zip', count_body=True, platform='bulk')
+
+
+def open_stream(url, platform, format_id, client=None):
+    """Resolve a single-file format and open it for pass-through streaming"""
+    format_spec = download_selector(format_id)
+    
+    def make_options():
+        ydl_opts = get_ytdlp_options(platform)
+        ydl_opts['format'] = format_spec
+        return ydl_opts
+    
+    # yt-dlp builds the format selector at construction, so pool per format
+    with platform_guard.guard(platform), metrics.time('stream_open', platform=platform):
+        with ydl_pool.checkout((platform, format_spec), make_options) as ydl:
+            info = ydl.extract_info(url, download=False)
+        
+        media_url, headers = streamable_format(info)
+        return info, MediaStream(media_url, headers, transfer=bandwidth.upstream.open(client), **stream_settings())
+
+
+@app.route('/api/stream')
+def stream_video():
+    """Stream a single-file format straight to the browser without storing it"""
+    url = request.args.get('url', '').strip()
+    format_id = request.args.get('format_id', 'best')
+    
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    
+    parsed = parse_video_url(url)
+    if parsed.platform == 'unknown':
+        return jsonify({'error': 'Unsupported platform'}), 400
+    
+    try:
+        info, stream = open_stream(parsed.canonical_url, parsed.platform, format_id, request_client())
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    except PlatformThrottled as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"Error opening stream: {error_msg}")
+        if is_bot_detection(error_msg):
+            return jsonify({
+                'error': 'YouTube is temporarily blocking automated access. Please try again in a few minutes.'
+            }), 503
+        return jsonify({'error': f'Stream failed: {error_msg}'}), 500
+    
+    headers = {
+        'Content-Disposition': content_disposition(
+            download_name(info.get('title', 'Unknown'), f"video.{info.get('ext', 'mp4')}")
+        ),
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    if stream.content_length is not None:
+        headers['Content-Length'] = str(stream.content_length)
+    # The stream itself as the body: servers close it even when it is never iterated (disconnect, HEAD)
+    response = Response(stream, mimetype=stream.content_type, headers=headers, direct_passthrough=True)
+    response.call_on_close(stream.close)
+    response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client()))
+    return metrics.track_response(response, 'stream', count_body=True, platform=parsed.platform)
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Report the progress of a download job"""
+    job = download_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the progress of a download job as Server-Sent Events"""
+    return Response(
+        stream_with_context(download_jobs.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics of all workers"""
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def profile_access_error():
+    """Error response when profiles may not be read by this request, else None"""
+    if not profiler.enabled:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER), request.remote_addr,
+                               request.headers.get('X-Forwarded-For')):
+        if profiler.token is None:
+            return jsonify({'error': 'Profiles are only served to localhost unless PROFILE_TOKEN is set'}), 403
+        return jsonify({'error': f'{PROFILE_HEADER} header with the profiling token required'}), 403
+    return None
+
+
+@app.route('/api/profiles')
+def list_profiles():
+    """List recent request profiles with their timing breakdown, newest first"""
+    error = profile_access_error()
+    if error is not None:
+        return error
+    return jsonify({'profiler': profiler.stats(), 'profiles': profiler.recent()})
+
+
+@app.route('/api/profiles/<profile_id>')
+def profile_detail(profile_id):
+    """Return one profile, or its collapsed stacks for flamegraph tools with ?format=collapsed"""
+    error = profile_access_error()
+    if error is not None:
+        return error
+    if request.args.get('format') == 'collapsed':
+        path = profiler.collapsed_path(profile_id)
+        if path is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        with open(path) as f:
+            return Response(f.read(), mimetype='text/plain')
+    summary = profiler.load(profile_id)
+    if summary is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(summary)
 
 
 @app.route('/api/download-file/<filename>')
 def download_file(filename):
     """Serve downloaded file"""
     try:
-        filepath = os.path.join(DOWNLOADS_DIR, filename)
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True)
+        artifact = artifact_store.resolve(filename)
+        if artifact is not None:
+            response = serve_artifact(artifact, **file_offload)
+            response = bandwidth.throttle_response(response, bandwidth.downstream.open(request_client()))
+            # Timed until the last byte has left: send_file streams after this returns
+            return metrics.track_response(response, 'serve', platform=artifact['key'].split(':', 1)[0])
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -265,6 +902,35 @@ def download_file(filename):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/static/dist/<path:filename>')
+def built_asset(filename):
+    """Serve a fingerprinted asset, brotli or gzip encoded when accepted, cached for a year"""
+    response = serve_asset(static_assets.dist_dir, filename, request.accept_encodings)
+    if response is None:
+        return jsonify({'error': 'File not found'}), 404
+    return response
+
+
+@app.route('/api/thumbnail/<thumbnail_id>')
+def thumbnail(thumbnail_id):
+    """Serve a video's resized preview thumbnail, fetching it on first use"""
+    entry = thumbnail_cache.lookup(thumbnail_id)
+    if entry is None:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    if entry['path'] is None:
+        try:
+            with metrics.time('thumbnail', platform=entry['platform']):
+                entry = thumbnail_cache.fetch(entry)
+        except ThumbnailError as e:
+            logger.warning(f"Thumbnail {thumbnail_id}: {str(e)}")
+            metrics.inc('fralix_thumbnail_requests_total', result='error')
+            return jsonify({'error': str(e)}), 502
+        metrics.inc('fralix_thumbnail_requests_total', result='fetched')
+    else:
+        metrics.inc('fralix_thumbnail_requests_total', result='hit')
+    return serve_thumbnail(entry, thumbnail_cache.max_age)
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
 
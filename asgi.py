@@ -0,0 +1,159 @@
+"""
+ASGI entry point (async serving mode)
+/api/analyze, /api/download, job status/events and /api/download-file run
+as async handlers. Their blocking yt-dlp and SQLite calls go to a bounded
+thread pool, and files are streamed without tying up a thread each. Every
+other route is the regular Flask app, run through a2wsgi on its own pool.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --host 0.0.0.0 --port 10000 --workers 2
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker --workers 2
+"""
+import contextlib
+import functools
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as backend
+from fralix.aio import BlockingPool, TrackedResponse, artifact_response, async_settings, job_events
+
+async_config = async_settings()
+
+# yt-dlp extractions, SQLite lookups and job state reads of the async handlers
+blocking = BlockingPool(async_config['blocking_threads'])
+
+metrics = backend.metrics
+
+# File transfers currently being sent by this process
+transfers = [0]
+
+
+@metrics.collector
+def async_samples():
+    return [
+        ('fralix_async_blocking_calls', {}, blocking.in_flight),
+        ('fralix_async_transfers', {}, transfers[0]),
+    ]
+
+
+# flask-cors covers the mounted Flask routes; the async ones need the same headers
+CORS_MIDDLEWARE = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+
+
+def instrumented(rule):
+    """Count and time an async handler like instrument_app does for Flask views"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            # A handler that raises answers 500 through Starlette's error middleware
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                metrics.inc('fralix_http_requests_total', endpoint=rule, method=request.method, status=status)
+                metrics.observe('fralix_http_request_duration_seconds', time.perf_counter() - started, endpoint=rule)
+        return wrapper
+    return decorator
+
+
+def _client(request):
+    """Client of a request for per-client bandwidth quotas"""
+    return backend.bandwidth.client(request.client.host if request.client else None,
+                                    request.headers.get('x-forwarded-for'))
+
+
+async def _json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@instrumented('/api/analyze')
+async def analyze_video(request):
+    """Analyze video URL and return information"""
+    body, status, headers = await blocking.run(backend.analyze_request, await _json_body(request), _client(request))
+    return JSONResponse(body, status, headers)
+
+
+@instrumented('/api/download')
+async def download_video(request):
+    """Queue a download and return its job ID"""
+    body, status, headers = await blocking.run(backend.download_request, await _json_body(request), _client(request))
+    return JSONResponse(body, status, headers)
+
+
+@instrumented('/api/jobs/<job_id>')
+async def job_status(request):
+    """Report the progress of a download job"""
+    job = await blocking.run(backend.download_jobs.get, request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, 404)
+    return JSONResponse(job)
+
+
+@instrumented('/api/jobs/<job_id>/events')
+async def job_event_stream(request):
+    """Stream the progress of a download job as Server-Sent Events"""
+    return StreamingResponse(
+        job_events(backend.download_jobs, request.path_params['job_id'], blocking),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@instrumented('/api/download-file/<filename>')
+async def download_file(request):
+    """Serve downloaded file"""
+    artifact = await blocking.run(backend.artifact_store.resolve, request.path_params['filename'])
+    if artifact is None:
+        return JSONResponse({'error': 'File not found'}, 404)
+    platform = artifact['key'].split(':', 1)[0]
+
+    def finished(size, seconds):
+        transfers[0] -= 1
+        metrics.observe('fralix_phase_duration_seconds', seconds, phase='serve', platform=platform)
+        metrics.inc('fralix_bytes_total', size, direction='served', platform=platform)
+
+    response = artifact_response(artifact, request.headers, **backend.file_offload)
+    transfer = backend.bandwidth.downstream.open(_client(request))
+    try:
+        if not backend.bandwidth.downstream.limited or backend.bandwidth.hand_to_proxy(response.headers, transfer):
+            transfer.close()
+            transfer = None
+    except Exception:
+        transfer.close()
+        raise
+    # Counted once nothing can fail before finished() is guaranteed to run
+    transfers[0] += 1
+    return TrackedResponse(response, finished, transfer)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    blocking.shutdown()
+
+
+application = Starlette(
+    routes=[
+        Route('/api/analyze', analyze_video, methods=['POST', 'OPTIONS'], middleware=CORS_MIDDLEWARE),
+        Route('/api/download', download_video, methods=['POST', 'OPTIONS'], middleware=CORS_MIDDLEWARE),
+        Route('/api/jobs/{job_id}', job_status, middleware=CORS_MIDDLEWARE),
+        Route('/api/jobs/{job_id}/events', job_event_stream, middleware=CORS_MIDDLEWARE),
+        Route('/api/download-file/{filename}', download_file, middleware=CORS_MIDDLEWARE),
+        # Everything else is served by Flask
+        Mount('/', app=WSGIMiddleware(backend.app, workers=async_config['wsgi_threads'])),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,95 @@
+"""
+Bulk download throughput against the local media server
+Downloads a set of fake HLS videos (and plain HTTP files) through
+app.perform_bulk_download with different item parallelism and fragment
+concurrency, each configuration in a fresh process with an empty store,
+then streams the result as a ZIP. Per-connection bandwidth and latency are
+capped by the media server, so throughput should grow with concurrency
+until the machine or the server becomes the bottleneck.
+Usage: python bench/bench_bulk.py [--items 6] [--segments 20] [--segment-kb 512] [--bandwidth 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+# (BULK_PARALLELISM, DOWNLOAD_FRAGMENTS)
+CONFIGURATIONS = ((1, 1), (1, 4), (3, 1), (3, 4), (6, 8))
+
+
+def run_child(urls):
+    """Bulk download urls once, stream the ZIP and print the measurements as JSON"""
+    import app
+    from fralix.bulk import unique_names, zip_stream
+
+    started = time.perf_counter()
+    result = app.perform_bulk_download([(url, 'generic', url) for url in urls], 'best')
+    downloaded = time.perf_counter() - started
+
+    artifacts = [app.artifact_store.resolve(item['filename']) for item in result['items'] if 'filename' in item]
+    names = unique_names([artifact['download_name'] for artifact in artifacts])
+    zip_started = time.perf_counter()
+    zip_bytes = sum(len(chunk) for chunk in zip_stream(
+        [(name, open(artifact['path'], 'rb'), artifact['created']) for name, artifact in zip(names, artifacts)]
+    ))
+    print(json.dumps({
+        'bytes': result['filesize'],
+        'failed': result['failed'],
+        'download_s': downloaded,
+        'zip_s': time.perf_counter() - zip_started,
+        'zip_bytes': zip_bytes,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=6)
+    parser.add_argument('--segments', type=int, default=20, help='HLS segments per video')
+    parser.add_argument('--segment-kb', type=int, default=512)
+    parser.add_argument('--bandwidth', type=float, default=4, help='media server MiB/s per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--urls', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.urls))
+        return
+
+    from media_server import MediaServer
+
+    server = MediaServer(latency=args.latency, bandwidth_mbps=args.bandwidth).start()
+    segment_size = args.segment_kb * 1024
+    # Distinct query strings make every item a different video; one plain HTTP file for good measure
+    urls = [f"{server.hls_url(args.segments, segment_size)}?item={i}" for i in range(args.items - 1)]
+    urls.append(server.url(args.segments * segment_size))
+    total_mb = args.items * args.segments * segment_size / (1024 * 1024)
+    print(f"{args.items} videos, {total_mb:.0f} MiB total, {args.bandwidth or 'unlimited'} MiB/s per connection, "
+          f"{args.latency * 1000:.0f} ms latency")
+    print(f"{'items':>6}{'frags':>7}{'download s':>12}{'MiB/s':>9}{'zip s':>9}{'failed':>8}")
+    for parallelism, fragments in CONFIGURATIONS:
+        with tempfile.TemporaryDirectory() as workdir:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', '--urls', json.dumps(urls)],
+                cwd=workdir, capture_output=True, text=True, check=True,
+                env=dict(os.environ, PYTHONPATH=PROJECT_ROOT,
+                         BULK_PARALLELISM=str(parallelism), DOWNLOAD_FRAGMENTS=str(fragments),
+                         PLATFORM_BURST='1000', PLATFORM_RATE='1000'),
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+        rate = result['bytes'] / (1024 * 1024) / result['download_s']
+        print(f"{parallelism:>6}{fragments:>7}{result['download_s']:>12.2f}{rate:>9.1f}"
+              f"{result['zip_s']:>9.2f}{result['failed']:>8}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for fralix.ratelimit.is_bot_detection
+Bot detection opens a platform's circuit breaker for every user, so the
+classifier is checked first against real yt-dlp messages, blocking and
+not, then timed. Usage: python bench/bench_ratelimit.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fralix.ratelimit import is_bot_detection
+
+CORPUS = [
+    ("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm you’re not a bot. Use --cookies-from-browser or "
+     "--cookies for the authentication. See  https://github.com/yt-dlp/yt-dlp/wiki/FAQ", True),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm you're not a bot. This helps protect our community.", True),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Video unavailable. This content isn't available, try again later.", True),
+    ("ERROR: [Instagram] CxYz123AbC: Requested content is not available, rate-limit reached or login required. "
+     "Use --cookies, --cookies-from-browser, --username and --password", True),
+    ("ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests", True),
+    # Per-video problems that merely mention cookies, bots or sign-in
+    ("ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm your age. This video may be inappropriate for some users. "
+     "Use --cookies-from-browser or --cookies for the authentication.", False),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Join this channel to get access to members-only content like this video. "
+     "Use --cookies-from-browser or --cookies for the authentication.", False),
+    ("WARNING: Failed to load cookies from cookies.txt", False),
+    ("ERROR: unable to download video data: HTTP Error 403: Forbidden (Robots at the bottom of the sea)", False),
+    ("ERROR: [youtube] dQw4w9WgXcQ: Private video. Sign in if you've been granted access to this video", False),
+    ("ERROR: [twitter] 1234567890123456789: No video could be found in this tweet", False),
+]
+
+
+def check_corpus():
+    """Fail loudly if any message is classified the wrong way"""
+    for message, blocked in CORPUS:
+        assert is_bot_detection(message) is blocked, (message, blocked)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_corpus()
+    messages = [message for message, _ in CORPUS]
+
+    def run():
+        for message in messages:
+            is_bot_detection(message)
+
+    best = min(timeit.repeat(run, number=iterations // len(messages) or 1, repeat=5))
+    per_call = best / ((iterations // len(messages) or 1) * len(messages))
+    print(f"{len(messages)} messages, {per_call * 1e6:.2f} us per is_bot_detection call")
+
+
+if __name__ == '__main__':
+    main()
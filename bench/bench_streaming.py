@@ -0,0 +1,130 @@
+"""
+Compare download-then-serve with pass-through streaming
+Serves a fake video from the local media server and fetches it through
+app.py both ways, each mode in a fresh process:
+  file   - perform_download into the artifact store, then read the stored file
+  stream - open_stream and consume the chunks as /api/stream would send them
+Reports time to first byte, total time, peak RSS and peak disk usage.
+Usage: python bench/bench_streaming.py [--size-mb 50] [--bandwidth 20]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskSampler(threading.Thread):
+    """Track the largest size a directory reaches"""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.baseline = directory_size(path)
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, directory_size(self.path) - self.baseline)
+            time.sleep(0.05)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.peak = max(self.peak, directory_size(self.path) - self.baseline)
+
+
+def run_child(mode, url):
+    """Fetch url once in the given mode and print the measurements as JSON"""
+    import app
+
+    sampler = DiskSampler(os.getcwd())
+    sampler.start()
+    started = time.perf_counter()
+    first_byte = None
+    received = 0
+
+    if mode == 'file':
+        result = app.perform_download(url, 'generic', 'best', f'bench:{url}')
+        with open(result['filepath'], 'rb') as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                received += len(chunk)
+    else:
+        _, stream = app.open_stream(url, 'generic', 'best')
+        for chunk in stream:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            received += len(chunk)
+
+    total = time.perf_counter() - started
+    sampler.stop()
+    print(json.dumps({
+        'mode': mode,
+        'bytes': received,
+        'ttfb': first_byte,
+        'total': total,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_disk_mb': sampler.peak / (1024 * 1024),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=50)
+    parser.add_argument('--bandwidth', type=float, default=20, help='media server MiB/s (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--child', choices=('file', 'stream'), help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.url)
+        return
+
+    from media_server import MediaServer
+
+    server = MediaServer(latency=args.latency, bandwidth_mbps=args.bandwidth).start()
+    url = server.url(int(args.size_mb * 1024 * 1024))
+    print(f"{args.size_mb:.0f} MiB at {args.bandwidth or 'unlimited'} MiB/s, {args.latency * 1000:.0f} ms latency")
+    print(f"{'mode':<8}{'ttfb s':>10}{'total s':>10}{'peak RSS MiB':>15}{'peak disk MiB':>15}")
+    for mode in ('file', 'stream'):
+        with tempfile.TemporaryDirectory() as workdir:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', mode, '--url', url],
+                cwd=workdir, capture_output=True, text=True, check=True,
+                env=dict(os.environ, PYTHONPATH=PROJECT_ROOT),
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<8}{result['ttfb']:>10.3f}{result['total']:>10.3f}"
+              f"{result['peak_rss_mb']:>15.1f}{result['peak_disk_mb']:>15.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for fralix.urls.parse_video_url
+Runs the parser over a corpus of real-world URL shapes and reports the mean
+cost per URL. Usage: python bench/bench_urls.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fralix.urls import parse_video_url
+
+CORPUS = [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://youtube.com/watch?v=dQw4w9WgXcQ&t=42s&list=PL1234', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ&si=abc', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ?si=Xyz123&t=5', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ?feature=share', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/live/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf', 'youtube', None),
+    ('https://twitter.com/NASA/status/1234567890123456789', 'twitter', '1234567890123456789'),
+    ('https://x.com/NASA/status/1234567890123456789/video/1', 'twitter', '1234567890123456789'),
+    ('https://mobile.twitter.com/i/web/status/1234567890123456789?s=20', 'twitter', '1234567890123456789'),
+    ('https://www.instagram.com/p/CxYz123AbC/?igsh=abc', 'instagram', 'CxYz123AbC'),
+    ('https://www.instagram.com/reel/CxYz123AbC/', 'instagram', 'CxYz123AbC'),
+    ('https://instagram.com/reels/CxYz123AbC', 'instagram', 'CxYz123AbC'),
+    ('https://www.instagram.com/someuser/reel/CxYz123AbC/', 'instagram', 'CxYz123AbC'),
+    ('https://www.linkedin.com/posts/someone_topic-activity-7123456789012345678-AbCd', 'linkedin', '7123456789012345678'),
+    ('https://www.linkedin.com/feed/update/urn:li:activity:7123456789012345678/', 'linkedin', '7123456789012345678'),
+    ('https://www.linkedin.com/feed/update/urn%3Ali%3Aactivity%3A7123456789012345678', 'linkedin', '7123456789012345678'),
+    ('https://box.com/s/x.com/status/1', 'unknown', None),
+    ('https://example.com/watch?v=dQw4w9WgXcQ', 'unknown', None),
+    ('https://notyoutube.com/watch?v=dQw4w9WgXcQ', 'unknown', None),
+    ('ftp://youtube.com/watch?v=dQw4w9WgXcQ', 'unknown', None),
+]
+
+
+def check_corpus():
+    """Fail loudly if any corpus URL parses to the wrong platform or ID"""
+    for url, platform, video_id in CORPUS:
+        parsed = parse_video_url(url)
+        assert (parsed.platform, parsed.video_id) == (platform, video_id), (url, parsed)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_corpus()
+    urls = [url for url, _, _ in CORPUS]
+
+    def run():
+        for url in urls:
+            parse_video_url(url)
+
+    best = min(timeit.repeat(run, number=iterations // len(urls) or 1, repeat=5))
+    per_url = best / ((iterations // len(urls) or 1) * len(urls))
+    print(f"{len(urls)} URL shapes, {per_url * 1e6:.2f} us per parse_video_url call")
+
+
+if __name__ == '__main__':
+    main()
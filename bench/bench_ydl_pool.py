@@ -0,0 +1,83 @@
+"""
+Per-request YoutubeDL overhead: fresh instance vs pooled instance
+Both modes run the same extraction through a local stub extractor (no
+network), so the difference is the cost of building options and
+constructing/tearing down YoutubeDL on every request.
+Usage: python bench/bench_ydl_pool.py [requests]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+from fralix.ydl_pool import YDLPool
+
+
+class StubIE(InfoExtractor):
+    """Deterministic extractor for stub:<id> URLs"""
+    IE_NAME = 'stub'
+    _VALID_URL = r'stub:(?P<id>\w+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            'id': video_id,
+            'title': f'Stub video {video_id}',
+            'duration': 60,
+            'formats': [
+                {'format_id': str(height), 'url': f'http://127.0.0.1/media/{height}.mp4',
+                 'ext': 'mp4', 'height': height, 'vcodec': 'avc1', 'acodec': 'mp4a', 'tbr': height * 2}
+                for height in (240, 360, 480, 720, 1080)
+            ],
+        }
+
+
+def make_ydl(options):
+    ydl = yt_dlp.YoutubeDL(options)
+    ydl.add_info_extractor(StubIE())
+    return ydl
+
+
+def options():
+    import app
+    return app.get_ytdlp_options('youtube')
+
+
+def fresh(n):
+    for i in range(n):
+        with make_ydl(options()) as ydl:
+            ydl.extract_info(f'stub:v{i}', download=False, ie_key='Stub')
+
+
+def pooled(n, pool):
+    for i in range(n):
+        with pool.checkout(('youtube',), options) as ydl:
+            ydl.extract_info(f'stub:v{i}', download=False, ie_key='Stub')
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    fresh(5)
+    started = time.perf_counter()
+    fresh(n)
+    fresh_ms = (time.perf_counter() - started) / n * 1000
+
+    pool = YDLPool(make_ydl, max_uses=50, max_idle=4)
+    pooled(5, pool)
+    started = time.perf_counter()
+    pooled(n, pool)
+    pooled_ms = (time.perf_counter() - started) / n * 1000
+
+    print(f"{n} extractions via stub extractor")
+    print(f"fresh YoutubeDL per request: {fresh_ms:.2f} ms/request")
+    print(f"pooled YoutubeDL:            {pooled_ms:.2f} ms/request ({fresh_ms / pooled_ms:.1f}x)")
+    print(f"pool stats: {pool.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Offline load test of the HTTP API under gunicorn
+Starts bench/media_server.py and gunicorn (bench/stub_wsgi.py: app.py with
+the stub extractor, so no real platform is contacted) in a scratch
+directory, then drives each scenario at increasing concurrency:
+  analyze        POST /api/analyze for a new video every request (cache miss)
+  analyze-cached POST /api/analyze for the same video (cache hit)
+  download       POST /api/download for a new video, poll the job, fetch the file
+  download-file  GET /api/download-file for an already stored video
+Reports p50/p95/p99 latency, throughput, peak RSS of the gunicorn processes
+and disk used by the scratch directory. --save writes the results as JSON;
+--compare checks them against a saved run and exits 1 on regressions.
+Usage: python bench/loadtest.py [--levels 1,4,16] [--requests 40] [--scenarios analyze,download]
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_streaming import directory_size  # noqa: E402
+
+SCENARIOS = ('analyze', 'analyze-cached', 'download', 'download-file')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def new_video_id():
+    return uuid.uuid4().hex[:11]
+
+
+def watch_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def process_tree_rss(root_pid):
+    """Resident memory in bytes of a process and all its children (Linux /proc)"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+class RSSSampler(threading.Thread):
+    """Track the peak RSS of the server process tree"""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            time.sleep(0.2)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        return max(self.peak, process_tree_rss(self.pid))
+
+
+class Client:
+    """One keep-alive connection per load generator thread"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        return None, b''
+
+    def json(self, method, path, payload=None):
+        status, body = self.request(method, path, payload)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {}
+
+
+def run_analyze(client, context, video_id=None):
+    status, body = client.request('POST', '/api/analyze', {'url': watch_url(video_id or new_video_id())})
+    return status == 200, len(body)
+
+
+def run_analyze_cached(client, context):
+    return run_analyze(client, context, context['hot_id'])
+
+
+def download_video(client, video_id):
+    """Queue a download, wait for the job and return the stored file name"""
+    status, job = client.json('POST', '/api/download', {'url': watch_url(video_id), 'format_id': '18'})
+    while status == 202 or job.get('state') in ('queued', 'running'):
+        time.sleep(0.05)
+        status, job = client.json('GET', f"/api/jobs/{job['job_id']}")
+    if job.get('state') != 'finished':
+        return None
+    return job['result']['filename']
+
+
+def run_download(client, context):
+    filename = download_video(client, new_video_id())
+    if filename is None:
+        return False, 0
+    return run_download_file(client, dict(context, hot_filename=filename))
+
+
+def run_download_file(client, context):
+    status, body = client.request('GET', f"/api/download-file/{context['hot_filename']}")
+    return status == 200, len(body)
+
+
+RUNNERS = {
+    'analyze': run_analyze,
+    'analyze-cached': run_analyze_cached,
+    'download': run_download,
+    'download-file': run_download_file,
+}
+
+
+def run_level(port, scenario, concurrency, requests, context):
+    """Send requests for scenario from concurrency threads; return latencies, errors and bytes"""
+    latencies = []
+    results = {'errors': 0, 'bytes': 0}
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(port)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                ok, size = RUNNERS[scenario](client, context)
+            except Exception:
+                ok, size = False, 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                results['bytes'] += size
+                if not ok:
+                    results['errors'] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), results['errors'], results['bytes'], time.perf_counter() - started
+
+
+def wait_until_up(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def compare(results, baseline, tolerance):
+    """Return human readable regressions of results against a baseline run"""
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        name = f"{result['scenario']} x{result['concurrency']}"
+        if old['p95_ms'] and result['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if old['rps'] and result['rps'] < old['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old['rps']:.1f} -> {result['rps']:.1f} req/s")
+        if result['errors'] > old['errors']:
+            regressions.append(f"{name}: errors {old['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--levels', default='1,4,16', help='comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=40, help='requests per scenario and level')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--size-mb', type=float, default=5, help='size of every stub video')
+    parser.add_argument('--bandwidth', type=float, default=0, help='media server MiB/s per connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.02, help='media server latency per request')
+    parser.add_argument('--extract-latency', type=float, default=0.2, help='simulated platform extraction time')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from --save to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.levels.split(',') if level]
+
+    workdir = tempfile.mkdtemp(prefix='fralix-loadtest-')
+    media_port, app_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([BENCH_DIR, PROJECT_ROOT]),
+        BENCH_MEDIA_SERVER=f'http://127.0.0.1:{media_port}',
+        BENCH_MEDIA_BYTES=str(int(args.size_mb * 1024 * 1024)),
+        BENCH_EXTRACT_LATENCY=str(args.extract_latency),
+        # The stub is not a real platform: do not rate limit it
+        PLATFORM_RATE='100000',
+        PLATFORM_BURST='100000',
+        DOWNLOAD_QUEUE_SIZE='100000',
+    )
+    media = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'media_server.py'), '--port', str(media_port),
+         '--latency', str(args.latency), '--bandwidth', str(args.bandwidth)],
+        stdout=subprocess.DEVNULL,
+    )
+    # yt-dlp prints download progress; keep it out of the report
+    server_log = open(os.path.join(workdir, 'server.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'stub_wsgi:application', '--bind', f'127.0.0.1:{app_port}',
+         '--worker-class', 'gthread', '--workers', str(args.workers), '--threads', str(args.threads),
+         '--timeout', '300', '--log-level', 'warning'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=server_log,
+    )
+    results = []
+    try:
+        wait_until_up(app_port, server)
+        client = Client(app_port)
+        context = {'hot_id': new_video_id()}
+        run_analyze(client, context, context['hot_id'])
+        context['hot_filename'] = download_video(client, context['hot_id'])
+        if context['hot_filename'] is None:
+            raise RuntimeError('could not download the warm-up video')
+
+        print(f"gunicorn {args.workers} workers x {args.threads} threads, {args.size_mb:g} MiB videos, "
+              f"extraction {args.extract_latency * 1000:.0f} ms, media latency {args.latency * 1000:.0f} ms, "
+              f"bandwidth {args.bandwidth or 'unlimited'} MiB/s")
+        print(f"{'scenario':<16}{'conc':>5}{'reqs':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'req/s':>8}{'MiB/s':>8}{'RSS MiB':>9}{'disk MiB':>10}")
+        for scenario in scenarios:
+            for concurrency in levels:
+                sampler = RSSSampler(server.pid)
+                sampler.start()
+                latencies, errors, size, elapsed = run_level(app_port, scenario, concurrency, args.requests, context)
+                peak_rss = sampler.stop()
+                result = {
+                    'scenario': scenario,
+                    'concurrency': concurrency,
+                    'requests': len(latencies),
+                    'errors': errors,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p95_ms': percentile(latencies, 95) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'rps': len(latencies) / elapsed,
+                    'mib_per_s': size / (1024 * 1024) / elapsed,
+                    'peak_rss_mib': peak_rss / (1024 * 1024),
+                    'disk_mib': directory_size(workdir) / (1024 * 1024),
+                }
+                results.append(result)
+                print(f"{scenario:<16}{concurrency:>5}{result['requests']:>6}{errors:>5}"
+                      f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+                      f"{result['rps']:>8.1f}{result['mib_per_s']:>8.1f}{result['peak_rss_mib']:>9.1f}"
+                      f"{result['disk_mib']:>10.1f}")
+    except Exception:
+        server_log.flush()
+        with open(server_log.name) as f:
+            sys.stderr.write(''.join(f.readlines()[-30:]))
+        raise
+    finally:
+        server.terminate()
+        media.terminate()
+        server.wait()
+        media.wait()
+        server_log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'No regressions beyond {args.tolerance:.0%} against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Local HTTP media server for benchmarks
+Serves deterministic fake media files so benchmarks never touch real
+platforms. GET /media/<bytes>.mp4 returns a body of that many bytes and
+GET /hls/<segments>x<bytes>.m3u8 an HLS playlist of that many segments; the
+server can add per-request latency and cap per-connection bandwidth.
+Run standalone with: python bench/media_server.py --port 8765 --latency 0.05 --bandwidth 10
+"""
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_MEDIA_PATH = re.compile(r'^/(?:media|hls/seg/\d+)/(\d+)\.(mp4|m4a|webm|ts)$')
+_PLAYLIST_PATH = re.compile(r'^/hls/(\d+)x(\d+)\.m3u8$')
+_CONTENT_TYPES = {'mp4': 'video/mp4', 'm4a': 'audio/mp4', 'webm': 'video/webm', 'ts': 'video/mp2t'}
+_BLOCK = bytes(range(256)) * 256  # 64 KiB of repeating bytes
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _playlist(self, segments, size):
+        """Media playlist of fixed 4 second segments of size bytes each"""
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(segments):
+            lines += ['#EXTINF:4.0,', f'/hls/seg/{index}/{size}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return ('\n'.join(lines) + '\n').encode('ascii')
+
+    def _send_playlist(self, head=False):
+        match = _PLAYLIST_PATH.match(self.path.split('?')[0])
+        if not match:
+            return False
+        time.sleep(self.server.latency)
+        body = self._playlist(int(match.group(1)), int(match.group(2)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+        return True
+
+    def _parse(self):
+        match = _MEDIA_PATH.match(self.path.split('?')[0])
+        if not match:
+            self.send_error(404)
+            return None
+        return int(match.group(1)), match.group(2)
+
+    def _send_headers(self, size, ext):
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range', '')
+        range_match = re.match(r'bytes=(\d*)-(\d*)$', range_header)
+        if range_match and (range_match.group(1) or range_match.group(2)):
+            if range_match.group(1):
+                start = int(range_match.group(1))
+                end = int(range_match.group(2)) if range_match.group(2) else size - 1
+            else:
+                start = max(size - int(range_match.group(2)), 0)
+            end = min(end, size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', _CONTENT_TYPES[ext])
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        if self._send_playlist(head=True):
+            return
+        parsed = self._parse()
+        if parsed:
+            time.sleep(self.server.latency)
+            self._send_headers(*parsed)
+
+    def do_GET(self):
+        if self._send_playlist():
+            return
+        parsed = self._parse()
+        if not parsed:
+            return
+        time.sleep(self.server.latency)
+        start, end = self._send_headers(*parsed)
+        remaining = end - start + 1
+        bytes_per_second = self.server.bandwidth
+        began = time.monotonic()
+        sent = 0
+        try:
+            while remaining > 0:
+                block = _BLOCK[:min(len(_BLOCK), remaining)]
+                self.wfile.write(block)
+                sent += len(block)
+                remaining -= len(block)
+                if bytes_per_second:
+                    # Sleep until the bandwidth budget allows the bytes sent so far
+                    ahead = sent / bytes_per_second - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, bandwidth_mbps=0.0):
+        super().__init__(('127.0.0.1', port), MediaHandler)
+        self.latency = latency
+        self.bandwidth = int(bandwidth_mbps * 1024 * 1024)
+
+    def url(self, size, ext='mp4'):
+        return f"http://127.0.0.1:{self.server_address[1]}/media/{size}.{ext}"
+
+    def hls_url(self, segments, segment_size):
+        return f"http://127.0.0.1:{self.server_address[1]}/hls/{segments}x{segment_size}.m3u8"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--bandwidth', type=float, default=0.0, help='MiB/s per connection (0 = unlimited)')
+    args = parser.parse_args()
+    server = MediaServer(args.port, args.latency, args.bandwidth)
+    print(f"Serving fake media on {server.url(1000000)}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Deterministic stand-in for the YouTube extractor
+install() makes every yt_dlp.YoutubeDL answer YouTube watch URLs with a
+stub extractor instead of contacting YouTube. Each video has one
+progressive MP4 format served by bench/media_server.py, so analyze,
+download and file serving run the real code paths end to end offline.
+
+Configured through the environment so it also works inside gunicorn workers:
+  BENCH_MEDIA_SERVER      base URL of the media server (http://127.0.0.1:8765)
+  BENCH_MEDIA_BYTES       size of every video in bytes (default 5 MiB)
+  BENCH_EXTRACT_LATENCY   seconds each extraction takes, like a platform round-trip (default 0.2)
+"""
+import os
+import time
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class StubYoutubeIE(InfoExtractor):
+    """YouTube watch URLs resolved locally"""
+    IE_NAME = 'stub:youtube'
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[A-Za-z0-9_-]{11})'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        time.sleep(float(os.environ.get('BENCH_EXTRACT_LATENCY', '0.2')))
+        server = os.environ.get('BENCH_MEDIA_SERVER', 'http://127.0.0.1:8765').rstrip('/')
+        size = int(os.environ.get('BENCH_MEDIA_BYTES', str(5 * 1024 * 1024)))
+        return {
+            'id': video_id,
+            'title': f'Stub video {video_id}',
+            'thumbnail': f'{server}/media/1024.mp4',
+            'duration': 60,
+            'formats': [{
+                'format_id': '18',
+                'url': f'{server}/media/{size}.mp4',
+                'ext': 'mp4',
+                'width': 640,
+                'height': 360,
+                'vcodec': 'avc1.42001E',
+                'acodec': 'mp4a.40.2',
+                'filesize': size,
+            }],
+        }
+
+
+class StubYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that tries the stub extractor before every real one"""
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        self.add_info_extractor(StubYoutubeIE())
+        stub = self._ies.pop(StubYoutubeIE.ie_key())
+        self._ies = {StubYoutubeIE.ie_key(): stub, **self._ies}
+
+
+def install():
+    """Route every YoutubeDL created through yt_dlp.YoutubeDL to the stub"""
+    yt_dlp.YoutubeDL = StubYoutubeDL
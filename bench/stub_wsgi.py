@@ -0,0 +1,13 @@
+"""
+WSGI entry point for load tests
+Same as wsgi.py, but with the stub extractor installed before the app is
+imported. Run from a scratch directory with bench/ and the project root on
+PYTHONPATH (bench/loadtest.py does this).
+"""
+from stub_extractor import install
+
+install()
+
+from app import app  # noqa: E402
+
+application = app
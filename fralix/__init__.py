@@ -0,0 +1,4 @@
+"""
+Shared building blocks for the Fralix Trailers backends
+Both the Render app (app.py) and the Vercel function (api/index.py) import from here
+"""
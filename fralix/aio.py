@@ -0,0 +1,151 @@
+"""
+Async serving helpers for the ASGI entry point (asgi.py)
+The event loop only ever waits on sockets. Blocking work (yt-dlp, SQLite,
+job state files) runs on a bounded thread pool. Stored files go out through
+Starlette's FileResponse, which reads them one chunk at a time in
+short-lived threads. A download to a slow client then costs a coroutine
+rather than a thread or a whole worker process, so one instance can keep
+hundreds of transfers going.
+"""
+import asyncio
+import email.utils
+import functools
+import json
+import mimetypes
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.responses import FileResponse, Response
+
+from fralix.config import env_int
+from fralix.fileserve import artifact_etag
+from fralix.jobs import TERMINAL_STATES
+from fralix.streaming import content_disposition
+
+
+def async_settings():
+    """Thread pool sizes of the ASGI mode"""
+    return {
+        'blocking_threads': env_int('ASYNC_BLOCKING_THREADS', 16),
+        'wsgi_threads': env_int('ASYNC_WSGI_THREADS', 16),
+    }
+
+
+class BlockingPool:
+    """Bounded thread pool for the blocking calls of async handlers"""
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi-blocking')
+        # Only touched from the event loop thread
+        self.in_flight = 0
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the pool and wait for it without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class TrackedResponse:
+    """ASGI response wrapper that reports bytes sent and time until the last one
+
+    With a bandwidth transfer (fralix.bandwidth) each body chunk is paced to
+    its share by sleeping on the event loop.
+    """
+
+    def __init__(self, response, on_done, transfer=None):
+        self.response = response
+        self.status_code = response.status_code
+        self._on_done = on_done
+        self._transfer = transfer
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        sent = [0]
+
+        async def counting_send(message):
+            if message['type'] == 'http.response.body':
+                size = len(message.get('body', b''))
+                sent[0] += size
+                await send(message)
+                delay = self._transfer.reserve(size) if self._transfer is not None and size else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                return
+            await send(message)
+
+        try:
+            await self.response(scope, receive, counting_send)
+        finally:
+            if self._transfer is not None:
+                self._transfer.close()
+            self._on_done(sent[0], time.perf_counter() - started)
+
+
+def _not_modified(request_headers, etag, last_modified):
+    """Evaluate If-None-Match / If-Modified-Since like werkzeug does for send_file"""
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = request_headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def artifact_response(artifact, request_headers, offload=None, accel_prefix='/protected-downloads/'):
+    """Starlette counterpart of fralix.fileserve.serve_artifact"""
+    disposition = content_disposition(artifact['download_name'])
+    mimetype = mimetypes.guess_type(artifact['filename'])[0] or 'application/octet-stream'
+    if offload == 'nginx':
+        return Response(status_code=200, media_type=mimetype, headers={
+            'X-Accel-Redirect': accel_prefix.rstrip('/') + '/' + artifact['filename'],
+            'Content-Disposition': disposition,
+            'X-Accel-Buffering': 'yes',
+        })
+    if offload == 'sendfile':
+        return Response(status_code=200, media_type=mimetype, headers={
+            'X-Sendfile': artifact['path'],
+            'Content-Disposition': disposition,
+        })
+
+    validators = {
+        'ETag': f'"{artifact_etag(artifact)}"',
+        'Last-Modified': email.utils.formatdate(artifact['created'], usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+    if _not_modified(request_headers, validators['ETag'], artifact['created']):
+        return Response(status_code=304, headers=validators)
+    # FileResponse answers Range and If-Range itself
+    return FileResponse(artifact['path'], media_type=mimetype,
+                        headers=dict(validators, **{'Content-Disposition': disposition}))
+
+
+async def job_events(jobs, job_id, pool, interval=0.5, timeout=3600):
+    """Async twin of JobManager.stream: Server-Sent Events until the job finishes"""
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        state = await pool.run(jobs.get, job_id)
+        if state is None:
+            yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+            return
+        payload = json.dumps(state)
+        if payload != last:
+            last = payload
+            yield f"data: {payload}\n\n"
+        if state['state'] in TERMINAL_STATES:
+            return
+        await asyncio.sleep(interval)
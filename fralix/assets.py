@@ -0,0 +1,127 @@
+"""
+Fingerprinted, precompressed static assets
+`python -m fralix.assets` minifies the stylesheet and script of the page,
+names each result after a hash of its content (css/style.1f3a9c0b7d2e.css)
+and writes gzip and brotli variants next to it under static/dist/, plus a
+manifest.json mapping source names to built ones. The template resolves
+names through the manifest, so a changed file gets a new URL and every
+built file can be cached by browsers for a year without revalidation.
+
+Without a manifest (nothing built yet) the plain static files are linked as
+before. rcssmin, rjsmin and brotli (requirements-build.txt) are optional:
+CSS then goes through a simple built-in minifier, JavaScript is only
+compressed, and no .br variants are written.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Assets referenced by templates/index.html, relative to the static folder
+ASSETS = ('css/style.css', 'js/main.js')
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Content-Encoding and file suffix of the precompressed variants, preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Built files never change under their name
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def minify_css(text):
+    """Minify a stylesheet with rcssmin, or strip comments and whitespace without it"""
+    try:
+        from rcssmin import cssmin
+    except ImportError:
+        text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+        text = re.sub(r'([{;])\s*([-\w]+)\s*:\s*', r'\1\2:', text)
+        return text.replace(';}', '}').strip()
+    return cssmin(text)
+
+
+def minify_js(text):
+    """Minify a script with rjsmin; unchanged without it (compression still applies)"""
+    try:
+        from rjsmin import jsmin
+    except ImportError:
+        return text
+    return jsmin(text)
+
+
+_MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def compress(data):
+    """Precompressed variants of data as {suffix: bytes}, only those that are smaller"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: packed for suffix, packed in variants.items() if len(packed) < len(data)}
+
+
+def _write(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(static_dir, assets=ASSETS):
+    """Write minified, fingerprinted and compressed copies of assets; returns the manifest"""
+    manifest = {}
+    for name in assets:
+        base, ext = os.path.splitext(name)
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            text = f.read()
+        data = _MINIFIERS.get(ext, lambda t: t)(text).encode('utf-8')
+        built = f"{DIST_DIR}/{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        path = os.path.join(static_dir, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Files of earlier builds stay, so pages cached with the old names keep working
+        _write(path, data)
+        for suffix, packed in compress(data).items():
+            _write(path + suffix, packed)
+        manifest[name] = built
+        logger.info(f"{name} -> {built} ({len(text.encode('utf-8'))} -> {len(data)} bytes)")
+    _write(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+class AssetManifest:
+    """Built names of the static assets, read once from static/dist/manifest.json"""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIR)
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST_NAME), encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def resolve(self, name):
+        """Static file name to link for an asset: the built one when it exists"""
+        built = self.entries.get(name)
+        if built and os.path.exists(os.path.join(self.static_dir, built)):
+            return built
+        return name
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'static')
+    build_assets(root)
@@ -0,0 +1,296 @@
+"""
+Audio-only downloads and their ffmpeg post-processing
+format_id 'audio:<target>' (m4a, mp3 or opus; plain 'audio' is m4a)
+downloads the best audio-only stream instead of a whole video, usually a
+tenth of the bytes or less. ffmpeg then remuxes it into the target
+container when the codec already matches, or transcodes it when it does
+not.
+
+ffmpeg never runs in a web worker or a download thread. Conversions go to a
+small process pool of their own: its processes run at a lower CPU priority,
+every ffmpeg run is capped in CPU seconds and wall time, and once the pool
+and its queue are full further audio downloads are refused with 503 instead
+of piling up behind the CPUs that serve requests. Without ffmpeg the audio
+stream is stored in the container it came in, and mp3 is not offered.
+"""
+import functools
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fralix.config import env_int
+from fralix.formats import codec_family, estimate_size
+
+try:
+    import resource
+except ImportError:  # Windows: no CPU time limit, only the wall clock one
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_PREFIX = 'audio'
+DEFAULT_TARGET = 'm4a'
+
+# target: (yt-dlp selector, codec families stored as they are, ffmpeg encoder, ffmpeg muxer)
+AUDIO_TARGETS = {
+    'm4a': ('bestaudio[ext=m4a]/bestaudio/best', ('mp4a', 'aac'), 'aac', 'ipod'),
+    'mp3': ('bestaudio/best', ('mp3',), 'libmp3lame', 'mp3'),
+    'opus': ('bestaudio[acodec=opus]/bestaudio/best', ('opus',), 'libopus', 'ogg'),
+}
+
+# Targets that cannot be served at all without ffmpeg
+NEEDS_FFMPEG = ('mp3',)
+
+# Last lines of ffmpeg's stderr kept for the job error
+_STDERR_TAIL = 500
+
+
+class PostprocessError(Exception):
+    """An ffmpeg conversion failed, timed out or ran out of CPU time"""
+
+
+class PostprocessBusy(PostprocessError):
+    """The post-processing pool and its queue are full"""
+
+
+def audio_target(format_id):
+    """Target container of an audio format_id, None for video formats; ValueError on unknown targets"""
+    if not isinstance(format_id, str):
+        # Straight from a JSON body, where {"format_id": 5} is valid
+        raise ValueError('format_id must be a string')
+    if format_id != AUDIO_PREFIX and not format_id.startswith(AUDIO_PREFIX + ':'):
+        return None
+    target = format_id.partition(':')[2] or DEFAULT_TARGET
+    if target not in AUDIO_TARGETS:
+        raise ValueError(f"Audio format must be one of {', '.join(AUDIO_TARGETS)}")
+    return target
+
+
+def download_selector(format_id):
+    """yt-dlp format selector for a format_id of the download and stream endpoints"""
+    target = audio_target(format_id)
+    if target is not None:
+        return AUDIO_TARGETS[target][0]
+    return format_id if format_id != 'best' else 'best[ext=mp4]/best'
+
+
+def _audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') != 'none'
+
+
+def audio_formats(info, ffmpeg=True, bitrate=192):
+    """Audio-only choices for /api/analyze, shaped like the ranked video formats"""
+    duration = info.get('duration') or 0
+    streams = [f for f in info.get('formats') or () if _audio_only(f)]
+    if not streams:
+        return []
+    choices = []
+    for target, (_, copied, _, _) in AUDIO_TARGETS.items():
+        if target in NEEDS_FFMPEG and not ffmpeg:
+            continue
+        # The stream the selector prefers: same container (or codec) as the target when there is one
+        preferred = [f for f in streams if f.get('ext') == target or codec_family(f.get('acodec')) in copied]
+        source = max(preferred or streams, key=lambda f: (f.get('abr') or f.get('tbr') or 0, f.get('quality') or 0))
+        codec = codec_family(source.get('acodec'))
+        if codec in copied or not ffmpeg:
+            size, estimated = estimate_size(source, duration)
+            kbps = source.get('abr') or source.get('tbr')
+        else:
+            # Transcoded at the configured bitrate
+            codec = copied[0]
+            size, estimated = (int(bitrate * 1000 / 8 * duration) or None), True
+            kbps = bitrate
+        choices.append({
+            'format_id': f'{AUDIO_PREFIX}:{target}',
+            'ext': target if ffmpeg else source.get('ext', target),
+            'resolution': 'Audio only',
+            'height': None,
+            'fps': None,
+            'vcodec': None,
+            'acodec': codec,
+            'tbr': round(kbps) if kbps else None,
+            'quality': source.get('quality', 0),
+            'filesize': size or 0,
+            'filesize_estimated': bool(size) and estimated,
+            'merged': False,
+        })
+    return choices
+
+
+def ffmpeg_command(src, dest, target, codec, bitrate=192):
+    """ffmpeg arguments converting src into dest: a stream copy when codec suits the target"""
+    _, copied, encoder, muxer = AUDIO_TARGETS[target]
+    if codec_family(codec) in copied:
+        codec_args = ['-c:a', 'copy']
+    else:
+        codec_args = ['-c:a', encoder, '-b:a', f'{bitrate}k']
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', '-i', src,
+               '-vn', '-map', '0:a:0', '-map_metadata', '0'] + codec_args
+    if muxer == 'ipod':
+        command += ['-movflags', '+faststart']
+    return command + ['-f', muxer, dest]
+
+
+def _lower_priority(niceness):
+    """Pool process initializer: yield the CPU to the web workers"""
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+def _limit_cpu(seconds):
+    # Runs in the ffmpeg child before exec; SIGXCPU ends it at the soft limit
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 5))
+
+
+def run_ffmpeg(command, cpu_seconds, timeout):
+    """Run one ffmpeg command inside a pool process; returns (returncode, stderr tail, CPU seconds)"""
+    preexec = functools.partial(_limit_cpu, cpu_seconds) if resource is not None and cpu_seconds else None
+    before = resource.getrusage(resource.RUSAGE_CHILDREN) if resource is not None else None
+    try:
+        completed = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, timeout=timeout, preexec_fn=preexec)
+        returncode, stderr = completed.returncode, completed.stderr
+    except subprocess.TimeoutExpired:
+        returncode, stderr = None, f'timed out after {timeout} seconds'.encode()
+    cpu = 0.0
+    if before is not None:
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return returncode, stderr.decode('utf-8', 'replace')[-_STDERR_TAIL:].strip(), cpu
+
+
+class AudioPool:
+    """Bounded process pool running the ffmpeg conversions of audio downloads"""
+
+    def __init__(self, workers=2, queue_depth=4, cpu_seconds=300, timeout=600, niceness=10, bitrate=192,
+                 ffmpeg=None):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.niceness = niceness
+        self.bitrate = bitrate
+        self.ffmpeg = ffmpeg if ffmpeg is not None else shutil.which('ffmpeg') is not None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cpu_used = 0.0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_env(cls):
+        """Build the pool from the AUDIO_* environment variables"""
+        return cls(
+            workers=env_int('AUDIO_WORKERS', 2),
+            queue_depth=env_int('AUDIO_QUEUE_DEPTH', 4),
+            cpu_seconds=env_int('AUDIO_CPU_SECONDS', 300),
+            timeout=env_int('AUDIO_TIMEOUT', 600),
+            niceness=env_int('AUDIO_NICE', 10),
+            bitrate=env_int('AUDIO_BITRATE', 192),
+        )
+
+    def format_id(self, format_id):
+        """Canonical format_id ('audio' -> 'audio:m4a', video ones unchanged); ValueError when unservable"""
+        target = audio_target(format_id)
+        if target is None:
+            return format_id
+        if target in NEEDS_FFMPEG and not self.ffmpeg:
+            raise ValueError(f'{target} needs ffmpeg, which is not installed on this server')
+        return f'{AUDIO_PREFIX}:{target}'
+
+    def formats(self, info):
+        """Audio-only choices of an extracted video"""
+        return audio_formats(info, self.ffmpeg, self.bitrate)
+
+    def busy(self):
+        """Whether a new conversion would be turned away right now"""
+        return self.ffmpeg and self.in_flight >= self.workers + self.queue_depth
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: the web worker has threads and locks a fork would copy mid-use
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_lower_priority, initargs=(self.niceness,)
+                )
+            return self._executor
+
+    def convert(self, src, target, codec, dest_dir):
+        """Remux or transcode a downloaded audio stream into target; returns the new file's path
+
+        Returns src unchanged without ffmpeg. Raises PostprocessBusy when the
+        pool is saturated and PostprocessError when ffmpeg fails.
+        """
+        if not self.ffmpeg:
+            return src
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_depth:
+                self.rejected += 1
+                raise PostprocessBusy('Too many audio conversions in progress, please try again shortly')
+            self.in_flight += 1
+        dest = os.path.join(dest_dir, f'audio.{target}')
+        # A .tmp name until ffmpeg is done, so find_output never picks up half a file
+        tmp_dest = dest + '.tmp'
+        command = ffmpeg_command(src, tmp_dest, target, codec, self.bitrate)
+        try:
+            executor = self._get_executor()
+            try:
+                returncode, stderr, cpu = executor.submit(run_ffmpeg, command, self.cpu_seconds, self.timeout).result()
+            except BrokenProcessPool:
+                # A pool process died (OOM killer, signal); start a fresh pool for the next conversion
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+                logger.error('An audio conversion process died; the pool will be restarted')
+                raise PostprocessError('Audio conversion failed: the conversion process died')
+            with self._lock:
+                self.cpu_used += cpu
+            if returncode != 0:
+                self.failed += 1
+                if returncode is None or returncode < 0:
+                    raise PostprocessError(f'Audio conversion stopped: {stderr or "CPU time limit reached"}')
+                raise PostprocessError(f'Audio conversion failed: {stderr or f"ffmpeg exited with {returncode}"}')
+            os.replace(tmp_dest, dest)
+            self.completed += 1
+            return dest
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
+
+    def samples(self):
+        """Metric samples: conversions running or queued and CPU seconds used"""
+        return [
+            ('fralix_postprocess_in_flight', {}, self.in_flight),
+            ('fralix_postprocess_cpu_seconds_total', {}, self.cpu_used),
+        ]
+
+    def stats(self):
+        return {
+            'ffmpeg': self.ffmpeg,
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'cpu_seconds': round(self.cpu_used, 2),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,467 @@
+"""
+Bandwidth scheduling
+Without limits, one 4K download fills the instance's link and every other
+transfer and extraction slows to a crawl. BandwidthManager caps two
+directions separately: upstream (what yt-dlp fetches from the platforms)
+and downstream (what is sent to clients). Each cap is split with weighted
+max-min fairness, first between clients (each optionally held to a quota),
+then between a client's transfers. Weights come from priority classes:
+interactive (single downloads, streams, served files), bulk (bulk jobs and
+their ZIPs) and background. A transfer that cannot use its share (a slow
+client, a slow CDN) is measured, and what it leaves goes to the others, so
+the link is not left idle.
+
+Transfers pace themselves: each chunk is reserved against the transfer's
+current rate and the caller sleeps for the difference. yt-dlp is paced
+from a progress hook, Flask bodies by wrapping their iterator, and nginx
+(FILE_OFFLOAD=nginx) through X-Accel-Limit-Rate. The split is recomputed
+twice a second. Worker processes publish their demand in SQLite from a
+background thread, so a cap holds for the whole instance instead of per
+gunicorn worker; per-client quotas are enforced per process.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from fralix.config import env_int, env_str
+from fralix.db import SQLiteBacked
+
+logger = logging.getLogger(__name__)
+
+UNLIMITED = float('inf')
+
+UPSTREAM = 'upstream'
+DOWNSTREAM = 'downstream'
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+BACKGROUND = 'background'
+
+# Relative share of each priority class when transfers compete
+DEFAULT_WEIGHTS = {INTERACTIVE: 4, BULK: 2, BACKGROUND: 1}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS demand (
+    pid INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    weight REAL NOT NULL,
+    demand REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (pid, direction)
+);
+"""
+
+# Shares are recomputed this often while transfers are running
+_REFRESH_SECONDS = 0.5
+
+# Processes that stopped reporting for this long no longer count
+_SHARED_TTL = 3.0
+
+# A transfer idle for a moment may catch up this much time at once
+_BURST_SECONDS = 0.25
+
+# Nobody is starved completely, even when many transfers split a small cap
+_MIN_RATE = 16 * 1024
+
+
+def parse_weights(value, defaults=DEFAULT_WEIGHTS):
+    """Priority weights from 'interactive=4,bulk=2,background=1'; unknown or bad entries are ignored"""
+    weights = dict(defaults)
+    for item in (value or '').split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            weights[name] = max(float(weight), 0.01)
+        except ValueError:
+            logger.warning(f"Ignoring bandwidth weight {item.strip()!r}")
+    return weights
+
+
+def fair_shares(capacity, demands):
+    """Weighted max-min fair split of capacity; demands maps key -> (weight, demand)"""
+    if capacity == UNLIMITED:
+        return {key: demand for key, (weight, demand) in demands.items()}
+    shares = {}
+    remaining = dict(demands)
+    while remaining:
+        total_weight = sum(weight for weight, _ in remaining.values())
+        # Whoever wants less than their weighted share gets what they want; the rest is split again
+        satisfied = {key: demand for key, (weight, demand) in remaining.items()
+                     if demand <= capacity * weight / total_weight}
+        if not satisfied:
+            for key, (weight, _) in remaining.items():
+                shares[key] = capacity * weight / total_weight
+            break
+        for key, demand in satisfied.items():
+            shares[key] = demand
+            capacity -= demand
+            del remaining[key]
+    return shares
+
+
+def client_address(remote_addr, forwarded_for=None, trusted_proxies=0):
+    """Client for per-client quotas: the peer, or the X-Forwarded-For entry of the outermost trusted proxy"""
+    if trusted_proxies and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if hops:
+            return hops[-min(trusted_proxies, len(hops))]
+    return remote_addr or 'unknown'
+
+
+class SharedDemand(SQLiteBacked):
+    """Demand of every worker process, so each takes only its fair part of a cap"""
+
+    schema = _SCHEMA
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.pid = os.getpid()
+        self._init_db()
+
+    def share(self, direction, capacity, weight, demand):
+        """Publish this process's weight and demand; returns its part of capacity"""
+        now = time.time()
+        # SQLite has no infinity; a demand above the whole cap means the same
+        demand = min(demand, capacity)
+
+        def exchange(conn):
+            conn.execute('INSERT OR REPLACE INTO demand (pid, direction, weight, demand, updated) '
+                         'VALUES (?, ?, ?, ?, ?)', (self.pid, direction, weight, demand, now))
+            conn.execute('DELETE FROM demand WHERE updated < ?', (now - 10 * _SHARED_TTL,))
+            return conn.execute('SELECT pid, weight, demand FROM demand WHERE direction = ? AND updated >= ?',
+                                (direction, now - _SHARED_TTL)).fetchall()
+
+        rows = self._transaction(exchange)
+        shares = fair_shares(capacity, {pid: (row_weight, row_demand) for pid, row_weight, row_demand in rows})
+        return shares.get(self.pid, capacity)
+
+    def leave(self, direction):
+        """Stop counting this process once it has no transfers left"""
+        self._connect().execute('DELETE FROM demand WHERE pid = ? AND direction = ?', (self.pid, direction))
+
+
+class Transfer:
+    """One flow of bytes paced to its share of a BandwidthChannel"""
+
+    def __init__(self, channel, client, priority, weight):
+        self.channel = channel
+        self.client = client
+        self.priority = priority
+        self.weight = weight
+        self.rate = UNLIMITED
+        self.demand = UNLIMITED
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._allowed_at = self.started
+        self._window_started = self.started
+        self._window_bytes = 0
+        # New transfers count as wanting as much as they can get
+        self._throttled = True
+
+    def reserve(self, size):
+        """Account for size bytes; returns the seconds to wait before moving more"""
+        return self.channel._reserve(self, size)
+
+    def consume(self, size):
+        """Account for size bytes and sleep until the transfer is back within its rate"""
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+    def promote(self, priority):
+        """Move the transfer into another priority class, e.g. once somebody waits for it"""
+        self.channel._promote(self, priority)
+
+    def close(self):
+        self.channel._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BandwidthChannel:
+    """Aggregate cap and per-client quota of one direction, shared fairly by its transfers"""
+
+    def __init__(self, direction, capacity=None, client_quota=None, weights=None, shared=None):
+        self.direction = direction
+        self.capacity = capacity or None
+        self.client_quota = client_quota or None
+        self.weights = weights or DEFAULT_WEIGHTS
+        self.shared = shared
+        self.process_capacity = self.capacity
+        self.throttled_seconds = {}
+        self._transfers = set()
+        self._lock = threading.Lock()
+        self._refreshed = 0.0
+        # Transfers by client and client demands of the last reallocation, for re-splitting a new share
+        self._clients = {}
+        self._client_demands = {}
+        # (weight, demand) of this process to publish, None once it has no transfers
+        self._demand = None
+        self._sharer = None
+        self._wake = threading.Event()
+
+    @property
+    def limited(self):
+        return self.capacity is not None or self.client_quota is not None
+
+    def open(self, client, priority=INTERACTIVE):
+        """Start a transfer for client in a priority class"""
+        if priority not in self.weights:
+            priority = INTERACTIVE
+        transfer = Transfer(self, client, priority, self.weights.get(priority, 1))
+        if self.limited:
+            with self._lock:
+                self._transfers.add(transfer)
+                self._reallocate(time.monotonic())
+            self._wake.set()
+        return transfer
+
+    def _promote(self, transfer, priority):
+        if priority not in self.weights:
+            return
+        with self._lock:
+            transfer.priority = priority
+            transfer.weight = self.weights[priority]
+            if transfer in self._transfers:
+                self._reallocate(time.monotonic())
+
+    def _close(self, transfer):
+        if not self.limited:
+            return
+        with self._lock:
+            if transfer not in self._transfers:
+                return
+            self._transfers.discard(transfer)
+            self._reallocate(time.monotonic())
+        self._wake.set()
+
+    def _reserve(self, transfer, size):
+        transfer.bytes += size
+        if not self.limited:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            transfer._window_bytes += size
+            if now - self._refreshed >= _REFRESH_SECONDS:
+                self._reallocate(now)
+            if transfer.rate == UNLIMITED:
+                return 0
+            start = max(transfer._allowed_at, now - _BURST_SECONDS)
+            transfer._allowed_at = start + size / transfer.rate
+            delay = transfer._allowed_at - now
+            if delay <= 0:
+                return 0
+            transfer._throttled = True
+            self.throttled_seconds[transfer.priority] = self.throttled_seconds.get(transfer.priority, 0) + delay
+            return delay
+
+    def _measure(self, transfer, now):
+        """Demand of a transfer: unbounded while it is held back, else a bit above its recent rate"""
+        elapsed = now - transfer._window_started
+        if transfer._throttled or elapsed < _REFRESH_SECONDS / 2:
+            demand = UNLIMITED
+        else:
+            demand = transfer._window_bytes / elapsed * 1.1 + _MIN_RATE
+        transfer._window_started = now
+        transfer._window_bytes = 0
+        transfer._throttled = False
+        return demand
+
+    def _reallocate(self, now):
+        """Recompute the rate of every transfer (called with the lock held)"""
+        self._refreshed = now
+        clients = {}
+        for transfer in self._transfers:
+            transfer.demand = self._measure(transfer, now)
+            clients.setdefault(transfer.client, []).append(transfer)
+
+        # A client weighs as much as its most important transfer, however many it opens
+        client_demands = {}
+        for client, transfers in clients.items():
+            demand = sum(transfer.demand for transfer in transfers)
+            if self.client_quota is not None:
+                demand = min(demand, self.client_quota)
+            client_demands[client] = (max(transfer.weight for transfer in transfers), demand)
+
+        if self.shared is not None and self.capacity is not None:
+            self._demand = (sum(weight for weight, _ in client_demands.values()),
+                            sum(demand for _, demand in client_demands.values())) if client_demands else None
+            if self._sharer is None:
+                self._sharer = threading.Thread(target=self._share_forever, name=f'bandwidth-{self.direction}',
+                                                daemon=True)
+                self._sharer.start()
+        self._clients = clients
+        self._client_demands = client_demands
+        self._assign_rates()
+
+    def _assign_rates(self):
+        """Split this process's share of the cap by the last measured demands (called with the lock held)"""
+        capacity = UNLIMITED if self.capacity is None else self.process_capacity
+        for client, client_rate in fair_shares(capacity, self._client_demands).items():
+            transfers = self._clients[client]
+            rates = fair_shares(client_rate, {transfer: (transfer.weight, transfer.demand) for transfer in transfers})
+            for transfer in transfers:
+                rate = rates.get(transfer, UNLIMITED)
+                transfer.rate = rate if rate == UNLIMITED else max(rate, _MIN_RATE)
+
+    def _share_forever(self):
+        """Exchange demand with the other processes off the request path and apply the share that comes back"""
+        published = False
+        while True:
+            self._wake.clear()
+            with self._lock:
+                demand = self._demand
+            try:
+                if demand is not None:
+                    capacity = self.shared.share(self.direction, self.capacity, *demand)
+                    published = True
+                else:
+                    if published:
+                        self.shared.leave(self.direction)
+                        published = False
+                    capacity = self.capacity
+            except sqlite3.Error as e:
+                # Worst case every process uses the whole cap until the database answers again
+                logger.warning(f"Bandwidth coordination failed: {str(e)}")
+                capacity = self.capacity
+            # Only the swap of the new share holds the lock, never the SQLite transaction
+            with self._lock:
+                if capacity != self.process_capacity:
+                    self.process_capacity = capacity
+                    self._assign_rates()
+            self._wake.wait(_REFRESH_SECONDS)
+
+    def stats(self):
+        with self._lock:
+            transfers = sorted(self._transfers, key=lambda t: t.started)
+            now = time.monotonic()
+            return {
+                'capacity': self.capacity,
+                'process_capacity': self.process_capacity,
+                'client_quota': self.client_quota,
+                'transfers': [{
+                    'client': transfer.client,
+                    'priority': transfer.priority,
+                    'rate': None if transfer.rate == UNLIMITED else round(transfer.rate),
+                    'bytes': transfer.bytes,
+                    'seconds': round(now - transfer.started, 1),
+                } for transfer in transfers],
+                'throttled_seconds': {priority: round(seconds, 3)
+                                      for priority, seconds in self.throttled_seconds.items()},
+            }
+
+
+class _ThrottledBody:
+    """WSGI body that paces its chunks through a transfer and closes it at the end"""
+
+    def __init__(self, body, transfer):
+        self._body = body
+        self._transfer = transfer
+
+    def __iter__(self):
+        for chunk in self._body:
+            yield chunk
+            self._transfer.consume(len(chunk))
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._transfer.close()
+
+
+class BandwidthManager:
+    """Upstream and downstream bandwidth channels of this instance"""
+
+    def __init__(self, upstream, downstream, trusted_proxies=0):
+        self.upstream = upstream
+        self.downstream = downstream
+        self.trusted_proxies = trusted_proxies
+
+    @classmethod
+    def from_env(cls, state_dir=None):
+        """Build from the BANDWIDTH_* environment variables (rates in KiB/s, 0 = unlimited)"""
+        weights = parse_weights(env_str('BANDWIDTH_WEIGHTS', ''))
+        client_quota = env_int('BANDWIDTH_CLIENT_KBPS', 0) * 1024
+        shared = None
+        if state_dir is not None:
+            try:
+                shared = SharedDemand(os.path.join(state_dir, 'bandwidth.sqlite3'))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Bandwidth caps apply per process ({state_dir}): {str(e)}")
+        return cls(
+            BandwidthChannel(UPSTREAM, env_int('BANDWIDTH_UPSTREAM_KBPS', 0) * 1024, client_quota, weights, shared),
+            BandwidthChannel(DOWNSTREAM, env_int('BANDWIDTH_DOWNSTREAM_KBPS', 0) * 1024, client_quota, weights,
+                             shared),
+            trusted_proxies=env_int('BANDWIDTH_TRUSTED_PROXIES', 0),
+        )
+
+    def client(self, remote_addr, forwarded_for=None):
+        """Client key of a request for per-client quotas"""
+        return client_address(remote_addr, forwarded_for, self.trusted_proxies)
+
+    def download_hook(self, transfer):
+        """yt-dlp progress hook that paces a download through an upstream transfer"""
+        last = [0]
+        lock = threading.Lock()
+
+        def hook(d):
+            if d.get('status') != 'downloading':
+                return
+            done = d.get('downloaded_bytes') or 0
+            with lock:
+                # The count starts over for the audio file of a merged format
+                delta = done - last[0] if done >= last[0] else done
+                last[0] = done
+            if delta:
+                transfer.consume(delta)
+
+        return hook
+
+    def hand_to_proxy(self, headers, transfer):
+        """When nginx sends the file (X-Accel-Redirect), let it pace it instead; True if so"""
+        if 'X-Accel-Redirect' not in headers:
+            return False
+        if transfer.rate != UNLIMITED:
+            headers['X-Accel-Limit-Rate'] = str(int(transfer.rate))
+        transfer.close()
+        return True
+
+    def throttle_response(self, response, transfer):
+        """Pace a Flask response body through a downstream transfer"""
+        if not self.downstream.limited:
+            transfer.close()
+            return response
+        if self.hand_to_proxy(response.headers, transfer):
+            return response
+        if response.headers.get('X-Sendfile') or response.status_code == 304:
+            transfer.close()
+            return response
+        response.response = _ThrottledBody(response.response, transfer)
+        return response
+
+    def samples(self):
+        """Metrics collector: transfers and time spent held back per direction"""
+        samples = []
+        for channel in (self.upstream, self.downstream):
+            if not channel.limited:
+                continue
+            with channel._lock:
+                samples.append(('fralix_bandwidth_transfers', {'direction': channel.direction},
+                                len(channel._transfers)))
+                for priority, seconds in channel.throttled_seconds.items():
+                    samples.append(('fralix_bandwidth_throttled_seconds_total',
+                                    {'direction': channel.direction, 'priority': priority}, seconds))
+        return samples
+
+    def stats(self):
+        return {UPSTREAM: self.upstream.stats(), DOWNSTREAM: self.downstream.stats()}
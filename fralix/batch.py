@@ -0,0 +1,164 @@
+"""
+Batch analysis for /api/analyze/batch
+Many URLs (or a playlist / channel) are analyzed concurrently on a small
+thread pool instead of one request per URL. Collection URLs are first
+expanded with a flat extraction, which lists the entries without touching
+each video, and their entries join the same pool. Results are yielded as
+soon as each extraction finishes, so the response can be streamed as
+NDJSON and the whole batch takes about as long as its slowest item.
+"""
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from fralix.config import env_float, env_int
+from fralix.ratelimit import PlatformThrottled
+from fralix.urls import parse_video_url
+
+logger = logging.getLogger(__name__)
+
+# Options for listing a playlist's entries without extracting each of them
+FLAT_PLAYLIST_OPTIONS = {'extract_flat': 'in_playlist', 'lazy_playlist': True}
+
+
+def batch_settings():
+    """Limits from BATCH_* environment variables"""
+    return {
+        'max_urls': env_int('BATCH_MAX_URLS', 100),
+        'parallelism': max(env_int('BATCH_PARALLELISM', 4), 1),
+        'throttle_wait': env_float('BATCH_THROTTLE_WAIT', 30.0),
+    }
+
+
+def ndjson(record):
+    """Encode one record as a line of newline-delimited JSON"""
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def playlist_entries(info):
+    """Video URLs listed by a flat extraction (empty when info is a single video)"""
+    urls = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        url = entry.get('url') or entry.get('webpage_url')
+        if not url and entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if url:
+            urls.append(url)
+    return urls
+
+
+def _error_record(e):
+    if isinstance(e, PlatformThrottled):
+        return {'error': str(e), 'status': 503, 'retry_after': e.retry_after}
+    return {'error': f'Failed to analyze video: {str(e)}', 'status': 500}
+
+
+class BatchAnalyzer:
+    """Run analyze / expand callbacks for a list of URLs on a bounded pool"""
+
+    def __init__(self, analyze, expand, guard=None, max_urls=100, parallelism=4, throttle_wait=30.0):
+        # analyze(canonical_url, platform) -> video info dict
+        # expand(canonical_url, platform) -> flat yt-dlp info with 'entries'
+        self.analyze = analyze
+        self.expand = expand
+        self.guard = guard
+        self.max_urls = max_urls
+        self.parallelism = parallelism
+        self.throttle_wait = throttle_wait
+
+    def _patiently(self, func, url, platform):
+        """Call func, sitting out an empty token bucket (but never an open circuit)"""
+        deadline = time.time() + self.throttle_wait
+        while True:
+            try:
+                return func(url, platform)
+            except PlatformThrottled as e:
+                if self.guard is None or time.time() + e.retry_after > deadline:
+                    raise
+                # Raises again if the platform's circuit is what stopped us
+                self.guard.check(platform)
+                time.sleep(e.retry_after)
+
+    def run(self, urls):
+        """Yield one record per playlist and per video as each one completes, then a summary"""
+        started = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='batch')
+        pending = {}
+        seen = set()
+        counts = {'videos': 0, 'failed': 0, 'playlists': 0, 'skipped': 0}
+
+        def add_video(url, parsed, extra):
+            # Duplicates and videos past max_urls are only counted
+            if parsed.canonical_url in seen or len(seen) >= self.max_urls:
+                counts['skipped'] += 1
+                return
+            seen.add(parsed.canonical_url)
+            record = {'type': 'video', 'index': len(seen) - 1, 'url': url, **extra}
+            future = executor.submit(self._patiently, self.analyze, parsed.canonical_url, parsed.platform)
+            pending[future] = ('video', record, parsed)
+
+        def add(url, extra):
+            parsed = parse_video_url(url)
+            if parsed.platform == 'unknown':
+                return {'type': 'video', 'url': url, 'status': 400,
+                        'error': 'Unsupported platform. Please use YouTube, LinkedIn, X (Twitter), or Instagram.',
+                        **extra}
+            if parsed.video_id is None and not extra:
+                # Possibly a playlist or channel: list its entries first
+                record = {'type': 'playlist', 'url': url}
+                future = executor.submit(self._patiently, self.expand, parsed.canonical_url, parsed.platform)
+                pending[future] = ('playlist', record, parsed)
+                return None
+            add_video(url, parsed, extra)
+            return None
+
+        try:
+            for url in urls:
+                rejected = add(url, {})
+                if rejected:
+                    counts['failed'] += 1
+                    yield rejected
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, record, parsed = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Batch {kind} {record['url']} failed: {str(e)}")
+                        record.update(_error_record(e))
+                        counts['failed'] += 1
+                        yield record
+                        continue
+
+                    if kind == 'video':
+                        record['info'] = result
+                        counts['videos'] += 1
+                        yield record
+                        continue
+
+                    entries = playlist_entries(result)
+                    if not entries:
+                        # Not a collection after all: analyze it as a single video
+                        add_video(record['url'], parsed, {})
+                        continue
+                    counts['playlists'] += 1
+                    rejected = []
+                    for position, entry_url in enumerate(entries):
+                        entry_record = add(entry_url, {'playlist': record['url'], 'playlist_index': position})
+                        if entry_record:
+                            rejected.append(entry_record)
+                    record.update(title=result.get('title'), count=len(entries))
+                    yield record
+                    for entry_record in rejected:
+                        counts['failed'] += 1
+                        yield entry_record
+        finally:
+            # The client may have gone away: drop work that has not started yet
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        yield {'type': 'summary', **counts, 'elapsed': round(time.time() - started, 3)}
@@ -0,0 +1,149 @@
+"""
+Bulk downloads and streamed ZIP bundles
+A bulk job downloads several videos on a small thread pool into the
+artifact store, with yt-dlp fetching DASH/HLS fragments concurrently inside
+each download. The finished artifacts are then sent as one ZIP that is
+written on the fly: entries are stored (video is already compressed) and
+every chunk is yielded as soon as it is produced, so the archive never
+exists on disk or in memory as a whole.
+"""
+import os
+import threading
+import time
+import zipfile
+
+from fralix.config import env_int
+
+_ZIP_CHUNK = 256 * 1024
+
+
+def bulk_settings():
+    """Limits from BULK_* / DOWNLOAD_FRAGMENTS environment variables"""
+    return {
+        'max_items': env_int('BULK_MAX_ITEMS', 50),
+        'parallelism': max(env_int('BULK_PARALLELISM', 3), 1),
+        # Applies to every download, not only bulk ones
+        'fragments': max(env_int('DOWNLOAD_FRAGMENTS', 4), 1),
+    }
+
+
+class BulkProgress:
+    """Fold the progress hooks of parallel downloads into one job progress hook"""
+
+    def __init__(self, job_hook, total_items):
+        self.job_hook = job_hook
+        self.total_items = total_items
+        self.completed = 0
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def item_hook(self, index):
+        """yt-dlp progress hook for item index"""
+        def hook(d):
+            if d.get('status') not in ('downloading', 'finished'):
+                return
+            with self._lock:
+                self._items[index] = {
+                    'downloaded': d.get('downloaded_bytes') or d.get('total_bytes') or 0,
+                    'total': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+                    'speed': d.get('speed') if d.get('status') == 'downloading' else 0,
+                }
+            self._report()
+        return hook
+
+    def item_done(self, index, size=0):
+        """Mark item index as finished (size is used for items served from the store)"""
+        with self._lock:
+            self.completed += 1
+            item = self._items.setdefault(index, {'downloaded': size, 'total': size})
+            item['speed'] = 0
+        self._report()
+
+    def _report(self):
+        if self.job_hook is None:
+            return
+        with self._lock:
+            items = list(self._items.values())
+            completed = self.completed
+        speeds = [i['speed'] for i in items if i.get('speed')]
+        self.job_hook({
+            'status': 'downloading',
+            'downloaded_bytes': sum(i['downloaded'] for i in items),
+            # Only a lower bound until every item has reported its size
+            'total_bytes_estimate': sum(max(i['total'], i['downloaded']) for i in items) or None,
+            'speed': sum(speeds) if speeds else None,
+            'eta': None if completed < self.total_items else 0,
+        })
+
+
+def unique_names(names):
+    """Make archive member names unique by suffixing duplicates with (2), (3)..."""
+    taken = set()
+    unique = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        candidate = name
+        count = 1
+        while candidate.lower() in taken:
+            count += 1
+            candidate = f"{stem} ({count}){ext}"
+        taken.add(candidate.lower())
+        unique.append(candidate)
+    return unique
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object collecting what zipfile writes"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yield what was written since the last drain, if anything"""
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def zip_stream(entries, chunk_size=_ZIP_CHUNK):
+    """Yield a ZIP archive of (arcname, fileobj, mtime) entries chunk by chunk
+
+    Without a seekable output zipfile writes a data descriptor after each
+    member instead of patching its header, which is what makes streaming work.
+    The file objects are closed once the archive is done (or abandoned).
+    """
+    sink = _ChunkSink()
+    try:
+        with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for arcname, src, mtime in entries:
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(max(mtime, 315532800))[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                size = os.fstat(src.fileno()).st_size
+                with archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                    while True:
+                        block = src.read(chunk_size)
+                        if not block:
+                            break
+                        dest.write(block)
+                        yield from sink.drain()
+                src.close()
+                # Data descriptor of the member just written
+                yield from sink.drain()
+        # Central directory, written when the archive is closed
+        yield from sink.drain()
+    finally:
+        for _, src, _ in entries:
+            src.close()
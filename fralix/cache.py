@@ -0,0 +1,151 @@
+"""
+Metadata cache for /api/analyze
+Results of get_video_info are kept in a small SQLite database so that every
+gunicorn worker process reuses a recent extraction instead of asking the
+platform again. Entries expire after a TTL and the least recently used ones
+are evicted once the cache grows past its size limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from fralix.config import env_int, env_str
+from fralix.db import SQLiteBacked
+
+logger = logging.getLogger(__name__)
+
+# Options that change on every call (random user agent, headers) or only affect
+# logging must not change the cache key
+_VOLATILE_OPTIONS = ('user_agent', 'http_headers', 'referer', 'quiet', 'no_warnings', 'verbose')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def options_fingerprint(options):
+    """Hash the yt-dlp options that influence extraction results"""
+    stable = {k: v for k, v in (options or {}).items() if k not in _VOLATILE_OPTIONS}
+    encoded = json.dumps(stable, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+class MetadataCache(SQLiteBacked):
+    """TTL + LRU cache stored in SQLite and shared between processes"""
+
+    schema = _SCHEMA
+
+    def __init__(self, path, ttl=3600, max_entries=1000, enabled=True):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled and ttl > 0 and max_entries > 0
+
+        if self.enabled:
+            try:
+                self._init_db()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Metadata cache disabled ({path}): {str(e)}")
+                self.enabled = False
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build the cache from METADATA_CACHE_* environment variables"""
+        return cls(
+            env_str('METADATA_CACHE_PATH', os.path.join(default_dir, 'metadata.sqlite3')),
+            ttl=env_int('METADATA_CACHE_TTL', 3600),
+            max_entries=env_int('METADATA_CACHE_MAX_ENTRIES', 1000),
+        )
+
+    def make_key(self, platform, video_id, options=None):
+        """Build the cache key for a video and the options used to extract it"""
+        return f"{platform}:{video_id}:{options_fingerprint(options)}"
+
+    def _count(self, conn, name):
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def get(self, key):
+        """Return the cached value for key, or None when missing or expired"""
+        if not self.enabled:
+            return None
+        try:
+            conn = self._connect()
+            now = time.time()
+            row = conn.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._count(conn, 'misses')
+                return None
+            conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self._count(conn, 'hits')
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Metadata cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        """Store value under key and evict expired / least recently used entries"""
+        if not self.enabled:
+            return
+        try:
+            self._transaction(self._store, key, json.dumps(value), time.time())
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Metadata cache write failed: {str(e)}")
+
+    def _store(self, conn, key, value, now):
+        conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, value, now + self.ttl, now)
+        )
+        conn.execute('DELETE FROM entries WHERE expires < ?', (now,))
+        conn.execute(
+            'DELETE FROM entries WHERE key IN ('
+            'SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        """Drop every cached entry"""
+        if self.enabled:
+            self._connect().execute('DELETE FROM entries')
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries"""
+        if not self.enabled:
+            return {'enabled': False}
+        try:
+            conn = self._connect()
+            counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            entries = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        except sqlite3.Error as e:
+            return {'enabled': True, 'error': str(e)}
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        total = hits + misses
+        return {
+            'enabled': True,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,141 @@
+"""
+Serverless cold-start helpers
+A default YoutubeDL registers yt-dlp's whole extractor list (well over a
+thousand classes) and the first extraction tries their URL patterns one
+after another, which costs more than importing yt-dlp itself. Only a few of
+them can ever match the canonical URLs parse_video_url hands out, so
+ExtractorSet can build instances that register just the extractors of the
+supported platforms. Extractors those delegate to by key (an embedded
+YouTube video in a tweet, say) are still resolved by yt-dlp on demand.
+
+StartupTimer keeps how long each start-up step of the process took so cold
+starts show up on /debug and /metrics.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from fralix.config import env_bool, env_str
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp extractor keys for the URLs of every supported platform: single
+# posts plus the playlist and channel pages that batch analysis expands
+PLATFORM_EXTRACTORS = {
+    'youtube': ('Youtube', 'YoutubeClip', 'YoutubeTab', 'YoutubePlaylist', 'YoutubeYtBe'),
+    'twitter': ('Twitter', 'TwitterCard', 'TwitterBroadcast', 'TwitterAmplify'),
+    'instagram': ('Instagram', 'InstagramIOS', 'InstagramStory'),
+    'linkedin': ('LinkedIn', 'LinkedInEvents'),
+}
+
+
+def coldstart_settings():
+    """Extractor loading and pre-warming of the serverless entry"""
+    extractors = env_str('YTDLP_EXTRACTORS', 'platforms').lower()
+    if extractors not in ('platforms', 'all'):
+        logger.warning(f"Unknown YTDLP_EXTRACTORS={extractors}, using 'platforms'")
+        extractors = 'platforms'
+    return {
+        'extractors': extractors,
+        'prewarm': env_bool('COLDSTART_PREWARM', False),
+    }
+
+
+class StartupTimer:
+    """Durations of the start-up steps of this process"""
+
+    def __init__(self):
+        self._steps = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = None
+
+    def record(self, step, seconds):
+        """Keep the duration of a step; only the first one of each name counts"""
+        with self._lock:
+            if step in self._steps:
+                return
+            self._steps[step] = seconds
+            metrics = self._metrics
+        if metrics is not None:
+            metrics.observe('fralix_startup_seconds', seconds, step=step)
+
+    @contextmanager
+    def step(self, name):
+        """Record how long the block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def done(self, step):
+        with self._lock:
+            return step in self._steps
+
+    def attach(self, metrics):
+        """Report recorded and future steps as fralix_startup_seconds"""
+        with self._lock:
+            self._metrics = metrics
+            steps = list(self._steps.items())
+        for step, seconds in steps:
+            metrics.observe('fralix_startup_seconds', seconds, step=step)
+
+    def stats(self):
+        with self._lock:
+            return {step: round(seconds, 4) for step, seconds in self._steps.items()}
+
+
+class ExtractorSet:
+    """Builds YoutubeDL instances with every extractor or only the supported platforms' ones"""
+
+    def __init__(self, mode='platforms', timer=None):
+        self.mode = mode
+        self.timer = timer
+        self._classes = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, timer=None):
+        return cls(settings['extractors'], timer)
+
+    def classes(self):
+        """Extractor classes of the supported platforms, resolved once per process"""
+        if self._classes is None:
+            with self._lock:
+                if self._classes is None:
+                    started = time.perf_counter()
+                    self._classes = self._resolve()
+                    if self.timer is not None:
+                        self.timer.record('resolve_extractors', time.perf_counter() - started)
+        return self._classes
+
+    def _resolve(self):
+        from yt_dlp.extractor import get_info_extractor
+
+        classes = []
+        for keys in PLATFORM_EXTRACTORS.values():
+            for key in keys:
+                try:
+                    classes.append(get_info_extractor(key))
+                except KeyError:
+                    # Extractors get renamed or merged between yt-dlp releases
+                    logger.warning(f"yt-dlp has no {key} extractor, skipping it")
+        return classes
+
+    def build(self, ytdlp, options):
+        """Create a YoutubeDL for options"""
+        if self.mode == 'all':
+            return ytdlp.YoutubeDL(options)
+        ydl = ytdlp.YoutubeDL(options, auto_init=False)
+        for klass in self.classes():
+            ydl.add_info_extractor(klass)
+        return ydl
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'resolved': self._classes is not None,
+            'extractors': len(self._classes) if self._classes is not None else None,
+        }
@@ -0,0 +1,35 @@
+"""
+Environment variable helpers
+Every tunable in the backend can be overridden through the environment (see render.yaml)
+"""
+import os
+
+
+def env_str(name, default=None):
+    """Read a string setting, treating empty values as unset"""
+    value = os.environ.get(name, '').strip()
+    return value if value else default
+
+
+def env_int(name, default):
+    """Read an integer setting, falling back to the default on bad input"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name, default):
+    """Read a float setting, falling back to the default on bad input"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name, default=False):
+    """Read a boolean setting (1/true/yes/on)"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,45 @@
+"""
+SQLite plumbing shared by the cache and the artifact store
+Each thread gets its own connection; WAL mode lets several gunicorn
+worker processes read and write the same file concurrently.
+"""
+import os
+import sqlite3
+import threading
+
+
+class SQLiteBacked:
+    """Base class for components that keep their state in a SQLite file"""
+
+    schema = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _init_db(self):
+        """Create the database file and schema"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connect().executescript(self.schema)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, func, *args):
+        """Run func(conn, *args) inside a write transaction"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn, *args)
+            conn.execute('COMMIT')
+            return result
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
@@ -0,0 +1,101 @@
+"""
+Serving stored artifacts
+Artifacts never change once published, so each gets a strong ETag derived
+from its index entry. Werkzeug's conditional responses then take care of
+Range / If-Range / If-None-Match / If-Modified-Since, letting interrupted
+downloads resume instead of restarting from zero.
+
+Setting FILE_OFFLOAD hands the byte transfer to the front proxy:
+  nginx    - empty response with X-Accel-Redirect: <FILE_OFFLOAD_PREFIX><filename>
+  sendfile - X-Sendfile header with the absolute path (Apache, lighttpd)
+
+Preview thumbnails and the built static assets (fralix.assets) are served
+with long-lived Cache-Control headers instead, since their URLs change
+whenever their content does.
+"""
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, send_file
+from werkzeug.security import safe_join
+
+from fralix.assets import ENCODINGS, IMMUTABLE_MAX_AGE
+from fralix.config import env_str
+from fralix.streaming import content_disposition
+
+OFFLOAD_MODES = ('nginx', 'sendfile')
+
+
+def offload_settings():
+    """Front-proxy offload mode and internal location from the environment"""
+    mode = (env_str('FILE_OFFLOAD', '') or '').lower()
+    return {
+        'offload': mode if mode in OFFLOAD_MODES else None,
+        'accel_prefix': env_str('FILE_OFFLOAD_PREFIX', '/protected-downloads/'),
+    }
+
+
+def artifact_etag(artifact):
+    """Strong validator for a published artifact"""
+    seed = f"{artifact['key']}:{artifact['size']}:{artifact['created']}"
+    return hashlib.sha1(seed.encode('utf-8')).hexdigest()[:32]
+
+
+def serve_artifact(artifact, offload=None, accel_prefix='/protected-downloads/'):
+    """Build the response that sends an artifact to the browser"""
+    if offload == 'nginx':
+        # nginx serves the file from an internal location, including ranges and validators
+        mimetype = mimetypes.guess_type(artifact['filename'])[0] or 'application/octet-stream'
+        response = Response(status=200, mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + artifact['filename']
+        response.headers['Content-Disposition'] = content_disposition(artifact['download_name'])
+        response.headers['X-Accel-Buffering'] = 'yes'
+        return response
+
+    response = send_file(
+        artifact['path'],
+        as_attachment=True,
+        download_name=artifact['download_name'],
+        conditional=True,
+        etag=artifact_etag(artifact),
+        last_modified=artifact['created'],
+        max_age=0,
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_thumbnail(entry, max_age):
+    """Send a cached preview thumbnail; it only changes when the video's source does"""
+    return send_file(
+        entry['path'],
+        mimetype=entry['mimetype'],
+        conditional=True,
+        etag=entry['etag'],
+        last_modified=entry['created'],
+        max_age=max_age,
+    )
+
+
+def serve_asset(dist_dir, filename, accept_encodings):
+    """Send a built static asset, precompressed when the browser accepts it; None when missing"""
+    path = safe_join(dist_dir, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+    response = send_file(
+        path,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        conditional=True,
+        max_age=IMMUTABLE_MAX_AGE,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,203 @@
+"""
+Format ranking and size estimation
+yt-dlp lists formats in its own order and often without a filesize. The
+ranking turns them into the choices users pick from: single-file formats
+plus, when ffmpeg is there to merge them, adaptive video streams paired
+with the best audio stream in a matching container. Sizes come from
+filesize, filesize_approx or the average bitrate times the duration.
+Entries users cannot tell apart (same height, frame rate class, codec
+family and container) collapse into the smallest one, and the list runs
+from the highest resolution down.
+
+smallest_format implements the "smallest file meeting a target resolution
+and codec" preset; preset_selector is the yt-dlp selector equivalent for
+when no analysis is at hand. likely_format guesses the choice a speculative
+prefetch fetches ahead of the user.
+"""
+import re
+import shutil
+
+from fralix.config import env_bool, env_int
+
+# Codec families users choose between, matched against yt-dlp's vcodec strings
+CODEC_PATTERNS = {
+    'h264': r'^(avc|h264)',
+    'h265': r'^(hev|hvc|h265)',
+    'vp9': r'^vp0?9',
+    'av1': r'^av0?1',
+}
+
+# Audio containers that merge with a video container without re-encoding
+_AUDIO_FOR_VIDEO = {'mp4': ('m4a', 'mp4'), 'webm': ('webm',)}
+
+_RESOLUTION = re.compile(r'^(\d+)x(\d+)$')
+
+
+def format_settings():
+    """Whether adaptive pairs are offered (needs ffmpeg) and how many formats to list"""
+    return {
+        'merge': env_bool('FORMAT_MERGE', shutil.which('ffmpeg') is not None),
+        'limit': env_int('FORMAT_LIST_LIMIT', 10),
+    }
+
+
+def codec_family(codec):
+    """Map a yt-dlp codec string (avc1.64001F, vp09.00.40.08...) onto a family name"""
+    if not codec or codec == 'none':
+        return None
+    codec = codec.lower()
+    for family, pattern in CODEC_PATTERNS.items():
+        if re.match(pattern, codec):
+            return family
+    return codec.split('.')[0]
+
+
+def estimate_size(fmt, duration):
+    """Return (bytes, estimated) for a format, or (None, True) when nothing is known"""
+    if fmt.get('filesize'):
+        return int(fmt['filesize']), False
+    if fmt.get('filesize_approx'):
+        return int(fmt['filesize_approx']), True
+    # tbr is the average total bitrate in kbit/s
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration), True
+    return None, True
+
+
+def _height(fmt):
+    if fmt.get('height'):
+        return int(fmt['height'])
+    match = _RESOLUTION.match(fmt.get('resolution') or '')
+    return int(match.group(2)) if match else None
+
+
+def _has_video(fmt):
+    return fmt.get('vcodec') != 'none'
+
+
+def _has_audio(fmt):
+    return fmt.get('acodec') != 'none'
+
+
+def _playable(fmt):
+    # Storyboards and other image tracks are listed as formats too
+    return fmt.get('protocol') != 'mhtml' and fmt.get('ext') not in ('mhtml', 'jpg', 'webp')
+
+
+def _best_audio(audio, video_ext):
+    """Highest-bitrate audio stream that merges with video_ext, or any when none does"""
+    compatible = [a for a in audio if a.get('ext') in _AUDIO_FOR_VIDEO.get(video_ext, ())]
+    candidates = compatible or audio
+    if not candidates:
+        return None
+    return max(candidates, key=lambda a: (a.get('abr') or a.get('tbr') or 0, a.get('quality') or 0))
+
+
+def _entry(fmt, duration, audio=None):
+    size, estimated = estimate_size(fmt, duration)
+    if audio is not None:
+        audio_size, audio_estimated = estimate_size(audio, duration)
+        size = size + audio_size if size is not None and audio_size is not None else None
+        estimated = estimated or audio_estimated
+    height = _height(fmt)
+    tbr = (fmt.get('tbr') or 0) + ((audio.get('tbr') or audio.get('abr') or 0) if audio is not None else 0)
+    return {
+        'format_id': fmt.get('format_id') if audio is None else f"{fmt.get('format_id')}+{audio.get('format_id')}",
+        'ext': fmt.get('ext', 'mp4'),
+        'resolution': fmt.get('resolution') or (f'{height}p' if height else 'unknown'),
+        'height': height,
+        'fps': fmt.get('fps'),
+        'vcodec': codec_family(fmt.get('vcodec')),
+        'acodec': codec_family((audio or fmt).get('acodec')),
+        'tbr': round(tbr) if tbr else None,
+        'quality': fmt.get('quality', 0),
+        'filesize': size or 0,
+        'filesize_estimated': bool(size) and estimated,
+        'merged': audio is not None,
+    }
+
+
+def _size_order(entry):
+    # Unknown sizes last; a single file beats a merge of the same size
+    return (not entry['filesize'], entry['filesize'], entry['merged'])
+
+
+def rank_formats(info, merge=False, limit=10):
+    """Deduplicated formats of an extracted video, highest resolution first"""
+    duration = info.get('duration') or 0
+    formats = [f for f in info.get('formats') or () if _playable(f)]
+
+    entries = [_entry(f, duration) for f in formats if _has_video(f) and _has_audio(f)]
+    if merge:
+        audio = [f for f in formats if _has_audio(f) and not _has_video(f)]
+        for fmt in formats:
+            if _has_video(fmt) and not _has_audio(fmt):
+                best_audio = _best_audio(audio, fmt.get('ext'))
+                if best_audio is not None:
+                    entries.append(_entry(fmt, duration, best_audio))
+
+    # Keep the smallest of the entries that look the same to users
+    unique = {}
+    for entry in sorted(entries, key=_size_order):
+        fps_class = 'high' if (entry['fps'] or 0) > 30 else 'standard'
+        unique.setdefault((entry['height'], fps_class, entry['vcodec'], entry['ext']), entry)
+
+    ranked = sorted(unique.values(), key=lambda e: (-(e['height'] or 0), -(e['fps'] or 0),) + _size_order(e))
+    return ranked[:limit]
+
+
+def smallest_format(formats, height=None, codec=None):
+    """Smallest ranked format at least height pixels tall in the codec family
+
+    Falls back to the tallest format of the codec family when none reaches
+    the target; returns None when the codec matches nothing.
+    """
+    candidates = [f for f in formats if codec is None or f.get('vcodec') == codec]
+    if not candidates:
+        return None
+    meeting = [f for f in candidates if height is None or (f.get('height') or 0) >= height]
+    if not meeting:
+        return max(candidates, key=lambda f: ((f.get('height') or 0), -(f.get('filesize') or 0)))
+    return min(meeting, key=lambda f: (not f.get('filesize'), f.get('filesize') or 0, f.get('height') or 0))
+
+
+def likely_format(formats, max_bytes):
+    """The ranked format users most likely pick: the best single MP4 file of known size up to max_bytes
+
+    Falls back to any single-file container; returns None when nothing
+    fits, so a speculative download never runs unbounded.
+    """
+    fitting = [f for f in formats if not f.get('merged') and 0 < (f.get('filesize') or 0) <= max_bytes]
+    for fmt in fitting:
+        if fmt.get('ext') == 'mp4':
+            return fmt
+    return fitting[0] if fitting else None
+
+
+def preset_selector(height=None, codec=None, merge=False):
+    """yt-dlp format selector for the smallest-file preset
+
+    'worst' under yt-dlp's default sort is the lowest resolution that passes
+    the filters; when nothing does, the best format of the codec (or at all)
+    is still below the target, like smallest_format's fallback.
+    """
+    codec_filter = f"[vcodec~='{CODEC_PATTERNS.get(codec, re.escape(codec))}']" if codec else ''
+    filters = (f'[height>={int(height)}]' if height else '') + codec_filter
+    choices = [f'wv*{filters}+ba', f'w{filters}', f'bv*{codec_filter}+ba', f'b{codec_filter}', 'b']
+    if not merge:
+        choices = [choice for choice in choices if '+' not in choice]
+    # Drop repeats (no filters at all) while keeping the order
+    return '/'.join(dict.fromkeys(choices))
+
+
+def preset_request(data):
+    """(height, codec) of the smallest-file preset in a request body; ValueError on bad values"""
+    height = data.get('height')
+    codec = data.get('codec') or None
+    try:
+        height = int(height) if height not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('height must be a number of pixels')
+    if codec is not None and codec not in CODEC_PATTERNS:
+        raise ValueError(f"codec must be one of {', '.join(CODEC_PATTERNS)}")
+    return height, codec
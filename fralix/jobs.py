@@ -0,0 +1,443 @@
+"""
+Background download jobs
+/api/download hands the actual yt-dlp work to a bounded thread pool and
+returns a job ID straight away. Progress reported by yt-dlp's
+progress_hooks is kept on the job and mirrored to a small JSON file so
+any worker process can answer status requests for it.
+
+Submitting a job with a key that is already queued or running (the same
+video and format) returns the existing job instead of starting a second
+download; a marker file per key makes this work across worker processes.
+
+Given a WorkQueue (WORKER_QUEUE), the manager only enqueues: worker.py
+processes lease the jobs and run them through run_queued, writing the same
+state files the web processes answer status requests from.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fralix.config import env_bool, env_int
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+ERROR = 'error'
+TERMINAL_STATES = (FINISHED, ERROR)
+
+
+class JobError(Exception):
+    """Job failure carrying the HTTP status the client should see"""
+
+    def __init__(self, message, status=500, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class Job:
+    """State of one download job"""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.retry_after = None
+
+    def to_dict(self):
+        progress = None
+        if self.total_bytes:
+            progress = round(min(self.downloaded_bytes / self.total_bytes, 1.0) * 100, 1)
+        return {
+            'job_id': self.id,
+            'state': self.state,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'progress': progress,
+            'speed': self.speed,
+            'eta': self.eta,
+            'result': self.result,
+            'error': self.error,
+            'error_status': self.error_status,
+            'retry_after': self.retry_after,
+        }
+
+
+class JobManager:
+    """Runs jobs on a bounded pool and tracks their progress"""
+
+    def __init__(self, state_dir, max_workers=2, max_pending=16, inline=False, ttl=3600, stale_after=300,
+                 queue=None):
+        self.state_dir = state_dir
+        self.queue = queue
+        # Threads of worker.py running queued jobs in this process
+        self.queue_workers = 0
+        self.max_workers = max_workers
+        self.stale_after = stale_after
+        self.deduplicated = 0
+        self.max_pending = max_pending
+        self.inline = inline
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._executor = None if inline or queue is not None else ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='download-job'
+        )
+        os.makedirs(state_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, state_dir, inline=False, queue=None):
+        """Build the manager from DOWNLOAD_* environment variables"""
+        return cls(
+            state_dir,
+            max_workers=env_int('DOWNLOAD_WORKERS', 2),
+            max_pending=env_int('DOWNLOAD_QUEUE_SIZE', 16),
+            inline=env_bool('DOWNLOAD_JOBS_INLINE', inline),
+            ttl=env_int('DOWNLOAD_JOB_TTL', 3600),
+            queue=queue,
+        )
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _persist(self, job):
+        """Write the job state atomically so other workers can read it"""
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not persist job {job.id}: {str(e)}")
+
+    def _prune(self):
+        """Forget jobs that finished more than ttl seconds ago"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values()
+                           if j.state in TERMINAL_STATES and (j.finished or 0) < cutoff]:
+                del self._jobs[job_id]
+        try:
+            for name in os.listdir(self.state_dir):
+                path = os.path.join(self.state_dir, name)
+                if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def _marker_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.state_dir, f"active-{digest}")
+
+    def _active_job_for(self, key):
+        """Return the live job registered for key, clearing stale markers"""
+        path = self._marker_path(key)
+        try:
+            with open(path) as f:
+                job_id = f.read().strip()
+        except OSError:
+            return None
+        job = self.get(job_id)
+        if job is not None and job['state'] not in TERMINAL_STATES:
+            with self._lock:
+                if job_id in self._jobs:
+                    return job
+            # Waiting in the queue, or leased by a worker that still heartbeats
+            if self.queue is not None and self.queue.alive(job_id):
+                return job
+            # A job whose state file stopped changing belongs to a dead worker
+            try:
+                if time.time() - os.path.getmtime(self._state_path(job_id)) < self.stale_after:
+                    return job
+            except OSError:
+                pass
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    def _claim(self, key, job_id):
+        """Register job_id as the active job for key, or return the job that already is"""
+        path = self._marker_path(key)
+        tmp_path = f"{path}.{job_id}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(job_id)
+        try:
+            for _ in range(3):
+                try:
+                    # link() fails if the marker exists, so exactly one job wins
+                    os.link(tmp_path, path)
+                    return None
+                except FileExistsError:
+                    existing = self._active_job_for(key)
+                    if existing is not None:
+                        return existing
+            # Could not settle ownership; run without deduplication
+            return None
+        finally:
+            os.remove(tmp_path)
+
+    def _release(self, key, job_id):
+        path = self._marker_path(key)
+        try:
+            with open(path) as f:
+                owner = f.read().strip()
+            if owner == job_id:
+                os.remove(path)
+        except OSError:
+            pass
+
+    def pending(self):
+        """Number of jobs queued or running in this process, or in the whole queue"""
+        if self.queue is not None:
+            return self.queue.depth()
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.state not in TERMINAL_STATES)
+
+    def stats(self):
+        """Jobs of this process by state, plus the worker pool size"""
+        with self._lock:
+            states = [j.state for j in self._jobs.values()]
+        return {
+            QUEUED: states.count(QUEUED),
+            RUNNING: states.count(RUNNING),
+            'workers': self.queue_workers if self.queue is not None else 0 if self.inline else self.max_workers,
+            'deduplicated': self.deduplicated,
+        }
+
+    def submit(self, func, *args, key=None, **kwargs):
+        """Queue func(*args, progress_hook=..., **kwargs) and return the job state
+
+        Jobs with the same key share one execution while it is in flight.
+        """
+        self._prune()
+        if key is not None:
+            existing = self._active_job_for(key)
+            if existing is not None:
+                with self._lock:
+                    self.deduplicated += 1
+                existing['deduplicated'] = True
+                return existing
+        if self.pending() >= self.max_pending:
+            raise QueueFull('Too many downloads in progress, please try again shortly')
+
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._persist(job)
+
+        if key is not None:
+            existing = self._claim(key, job.id)
+            if existing is not None:
+                # Lost the race to another request for the same key
+                with self._lock:
+                    del self._jobs[job.id]
+                    self.deduplicated += 1
+                os.remove(self._state_path(job.id))
+                existing['deduplicated'] = True
+                return existing
+
+        if self.queue is not None:
+            return self._enqueue(job, func, args, kwargs, key)
+        self._start_heartbeat()
+        if self.inline:
+            self._run(job, func, args, kwargs, key)
+        else:
+            self._executor.submit(self._run, job, func, args, kwargs, key)
+        return self.get(job.id)
+
+    def _enqueue(self, job, func, args, kwargs, key=None):
+        """Hand a new job to the worker tier; the state file stays the source of its progress"""
+        with self._lock:
+            del self._jobs[job.id]
+        try:
+            self.queue.put(job.id, func.__name__, args, kwargs, key)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Could not enqueue job {job.id}: {str(e)}")
+            if key is not None:
+                self._release(key, job.id)
+            os.remove(self._state_path(job.id))
+            raise QueueFull('The download queue is unavailable, please try again shortly')
+        return self.get(job.id)
+
+    def run_queued(self, entry, func):
+        """Run a job leased from the queue (in worker.py) and record its outcome in the shared state file"""
+        self._prune()
+        job = Job(entry['job_id'])
+        state = self.get(job.id)
+        if state is not None:
+            if state['state'] in TERMINAL_STATES:
+                # Finished just before its worker died, without removing the lease
+                return
+            job.created = state.get('created') or job.created
+        with self._lock:
+            self._jobs[job.id] = job
+        self._run(job, func, entry['args'], entry['kwargs'], entry.get('key'))
+
+    def fail_queued(self, entry, message, status=500):
+        """Fail a queued job that will not run (abandoned too often, unknown task)"""
+        job = Job(entry['job_id'])
+        state = self.get(job.id) or {}
+        job.created = state.get('created') or job.created
+        job.state = ERROR
+        job.error = message
+        job.error_status = status
+        job.finished = time.time()
+        self._persist(job)
+        if entry.get('key') is not None:
+            self._release(entry['key'], job.id)
+
+    def touch(self, job_id):
+        """Keep a running job's state file fresh between progress updates (extraction, ffmpeg)"""
+        try:
+            os.utime(self._state_path(os.path.basename(job_id)))
+        except OSError:
+            pass
+
+    def _start_heartbeat(self):
+        """Start the thread keeping this process's live jobs from looking abandoned, once"""
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(target=self._heartbeat_forever, name='job-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_forever(self):
+        # Progress hooks go quiet during extraction, throttle waits and ffmpeg, which can outlast stale_after
+        interval = max(self.stale_after / 3, 1)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                live = [j.id for j in self._jobs.values() if j.state not in TERMINAL_STATES]
+            for job_id in live:
+                self.touch(job_id)
+
+    def _run(self, job, func, args, kwargs, key=None):
+        job.state = RUNNING
+        job.started = time.time()
+        self._persist(job)
+        try:
+            job.result = func(*args, progress_hook=self._progress_hook(job), **kwargs)
+            job.state = FINISHED
+        except JobError as e:
+            job.error = str(e)
+            job.error_status = e.status
+            job.retry_after = e.retry_after
+            job.state = ERROR
+        except Exception as e:
+            logger.error(f"Download job {job.id} crashed: {str(e)}")
+            job.error = f'Download failed: {str(e)}'
+            job.error_status = 500
+            job.state = ERROR
+        job.finished = time.time()
+        self._persist(job)
+        if key is not None:
+            self._release(key, job.id)
+
+    def _progress_hook(self, job):
+        """Build a yt-dlp progress hook that updates job"""
+        last_write = [0.0]
+
+        def hook(d):
+            if d.get('status') == 'downloading':
+                job.downloaded_bytes = d.get('downloaded_bytes') or 0
+                job.total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+                job.speed = d.get('speed')
+                job.eta = d.get('eta')
+            elif d.get('status') == 'finished':
+                job.downloaded_bytes = d.get('total_bytes') or job.downloaded_bytes
+                job.total_bytes = job.total_bytes or job.downloaded_bytes
+                job.eta = 0
+            # Throttle file writes; yt-dlp calls hooks for every chunk
+            now = time.monotonic()
+            if now - last_write[0] >= 0.5 or d.get('status') == 'finished':
+                last_write[0] = now
+                self._persist(job)
+
+        return hook
+
+    def get(self, job_id):
+        """Return the job state as a dict, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # The job may belong to another worker process
+        try:
+            with open(self._state_path(os.path.basename(job_id))) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stream(self, job_id, interval=0.5, timeout=25, retry=1000):
+        """Yield Server-Sent Events with the job state until it finishes or timeout passes
+
+        Each subscriber holds a server thread, so the connection is kept short
+        and the retry hint has EventSource reconnect after retry milliseconds.
+        """
+        deadline = time.monotonic() + timeout
+        last = None
+        yield f"retry: {retry}\n\n"
+        while time.monotonic() < deadline:
+            state = self.get(job_id)
+            if state is None:
+                yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+                return
+            payload = json.dumps(state)
+            if payload != last:
+                last = payload
+                yield f"data: {payload}\n\n"
+            if state['state'] in TERMINAL_STATES:
+                return
+            time.sleep(interval)
+
+
+def completed_job(result):
+    """Job-shaped response for work that needed no job (e.g. a stored artifact)"""
+    job = Job(None)
+    job.state = FINISHED
+    job.started = job.finished = job.created
+    job.result = result
+    return job.to_dict()
+
+
+def job_http_status(job):
+    """HTTP status to send with a job's state"""
+    if job['state'] == ERROR:
+        return job.get('error_status') or 500
+    if job['state'] == FINISHED:
+        return 200
+    return 202
+
+
+def job_headers(job):
+    """Extra response headers for a job's state (Retry-After on throttled failures)"""
+    if job['state'] == ERROR and job.get('retry_after'):
+        return {'Retry-After': str(job['retry_after'])}
+    return {}
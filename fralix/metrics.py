@@ -0,0 +1,523 @@
+"""
+Prometheus metrics
+Counters and histograms are recorded into a per-thread shard, so the hot
+path never takes a lock; shards are only summed when /metrics is scraped.
+Every worker process also writes its totals to a small JSON snapshot under
+the metrics directory every few seconds, and the process answering the
+scrape merges the snapshots of all live workers with its own numbers.
+
+Values that already live in shared storage (metadata cache, platform guard,
+download store) are read by collectors at scrape time instead.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from fralix.config import env_bool, env_float, env_str
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+THROUGHPUT_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 19, 2))  # 64 KiB/s .. 256 MiB/s
+
+# name: (type, help, buckets)
+DEFINITIONS = {
+    'fralix_phase_duration_seconds': (
+        HISTOGRAM, 'Time spent per platform in each phase (extract, download, publish, serve, stream, thumbnail...)',
+        LATENCY_BUCKETS),
+    'fralix_http_requests_total': (COUNTER, 'HTTP requests handled, by endpoint and status', None),
+    'fralix_http_request_duration_seconds': (
+        HISTOGRAM, 'Time until the handler returned, by endpoint (bodies stream afterwards)', LATENCY_BUCKETS),
+    'fralix_bytes_total': (COUNTER, 'Media bytes downloaded from platforms and served to clients', None),
+    'fralix_download_throughput_bytes_per_second': (
+        HISTOGRAM, 'Average speed of each finished download', THROUGHPUT_BUCKETS),
+    'fralix_download_resumed_bytes_total': (
+        COUNTER, 'Bytes of partial downloads continued instead of fetched again', None),
+    'fralix_extraction_retries_total': (COUNTER, 'Extractions retried after a bot-detection error', None),
+    'fralix_platform_outcomes_total': (COUNTER, 'Outcomes recorded by the platform guard (all workers)', None),
+    'fralix_platform_circuit_state': (GAUGE, 'Circuit breaker state: 0 closed, 1 half open, 2 open', None),
+    'fralix_metadata_cache_requests_total': (COUNTER, 'Metadata cache lookups by result (all workers)', None),
+    'fralix_metadata_cache_entries': (GAUGE, 'Entries in the metadata cache', None),
+    'fralix_thumbnail_requests_total': (COUNTER, 'Thumbnail proxy requests by result (hit, fetched, error)', None),
+    'fralix_store_bytes': (GAUGE, 'Bytes used by the download store', None),
+    'fralix_store_quota_bytes': (GAUGE, 'Byte quota of the download store', None),
+    'fralix_store_artifacts': (GAUGE, 'Files in the download store', None),
+    'fralix_jobs': (GAUGE, 'Download jobs by state', None),
+    'fralix_job_workers': (GAUGE, 'Download job worker threads', None),
+    'fralix_analyze_in_flight': (GAUGE, 'Distinct extractions currently running', None),
+    'fralix_ydl_pool_idle': (GAUGE, 'Idle pooled YoutubeDL instances', None),
+    'fralix_async_blocking_calls': (GAUGE, 'Blocking calls of async handlers running or queued (ASGI mode)', None),
+    'fralix_async_transfers': (GAUGE, 'File transfers in progress on the event loop (ASGI mode)', None),
+    'fralix_bandwidth_transfers': (GAUGE, 'Transfers sharing a bandwidth cap, by direction', None),
+    'fralix_bandwidth_throttled_seconds_total': (
+        COUNTER, 'Time transfers were held back to stay within their bandwidth share', None),
+    'fralix_postprocess_total': (COUNTER, 'Audio conversions by target and result (done, error, busy)', None),
+    'fralix_postprocess_in_flight': (GAUGE, 'Audio conversions running or queued on the ffmpeg pool', None),
+    'fralix_postprocess_cpu_seconds_total': (COUNTER, 'CPU seconds used by ffmpeg conversions', None),
+    'fralix_prefetch_total': (
+        COUNTER, 'Speculative downloads by result (started, skipped, adopted, cancelled, done)', None),
+    'fralix_prefetch_wasted_bytes': (GAUGE, 'Bytes fetched by prefetches nobody adopted in the last hour', None),
+    'fralix_queue_jobs': (GAUGE, 'Jobs in the worker tier queue by state (pending, leased)', None),
+    'fralix_queue_abandoned_total': (
+        COUNTER, 'Leases of dead or hung workers by outcome (retried, failed)', None),
+    'fralix_worker_processes': (GAUGE, 'Worker processes contributing to these metrics', None),
+    'fralix_startup_seconds': (HISTOGRAM, 'Duration of each start-up step, once per process', LATENCY_BUCKETS),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class _Shard:
+    """Counters and histograms written by one thread only"""
+
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.counters = {}
+        # (name, labels) -> per-bucket counts + [sum, count]
+        self.histograms = {}
+
+
+class _CountingBody:
+    """Response body that counts the bytes it yields and reports when closed"""
+
+    def __init__(self, body, sent, on_close):
+        self._body = body
+        self._sent = sent
+        self._on_close = on_close
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._sent[0] += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+class _Totals:
+    """Merged view of shards and snapshots"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def add_counter(self, key, value):
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_histogram(self, key, values):
+        current = self.histograms.get(key)
+        if current is None or len(current) != len(values):
+            self.histograms[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                current[i] += value
+
+    def add_gauge(self, key, value):
+        self.gauges[key] = self.gauges.get(key, 0) + value
+
+
+class Metrics:
+    """Low-overhead metrics registry rendered in the Prometheus text format"""
+
+    def __init__(self, snapshot_dir=None, flush_interval=5.0, enabled=True):
+        self.enabled = enabled
+        self.snapshot_dir = snapshot_dir if enabled else None
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = _Shard()
+        self._gauges = {}
+        self._collectors = []
+        self._phase_listeners = []
+        self._flusher = None
+        if self.snapshot_dir:
+            try:
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Metrics snapshots disabled ({snapshot_dir}): {str(e)}")
+                self.snapshot_dir = None
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build the registry from METRICS_* environment variables"""
+        return cls(
+            env_str('METRICS_DIR', os.path.join(default_dir, 'metrics')),
+            flush_interval=env_float('METRICS_FLUSH_INTERVAL', 5.0),
+            enabled=env_bool('METRICS_ENABLED', True),
+        )
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Once per thread; every later update is lock-free
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            self._start_flusher()
+        return shard
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        if not self.enabled:
+            return
+        counters = self._shard().counters
+        key = (name, _labels_key(labels))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation"""
+        if not self.enabled:
+            return
+        buckets = DEFINITIONS[name][2]
+        histograms = self._shard().histograms
+        key = (name, _labels_key(labels))
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(buckets) + 3)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def set(self, name, value, **labels):
+        """Set a gauge owned by this process"""
+        if self.enabled:
+            self._gauges[(name, _labels_key(labels))] = value
+
+    @contextmanager
+    def time(self, phase, **labels):
+        """Observe how long the block takes as a phase duration"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('fralix_phase_duration_seconds', elapsed, phase=phase, **labels)
+            for listener in self._phase_listeners:
+                listener(phase, elapsed, labels)
+
+    def on_phase(self, func):
+        """Also call func(phase, seconds, labels) whenever a timed phase ends, even with metrics disabled"""
+        self._phase_listeners.append(func)
+        return func
+
+    def collector(self, func, shared=False):
+        """Register func() -> [(name, labels, value)], called on every scrape / snapshot
+
+        shared collectors read storage common to all workers and are only
+        evaluated by the process answering the scrape.
+        """
+        self._collectors.append((func, shared))
+        return func
+
+    def record_download(self, size, seconds, **labels):
+        """Count the bytes of a finished download and observe its average speed"""
+        self.inc('fralix_bytes_total', size, direction='downloaded', **labels)
+        if seconds > 0:
+            self.observe('fralix_download_throughput_bytes_per_second', size / seconds, **labels)
+
+    def track_response(self, response, phase, count_body=False, **labels):
+        """Time a response until the server has finished sending it and count its bytes"""
+        if not self.enabled:
+            return response
+        started = time.perf_counter()
+        body = response.response
+        sent = [0]
+        done = []
+
+        def finished():
+            if done:
+                return
+            done.append(True)
+            self.observe('fralix_phase_duration_seconds', time.perf_counter() - started, phase=phase, **labels)
+            size = sent[0] if count_body else (response.content_length or 0)
+            self.inc('fralix_bytes_total', size, direction='served', **labels)
+
+        if count_body:
+            response.response = _CountingBody(body, sent, finished)
+            return response
+        # Passthrough bodies (send_file) skip Response.close, so hook the body's own
+        # close instead of wrapping it, which would defeat the server's sendfile path
+        if response.direct_passthrough and hasattr(body, 'close'):
+            close = body.close
+
+            def close_and_record():
+                try:
+                    close()
+                finally:
+                    finished()
+
+            try:
+                body.close = close_and_record
+            except AttributeError:
+                pass
+        response.call_on_close(finished)
+        return response
+
+    def _local_totals(self):
+        """Sum this process's shards (folding in those of finished threads) and gauges"""
+        totals = _Totals()
+        with self._lock:
+            alive = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    alive.append(shard)
+                    continue
+                # The thread is gone, so nothing writes to its shard any more
+                for key, value in shard.counters.items():
+                    self._retired.counters[key] = self._retired.counters.get(key, 0) + value
+                for key, values in shard.histograms.items():
+                    current = self._retired.histograms.setdefault(key, [0] * len(values))
+                    for i, value in enumerate(values):
+                        current[i] += value
+            self._shards = alive
+            shards = [self._retired] + alive
+        for shard in shards:
+            # Copies are taken in one C-level call each, so concurrent updates are safe
+            for key, value in list(shard.counters.items()):
+                totals.add_counter(key, value)
+            for key, values in list(shard.histograms.items()):
+                totals.add_histogram(key, list(values))
+        for key, value in list(self._gauges.items()):
+            totals.add_gauge(key, value)
+        for func, shared in self._collectors:
+            if not shared:
+                self._run_collector(func, totals)
+        return totals
+
+    def _run_collector(self, func, totals):
+        try:
+            samples = func()
+        except Exception as e:
+            logger.warning(f"Metrics collector failed: {str(e)}")
+            return
+        for name, labels, value in samples:
+            key = (name, _labels_key(labels))
+            if DEFINITIONS[name][0] == COUNTER:
+                totals.add_counter(key, value)
+            else:
+                totals.add_gauge(key, value)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f"{pid}.json")
+
+    def flush(self):
+        """Write this process's totals where other workers can merge them"""
+        if not self.snapshot_dir:
+            return
+        totals = self._local_totals()
+        payload = {
+            'pid': os.getpid(),
+            'written': time.time(),
+            'counters': [[name, labels, value] for (name, labels), value in totals.counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in totals.histograms.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in totals.gauges.items()],
+        }
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+    def _start_flusher(self):
+        if not self.snapshot_dir or self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _merge_snapshots(self, totals):
+        """Add the snapshots of the other live workers; returns how many were merged"""
+        if not self.snapshot_dir:
+            return 0
+        merged = 0
+        try:
+            names = os.listdir(self.snapshot_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                pid = int(name[:-5])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            path = os.path.join(self.snapshot_dir, name)
+            if not _pid_alive(pid):
+                # Its counters restart from zero in its replacement; Prometheus handles resets
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, labels, value in payload.get('counters', []):
+                totals.add_counter((metric, tuple(map(tuple, labels))), value)
+            for metric, labels, values in payload.get('histograms', []):
+                totals.add_histogram((metric, tuple(map(tuple, labels))), values)
+            for metric, labels, value in payload.get('gauges', []):
+                totals.add_gauge((metric, tuple(map(tuple, labels))), value)
+            merged += 1
+        return merged
+
+    def render(self):
+        """All metrics of all workers in the Prometheus text exposition format"""
+        totals = self._local_totals()
+        workers = 1 + self._merge_snapshots(totals)
+        for func, shared in self._collectors:
+            if shared:
+                self._run_collector(func, totals)
+        totals.add_gauge(('fralix_worker_processes', ()), workers)
+
+        by_name = {}
+        for (name, labels), value in totals.counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), value in totals.gauges.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), values in totals.histograms.items():
+            by_name.setdefault(name, []).append((labels, values))
+
+        lines = []
+        for name, (kind, help_text, buckets) in DEFINITIONS.items():
+            samples = by_name.get(name)
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(samples, key=lambda sample: sample[0]):
+                if kind != HISTOGRAM:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = labels + (('le', _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(value[-1])}")
+        return '\n'.join(lines) + '\n'
+
+
+_CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def instrument_app(app, metrics):
+    """Count and time every Flask request by endpoint and status"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.inc('fralix_http_requests_total', endpoint=endpoint, method=request.method,
+                    status=response.status_code)
+        started = g.get('metrics_started')
+        if started is not None:
+            metrics.observe('fralix_http_request_duration_seconds', time.perf_counter() - started,
+                            endpoint=endpoint)
+        return response
+
+
+def register_service_collectors(metrics, jobs, flight, pool, cache, store, guard):
+    """Expose job, pool, cache, store and platform guard state on /metrics"""
+    def worker_samples():
+        job_stats = jobs.stats()
+        return [
+            ('fralix_jobs', {'state': 'queued'}, job_stats['queued']),
+            ('fralix_jobs', {'state': 'running'}, job_stats['running']),
+            ('fralix_job_workers', {}, job_stats['workers']),
+            ('fralix_analyze_in_flight', {}, flight.in_flight()),
+            ('fralix_ydl_pool_idle', {}, pool.stats()['idle']),
+        ]
+
+    def shared_samples():
+        samples = []
+        cache_stats = cache.stats()
+        if cache_stats.get('enabled') and 'error' not in cache_stats:
+            samples += [
+                ('fralix_metadata_cache_requests_total', {'result': 'hit'}, cache_stats['hits']),
+                ('fralix_metadata_cache_requests_total', {'result': 'miss'}, cache_stats['misses']),
+                ('fralix_metadata_cache_entries', {}, cache_stats['entries']),
+            ]
+        store_stats = store.stats()
+        if 'error' not in store_stats:
+            samples += [
+                ('fralix_store_bytes', {}, store_stats['bytes']),
+                ('fralix_store_quota_bytes', {}, store_stats['quota_bytes']),
+                ('fralix_store_artifacts', {}, store_stats['artifacts']),
+            ]
+        for platform, entry in guard.stats().get('platforms', {}).items():
+            for outcome, field in (('success', 'successes'), ('error', 'errors'), ('bot', 'bot_errors'),
+                                   ('throttled', 'throttled'), ('rejected', 'rejected')):
+                samples.append(('fralix_platform_outcomes_total', {'platform': platform, 'outcome': outcome},
+                                entry[field]))
+            samples.append(('fralix_platform_circuit_state', {'platform': platform},
+                            _CIRCUIT_STATES.get(entry['state'], 0)))
+        return samples
+
+    metrics.collector(worker_samples)
+    metrics.collector(shared_samples, shared=True)
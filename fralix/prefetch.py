@@ -0,0 +1,284 @@
+"""
+Speculative prefetch
+Between /api/analyze and the click on "Download Selected" the server sits
+idle while the user looks at the format list. With PREFETCH on, the format
+they most likely pick (the best single-file MP4 up to PREFETCH_MAX_MB) starts
+downloading right after the analysis, as an ordinary download job on a small
+pool of its own and at background bandwidth priority. A later /api/download
+of the same video and format joins that job, or finds the file already in
+the artifact store, and the transfer is promoted to interactive priority.
+
+A prefetch is cancelled when the modal is closed (POST
+/api/prefetch/<job_id>/cancel) or when the video is downloaded in another
+format; its partial files stay, so choosing that format later resumes them.
+Bytes fetched by prefetches nobody adopted count against PREFETCH_BUDGET_MB
+per hour, and no new prefetch starts past it. The state lives in SQLite
+because the request that adopts or cancels a prefetch is often served by
+another gunicorn worker than the one running it.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from fralix.bandwidth import INTERACTIVE
+from fralix.config import env_bool, env_int
+from fralix.db import SQLiteBacked
+from fralix.jobs import TERMINAL_STATES, JobManager, QueueFull
+
+logger = logging.getLogger(__name__)
+
+RUNNING = 'running'
+ADOPTED = 'adopted'
+CANCELLED = 'cancelled'
+UNUSED = 'unused'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prefetches (
+    id TEXT PRIMARY KEY,
+    job_id TEXT,
+    key TEXT NOT NULL,
+    video TEXT NOT NULL,
+    format_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    started REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prefetches_key ON prefetches (key);
+CREATE INDEX IF NOT EXISTS prefetches_video ON prefetches (video, state);
+"""
+
+# Window of the wasted-bytes budget
+_BUDGET_WINDOW = 3600
+
+# How often a running prefetch looks for a cancellation or an adoption
+_CHECK_SECONDS = 0.5
+
+# Rows are kept this long for the budget and stats
+_KEEP_SECONDS = 24 * 3600
+
+
+class PrefetchCancelled(Exception):
+    """Raised from the progress hook to stop a cancelled prefetch"""
+
+
+class Prefetcher(SQLiteBacked):
+    """Starts, adopts and cancels speculative downloads within a wasted-bytes budget"""
+
+    schema = _SCHEMA
+
+    def __init__(self, path, jobs_dir, enabled=False, max_bytes=100 * 1024 ** 2,
+                 budget_bytes=1024 ** 3, workers=1, queue=None):
+        super().__init__(path)
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.budget_bytes = budget_bytes
+        self.started = 0
+        self.skipped = 0
+        self.jobs = None
+        if not enabled:
+            return
+        try:
+            self._init_db()
+            # Same state directory as the download jobs, so /api/download joins a prefetch through its key.
+            # On the worker tier max_pending counts the whole queue: guesses only run when it is nearly idle
+            self.jobs = JobManager(jobs_dir, max_workers=workers, max_pending=workers, queue=queue)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Prefetch disabled ({path}): {str(e)}")
+            self.enabled = False
+
+    @classmethod
+    def from_env(cls, cache_dir, jobs_dir, queue=None):
+        """Build from the PREFETCH* environment variables (off unless PREFETCH is set)"""
+        return cls(
+            os.path.join(cache_dir, 'prefetch.sqlite3'),
+            jobs_dir,
+            enabled=env_bool('PREFETCH', False),
+            max_bytes=env_int('PREFETCH_MAX_MB', 100) * 1024 ** 2,
+            budget_bytes=env_int('PREFETCH_BUDGET_MB', 1024) * 1024 ** 2,
+            workers=env_int('PREFETCH_WORKERS', 1),
+            queue=queue,
+        )
+
+    def wasted(self, now=None):
+        """Bytes of the last hour's prefetches nobody adopted; running ones count at their full size"""
+        since = (now or time.time()) - _BUDGET_WINDOW
+        row = self._connect().execute(
+            'SELECT COALESCE(SUM(CASE WHEN state = ? THEN MAX(size, bytes) ELSE bytes END), 0) '
+            'FROM prefetches WHERE state != ? AND started >= ?',
+            (RUNNING, ADOPTED, since)
+        ).fetchone()
+        return row[0]
+
+    def start(self, fmt, key, video, submit):
+        """Prefetch fmt (a ranked format) unless the budget is spent
+
+        submit(prefetch_id) queues the download on self.jobs and returns its
+        job. Returns {'job_id', 'format_id'} or None when nothing started.
+        """
+        if not self.enabled or fmt is None:
+            return None
+        try:
+            for row in self._connect().execute(
+                    'SELECT job_id, format_id FROM prefetches WHERE key = ? AND state IN (?, ?) AND job_id IS NOT NULL',
+                    (key, RUNNING, ADOPTED)):
+                # Analyzed again while the earlier prefetch is still going
+                job = self.jobs.get(row[0])
+                if job is not None and job['state'] not in TERMINAL_STATES:
+                    return {'job_id': row[0], 'format_id': row[1]}
+            if self.wasted() + fmt['filesize'] > self.budget_bytes:
+                self.skipped += 1
+                return None
+            prefetch_id = uuid.uuid4().hex
+            now = time.time()
+            self._transaction(lambda conn: (
+                conn.execute('DELETE FROM prefetches WHERE updated < ?', (now - _KEEP_SECONDS,)),
+                conn.execute(
+                    'INSERT INTO prefetches (id, key, video, format_id, size, state, started, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (prefetch_id, key, video, fmt['format_id'], fmt['filesize'], RUNNING, now, now)
+                ),
+            ))
+        except sqlite3.Error as e:
+            logger.warning(f"Prefetch of {key} not started: {str(e)}")
+            return None
+        try:
+            job = submit(prefetch_id)
+        except QueueFull:
+            # The prefetch pool is busy with earlier guesses
+            job = None
+        if job is None or job.get('deduplicated'):
+            # Nothing to prefetch when a real download of this format is already running
+            self._connect().execute('DELETE FROM prefetches WHERE id = ?', (prefetch_id,))
+            self.skipped += job is None
+            return None
+        self._connect().execute('UPDATE prefetches SET job_id = ? WHERE id = ?', (job['job_id'], prefetch_id))
+        self.started += 1
+        return {'job_id': job['job_id'], 'format_id': fmt['format_id']}
+
+    def adopt(self, key):
+        """A user asked for key: its prefetch, running or done, was not wasted; returns how many"""
+        if not self.enabled:
+            return 0
+        try:
+            cursor = self._connect().execute(
+                'UPDATE prefetches SET state = ?, updated = ? WHERE key = ? AND state IN (?, ?)',
+                (ADOPTED, time.time(), key, RUNNING, UNUSED)
+            )
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Could not adopt prefetch of {key}: {str(e)}")
+            return 0
+
+    def cancel(self, job_id):
+        """Cancel the running prefetch of a job; False when it is adopted, finished or unknown"""
+        if not self.enabled:
+            return False
+        try:
+            cursor = self._connect().execute(
+                'UPDATE prefetches SET state = ?, updated = ? WHERE job_id = ? AND state = ?',
+                (CANCELLED, time.time(), job_id, RUNNING)
+            )
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.warning(f"Could not cancel prefetch of job {job_id}: {str(e)}")
+            return False
+
+    def cancel_others(self, video, key):
+        """Cancel running prefetches of video in a format other than key's; returns how many"""
+        if not self.enabled:
+            return 0
+        try:
+            cursor = self._connect().execute(
+                'UPDATE prefetches SET state = ?, updated = ? WHERE video = ? AND key != ? AND state = ?',
+                (CANCELLED, time.time(), video, key, RUNNING)
+            )
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Could not cancel prefetches of {video}: {str(e)}")
+            return 0
+
+    def progress_hook(self, prefetch_id, transfer):
+        """yt-dlp progress hook recording the bytes fetched, stopping a cancelled prefetch and promoting an adopted one"""
+        checked = [0.0]
+        promoted = [False]
+        # Bytes per file: adaptive formats download video and audio one after the other
+        fetched = {}
+        lock = threading.Lock()
+
+        def hook(d):
+            now = time.monotonic()
+            with lock:
+                if d.get('status') in ('downloading', 'finished'):
+                    fetched[d.get('filename')] = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+                if now - checked[0] < _CHECK_SECONDS and d.get('status') != 'finished':
+                    return
+                checked[0] = now
+                total = sum(fetched.values())
+            try:
+                conn = self._connect()
+                conn.execute('UPDATE prefetches SET bytes = ?, updated = ? WHERE id = ?', (total, time.time(), prefetch_id))
+                row = conn.execute('SELECT state FROM prefetches WHERE id = ?', (prefetch_id,)).fetchone()
+            except sqlite3.Error:
+                return
+            if row is None or row[0] == CANCELLED:
+                raise PrefetchCancelled('Prefetch cancelled')
+            if row[0] == ADOPTED and not promoted[0]:
+                # Somebody is waiting for this download now
+                transfer.promote(INTERACTIVE)
+                promoted[0] = True
+
+        return hook
+
+    def finished(self, prefetch_id, success):
+        """Record how a prefetch ended; a completed one stays adoptable from the store"""
+        try:
+            # Adopted and cancelled prefetches keep their state
+            self._connect().execute(
+                'UPDATE prefetches SET state = ?, updated = ? WHERE id = ? AND state = ?',
+                (UNUSED if success else CANCELLED, time.time(), prefetch_id, RUNNING)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update prefetch {prefetch_id}: {str(e)}")
+
+    def state(self, job_id):
+        """State of the prefetch behind a job, or None"""
+        try:
+            row = self._connect().execute('SELECT state FROM prefetches WHERE job_id = ?', (job_id,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def samples(self):
+        """Shared metric sample: bytes counted against the budget"""
+        if not self.enabled:
+            return []
+        try:
+            return [('fralix_prefetch_wasted_bytes', {}, self.wasted())]
+        except sqlite3.Error:
+            return []
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        since = time.time() - _BUDGET_WINDOW
+        try:
+            states = dict(self._connect().execute(
+                'SELECT state, COUNT(*) FROM prefetches WHERE started >= ? GROUP BY state', (since,)
+            ).fetchall())
+            wasted = self.wasted()
+        except sqlite3.Error as e:
+            return {'enabled': True, 'error': str(e)}
+        return {
+            'enabled': True,
+            'max_bytes': self.max_bytes,
+            'budget_bytes': self.budget_bytes,
+            'wasted_bytes': wasted,
+            'last_hour': {state: states.get(state, 0) for state in (RUNNING, ADOPTED, CANCELLED, UNUSED)},
+            'started': self.started,
+            'skipped': self.skipped,
+        }
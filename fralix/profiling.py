@@ -0,0 +1,345 @@
+"""
+Opt-in request profiling
+A fraction of requests (PROFILE_SAMPLE_RATE) and every request carrying
+X-Fralix-Profile: <PROFILE_TOKEN> is profiled. A sampler thread reads the
+request thread's stack from sys._current_frames() every PROFILE_INTERVAL_MS
+instead of tracing every call, so a profiled request runs at close to full
+speed. The phases timed through Metrics.time (extract, download, publish...)
+are recorded alongside as a timing breakdown.
+
+Each profile is written to PROFILE_DIR as <id>.collapsed, one
+"frame;frame;frame count" line per stack (flamegraph.pl, speedscope and
+inferno read it), and <id>.json with the request, its phases and the
+hottest functions. The newest PROFILE_KEEP profiles are kept. Only the
+request thread is sampled: work handed to other threads (batch items,
+download jobs) shows up as the request waiting on it.
+"""
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from fralix.config import env_float, env_int, env_str
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Fralix-Profile'
+
+_PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+# Addresses allowed to read profiles when no PROFILE_TOKEN is set
+_LOOPBACK = ('127.0.0.1', '::1')
+
+# Deepest stack recorded; deeper frames are cut off at the root end
+_MAX_DEPTH = 128
+
+# Functions listed in the JSON summary
+_HOT_FUNCTIONS = 20
+
+
+def _short_path(filename):
+    """File of a frame relative to site-packages or the working directory"""
+    marker = os.sep + 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    cwd = os.getcwd() + os.sep
+    if filename.startswith(cwd):
+        return filename[len(cwd):]
+    return os.path.basename(filename)
+
+
+def _frame_label(code):
+    # Collapsed stacks separate frames with ';' and end with ' <count>'
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class Profile:
+    """Stack samples and phase timings of one request"""
+
+    def __init__(self, method, path, interval):
+        self.id = time.strftime('%Y%m%d-%H%M%S', time.gmtime()) + '-' + uuid.uuid4().hex[:8]
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.created = time.time()
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.phases = []
+
+    def add_sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < _MAX_DEPTH:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def add_phase(self, phase, seconds, labels):
+        # Metrics.time reports when the phase ends
+        ended = time.perf_counter() - self.started
+        self.phases.append({
+            'phase': phase,
+            'labels': labels,
+            'start': round(max(ended - seconds, 0), 6),
+            'seconds': round(seconds, 6),
+        })
+
+    def collapsed(self):
+        """Stacks in the collapsed format, root frame first"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def hot_functions(self, duration):
+        """Functions by samples spent in them (self) and under them (total)"""
+        # Sleeps overshoot, so the measured time per sample is more accurate than the interval
+        per_sample = duration / self.samples if self.samples else self.interval
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [
+            {
+                'function': label,
+                'self_samples': own[label],
+                'total_samples': count,
+                'total_seconds': round(count * per_sample, 4),
+            }
+            for label, count in total.most_common(_HOT_FUNCTIONS)
+        ]
+
+    def summary(self, endpoint, status, duration):
+        phase_totals = {}
+        for entry in self.phases:
+            phase_totals[entry['phase']] = round(phase_totals.get(entry['phase'], 0) + entry['seconds'], 6)
+        return {
+            'id': self.id,
+            'created': self.created,
+            'method': self.method,
+            'path': self.path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration': round(duration, 6),
+            'samples': self.samples,
+            'interval': self.interval,
+            'phases': self.phases,
+            'phase_totals': phase_totals,
+            # Time outside every timed phase: request parsing, JSON building, retries, waiting
+            'other_seconds': round(max(duration - sum(phase_totals.values()), 0), 6),
+            'hot_functions': self.hot_functions(duration),
+        }
+
+
+class Profiler:
+    """Samples the stacks of selected requests and keeps their profiles on disk"""
+
+    def __init__(self, directory, sample_rate=0.0, token=None, interval=0.005, keep=50, max_active=4):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.keep = keep
+        self.max_active = max_active
+        self.skipped = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+        if self.enabled:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Profiling disabled ({directory}): {str(e)}")
+                self.sample_rate, self.token = 0.0, None
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build the profiler from the PROFILE_* environment variables (off unless one is set)"""
+        return cls(
+            env_str('PROFILE_DIR', os.path.join(default_dir, 'profiles')),
+            sample_rate=env_float('PROFILE_SAMPLE_RATE', 0.0),
+            token=env_str('PROFILE_TOKEN'),
+            interval=env_int('PROFILE_INTERVAL_MS', 5) / 1000.0,
+            keep=env_int('PROFILE_KEEP', 50),
+            max_active=env_int('PROFILE_MAX_ACTIVE', 4),
+        )
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.token is not None
+
+    def _token_matches(self, header_value):
+        if self.token is None or header_value is None:
+            return False
+        return hmac.compare_digest(header_value.encode('utf-8'), self.token.encode('utf-8'))
+
+    def authorized(self, header_value, remote_addr=None, forwarded_for=None):
+        """Whether a request may read profiles: it carries the token, or none is set and it comes straight from localhost"""
+        if self.token is not None:
+            return self._token_matches(header_value)
+        # Behind a proxy every request comes from localhost; the proxy adds X-Forwarded-For
+        return remote_addr in _LOOPBACK and not forwarded_for
+
+    def wants(self, header_value):
+        """Whether to profile a request, given its X-Fralix-Profile header"""
+        if self._token_matches(header_value):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, method, path):
+        """Begin sampling the calling thread; None when enough requests are being profiled already"""
+        profile = Profile(method, path, self.interval)
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self.skipped += 1
+                return None
+            self._active[profile.thread_id] = profile
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_forever, name='profile-sampler', daemon=True)
+                self._sampler.start()
+        self._wake.set()
+        return profile
+
+    def finish(self, profile, endpoint, status):
+        """Stop sampling and write the profile; returns its summary"""
+        duration = time.perf_counter() - profile.started
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        summary = profile.summary(endpoint, status, duration)
+        base = os.path.join(self.directory, profile.id)
+        try:
+            with open(base + '.collapsed', 'w') as f:
+                f.write(profile.collapsed())
+            with open(base + '.json', 'w') as f:
+                json.dump(summary, f)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not write profile {profile.id}: {str(e)}")
+        self._prune()
+        return summary
+
+    def record_phase(self, phase, seconds, labels):
+        """Metrics.on_phase listener: add the phase to the profile of the current request, if any"""
+        profile = self._active.get(threading.get_ident())
+        if profile is not None:
+            profile.add_phase(phase, seconds, labels)
+
+    def _sample_forever(self):
+        while True:
+            self._wake.wait()
+            # Under the lock, so finish() never summarizes a profile while a sample is added
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.add_sample(frame)
+                del frames
+            time.sleep(self.interval)
+
+    def _prune(self):
+        """Delete all but the newest keep profiles"""
+        try:
+            ids = sorted({name.rsplit('.', 1)[0] for name in os.listdir(self.directory)
+                          if _PROFILE_ID.match(name.rsplit('.', 1)[0])})
+        except OSError:
+            return
+        for profile_id in ids[:-self.keep] if self.keep > 0 else ids:
+            for ext in ('.json', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + ext))
+                except OSError:
+                    pass
+
+    def _path(self, profile_id, ext):
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + ext)
+        return path if os.path.exists(path) else None
+
+    def recent(self, limit=50):
+        """Summaries of the newest profiles (without stacks and phases), newest first"""
+        try:
+            ids = sorted((name[:-5] for name in os.listdir(self.directory)
+                          if name.endswith('.json') and _PROFILE_ID.match(name[:-5])), reverse=True)
+        except OSError:
+            return []
+        profiles = []
+        for profile_id in ids[:limit]:
+            summary = self.load(profile_id)
+            if summary is not None:
+                profiles.append({key: summary.get(key) for key in (
+                    'id', 'created', 'method', 'path', 'endpoint', 'status', 'duration', 'samples',
+                    'phase_totals', 'other_seconds')})
+        return profiles
+
+    def load(self, profile_id):
+        """Full summary of a profile, or None"""
+        path = self._path(profile_id, '.json')
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collapsed_path(self, profile_id):
+        """Path of a profile's collapsed stacks, or None"""
+        return self._path(profile_id, '.collapsed')
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'token': self.token is not None,
+            'interval_ms': round(self.interval * 1000, 3),
+            'active': len(self._active),
+            'skipped': self.skipped,
+        }
+
+
+def profile_app(app, profiler, exclude=('/api/profiles',)):
+    """Profile the Flask requests the profiler selects and name the profile in X-Profile-Id"""
+    from flask import g, request
+
+    if not profiler.enabled:
+        return
+
+    @app.before_request
+    def _start_profile():
+        # Reading profiles carries the token too, but should not produce new ones
+        if request.path.startswith(exclude):
+            return
+        if profiler.wants(request.headers.get(PROFILE_HEADER)):
+            g.profile = profiler.start(request.method, request.path)
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            # Streamed bodies are still being sent: their profile covers the handler only
+            profiler.finish(profile, endpoint, response.status_code)
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def _drop_profile(exc):
+        # after_request is skipped when a view raises
+        profile = g.pop('profile', None)
+        if profile is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            profiler.finish(profile, endpoint, 500)
@@ -0,0 +1,284 @@
+"""
+Per-platform rate limiting and circuit breaking for outbound extractions
+Every yt-dlp call against a platform first takes a token from that
+platform's bucket. Repeated bot-detection errors ("Sign in to confirm
+you're not a bot") open the platform's circuit: requests then fail fast
+with 503 + Retry-After instead of sleeping in a worker and hammering a
+platform that is actively blocking us. After the cooldown one half-open
+probe is let through; if it succeeds the circuit closes again.
+
+State lives in SQLite so all worker processes share one bucket and one
+breaker per platform.
+"""
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from fralix.config import env_float, env_int, env_str
+from fralix.db import SQLiteBacked
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS platforms (
+    platform TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    refilled REAL NOT NULL,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    opened_at REAL,
+    probe_at REAL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    bot_errors INTEGER NOT NULL DEFAULT 0,
+    throttled INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_DISPLAY_NAMES = {'youtube': 'YouTube', 'linkedin': 'LinkedIn', 'twitter': 'X (Twitter)', 'instagram': 'Instagram'}
+
+_FIELDS = ('platform', 'tokens', 'refilled', 'state', 'failures', 'opened_at', 'probe_at',
+           'requests', 'successes', 'errors', 'bot_errors', 'throttled', 'rejected')
+
+
+# yt-dlp errors of a platform refusing us as a whole, not one video. Age gates and members-only
+# videos also say "use --cookies", so the cookies hint alone does not count
+_BLOCKED_PATTERNS = re.compile('|'.join((
+    r"confirm you'?re not a bot",
+    r"this content isn't available, try again later",
+    r"rate-limit reached or login required",
+    r"http error 429",
+    r"too many requests",
+)))
+
+
+def is_bot_detection(error_msg):
+    """Whether a yt-dlp error means the platform is blocking automated access"""
+    # yt-dlp quotes YouTube's message with a typographic apostrophe
+    return _BLOCKED_PATTERNS.search(error_msg.lower().replace('\u2019', "'")) is not None
+
+
+def blocked_message(platform):
+    """User-facing message for a platform that is blocking us"""
+    name = _DISPLAY_NAMES.get(platform, platform)
+    return f'{name} is temporarily blocking automated access. Please try again in a few minutes.'
+
+
+class PlatformThrottled(Exception):
+    """The platform's bucket is empty or its circuit is open"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(int(retry_after + 0.999), 1)
+
+
+class PlatformGuard(SQLiteBacked):
+    """Token bucket + circuit breaker per platform, shared between processes"""
+
+    schema = _SCHEMA
+
+    def __init__(self, path, rate=1.0, burst=10, failure_threshold=3, cooldown=120,
+                 probe_timeout=60, max_wait=2.0, rates=None):
+        super().__init__(path)
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.max_wait = max_wait
+        self.rates = rates or {}
+        self._init_db()
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build the guard from PLATFORM_* / BREAKER_* environment variables"""
+        rate = env_float('PLATFORM_RATE', 1.0)
+        rates = {}
+        for platform in ('youtube', 'linkedin', 'twitter', 'instagram'):
+            override = env_str(f'PLATFORM_RATE_{platform.upper()}')
+            if override:
+                try:
+                    rates[platform] = float(override)
+                except ValueError:
+                    pass
+        return cls(
+            env_str('PLATFORM_GUARD_PATH', os.path.join(default_dir, 'platforms.sqlite3')),
+            rate=rate,
+            burst=env_int('PLATFORM_BURST', 10),
+            failure_threshold=env_int('BREAKER_FAILURES', 3),
+            cooldown=env_int('BREAKER_COOLDOWN', 120),
+            probe_timeout=env_int('BREAKER_PROBE_TIMEOUT', 60),
+            max_wait=env_float('PLATFORM_MAX_WAIT', 2.0),
+            rates=rates,
+        )
+
+    def _row(self, conn, platform, now):
+        row = conn.execute(f"SELECT {', '.join(_FIELDS)} FROM platforms WHERE platform = ?", (platform,)).fetchone()
+        if row is None:
+            conn.execute(
+                'INSERT INTO platforms (platform, tokens, refilled, state) VALUES (?, ?, ?, ?)',
+                (platform, float(self.burst), now, CLOSED)
+            )
+            row = conn.execute(f"SELECT {', '.join(_FIELDS)} FROM platforms WHERE platform = ?", (platform,)).fetchone()
+        return dict(zip(_FIELDS, row))
+
+    def _update(self, conn, platform, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE platforms SET {assignments} WHERE platform = ?", (*fields.values(), platform))
+
+    def _circuit_retry_after(self, row, now):
+        """Seconds until the circuit lets a request through, or None if it would now"""
+        if row['state'] == OPEN:
+            remaining = self.cooldown - (now - (row['opened_at'] or 0))
+            return remaining if remaining > 0 else None
+        if row['state'] == HALF_OPEN and row['probe_at'] is not None:
+            remaining = self.probe_timeout - (now - row['probe_at'])
+            return remaining if remaining > 0 else None
+        return None
+
+    def _acquire(self, conn, platform, now):
+        row = self._row(conn, platform, now)
+
+        retry_after = self._circuit_retry_after(row, now)
+        if retry_after is not None:
+            self._update(conn, platform, rejected=row['rejected'] + 1)
+            return 'open', retry_after
+
+        updates = {}
+        if row['state'] != CLOSED:
+            # Cooldown is over (or the last probe never reported back): this request probes
+            updates.update(state=HALF_OPEN, probe_at=now)
+
+        rate = self.rates.get(platform, self.rate)
+        tokens = min(float(self.burst), row['tokens'] + (now - row['refilled']) * rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate if rate > 0 else float('inf')
+        if wait > self.max_wait:
+            self._update(conn, platform, tokens=tokens, refilled=now, throttled=row['throttled'] + 1)
+            return 'throttled', wait
+
+        # Reserve the token now (possibly going negative) and let the caller wait
+        updates.update(tokens=tokens - 1, refilled=now, requests=row['requests'] + 1)
+        self._update(conn, platform, **updates)
+        return 'ok', wait
+
+    def acquire(self, platform):
+        """Take a token for platform; returns seconds to wait or raises PlatformThrottled"""
+        try:
+            outcome, seconds = self._transaction(self._acquire, platform, time.time())
+        except sqlite3.Error as e:
+            # Never let limiter bookkeeping take the site down
+            logger.warning(f"Platform guard unavailable: {str(e)}")
+            return 0.0
+        if outcome == 'open':
+            raise PlatformThrottled(blocked_message(platform), seconds)
+        if outcome == 'throttled':
+            raise PlatformThrottled('Too many requests right now, please try again shortly.', seconds)
+        return seconds
+
+    def _record(self, conn, platform, outcome, now):
+        row = self._row(conn, platform, now)
+        if outcome == 'aborted':
+            if row['state'] == HALF_OPEN and row['probe_at'] is not None:
+                # The probe never got an answer; the next request probes instead of waiting out probe_timeout
+                self._update(conn, platform, probe_at=None)
+            return
+        if outcome == 'bot':
+            failures = row['failures'] + 1
+            updates = {'bot_errors': row['bot_errors'] + 1, 'failures': failures}
+            if row['state'] == HALF_OPEN or failures >= self.failure_threshold:
+                if row['state'] != OPEN:
+                    logger.warning(f"Circuit for {platform} opened after {failures} bot-detection errors")
+                updates.update(state=OPEN, opened_at=now, probe_at=None)
+            self._update(conn, platform, **updates)
+            return
+        # Any answer that is not a block means the platform is talking to us again
+        if row['state'] != CLOSED:
+            logger.info(f"Circuit for {platform} closed")
+        counter = 'successes' if outcome == 'success' else 'errors'
+        self._update(conn, platform, state=CLOSED, failures=0, probe_at=None,
+                     **{counter: row[counter] + 1})
+
+    def record(self, platform, outcome):
+        """Record the result of an extraction: 'success', 'error', 'bot' or 'aborted' (no answer)"""
+        try:
+            self._transaction(self._record, platform, outcome, time.time())
+        except sqlite3.Error as e:
+            logger.warning(f"Platform guard unavailable: {str(e)}")
+
+    def check(self, platform):
+        """Fail fast (without taking a token) if platform's circuit is open"""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT state, opened_at, probe_at FROM platforms WHERE platform = ?', (platform,)
+            ).fetchone()
+        except sqlite3.Error:
+            return
+        if row is None:
+            return
+        retry_after = self._circuit_retry_after(
+            {'state': row[0], 'opened_at': row[1], 'probe_at': row[2]}, time.time()
+        )
+        if retry_after is not None:
+            raise PlatformThrottled(blocked_message(platform), retry_after)
+
+    @contextmanager
+    def guard(self, platform, neutral=()):
+        """Wrap one outbound extraction: rate limit it and feed its outcome to the breaker
+
+        Exceptions of the neutral types are ours (e.g. a cancelled download),
+        not the platform's answer, and say nothing about its circuit.
+        """
+        wait = self.acquire(platform)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            yield
+        except neutral:
+            self.record(platform, 'aborted')
+            raise
+        except Exception as e:
+            self.record(platform, 'bot' if is_bot_detection(str(e)) else 'error')
+            raise
+        self.record(platform, 'success')
+
+    def retry_after(self, platform):
+        """Seconds a client should wait before trying platform again"""
+        try:
+            self.check(platform)
+        except PlatformThrottled as e:
+            return e.retry_after
+        return 30
+
+    def stats(self):
+        """Current state and counters of every platform seen so far"""
+        try:
+            rows = self._connect().execute(f"SELECT {', '.join(_FIELDS)} FROM platforms").fetchall()
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        now = time.time()
+        platforms = {}
+        for row in rows:
+            entry = dict(zip(_FIELDS, row))
+            rate = self.rates.get(entry['platform'], self.rate)
+            entry['tokens'] = round(min(float(self.burst), entry['tokens'] + (now - entry['refilled']) * rate), 2)
+            retry_after = self._circuit_retry_after(entry, now)
+            entry['retry_after'] = int(retry_after) + 1 if retry_after else 0
+            entry['rate'] = rate
+            del entry['refilled']
+            platforms[entry.pop('platform')] = entry
+        return {
+            'burst': self.burst,
+            'failure_threshold': self.failure_threshold,
+            'cooldown': self.cooldown,
+            'platforms': platforms,
+        }
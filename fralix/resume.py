@@ -0,0 +1,222 @@
+"""
+Resumable partial downloads
+Every download of a video and format goes into the same directory, derived
+from its artifact key, instead of a fresh temporary one. yt-dlp resumes
+from the .part file (plain HTTP, via a Range request) or from the fragment
+index in its .ytdl file (HLS/DASH) it finds there. A recycled worker, a
+timed-out job or the bot-detection retry then only fetches what is
+missing.
+
+The state of each partial download (URL, format, output file, bytes and
+fragment reached, attempts) is kept in SQLite next to the files, so any
+worker process can pick it up. An flock on the directory keeps two
+processes from writing the same .part file; the loser downloads into a
+private directory instead. Partials that nobody touched for ttl seconds are
+deleted.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking, downloads never share a directory
+    fcntl = None
+
+from fralix.config import env_bool, env_int
+from fralix.db import SQLiteBacked
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS partials (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    format_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    output TEXT,
+    bytes_done INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER,
+    fragment_index INTEGER,
+    fragment_count INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    resumed_bytes INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS partials_updated ON partials (updated);
+"""
+
+_LOCK_NAME = '.lock'
+
+
+def _disk_usage(path):
+    """Bytes of the files in a directory (the .part files and fragments so far)"""
+    total = 0
+    try:
+        for name in os.listdir(path):
+            if name != _LOCK_NAME:
+                total += os.path.getsize(os.path.join(path, name))
+    except OSError:
+        pass
+    return total
+
+
+class PartialDownloads(SQLiteBacked):
+    """Persistent, per artifact key download directories that survive failed attempts"""
+
+    schema = _SCHEMA
+
+    def __init__(self, root, ttl=24 * 3600, enabled=True):
+        super().__init__(os.path.join(root, 'state.sqlite3'))
+        self.root = root
+        self.ttl = ttl
+        self.enabled = enabled
+        os.makedirs(root, exist_ok=True)
+        self._init_db()
+        self.clean()
+
+    @classmethod
+    def from_env(cls, root):
+        """Build from the DOWNLOAD_RESUME* environment variables"""
+        return cls(
+            root,
+            ttl=env_int('DOWNLOAD_RESUME_TTL', 24 * 3600),
+            enabled=env_bool('DOWNLOAD_RESUME', True),
+        )
+
+    def _path_for(self, key):
+        return os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest()[:20])
+
+    def start(self, key, url, format_id):
+        """Open the download directory for key
+
+        Returns a handle for progress_hook/finish/release: 'path' is where to
+        download, 'resumed_bytes' how much an earlier attempt left there.
+        """
+        if not self.enabled or fcntl is None:
+            return {'key': key, 'path': tempfile.mkdtemp(dir=self.root), 'lock': None, 'resumed_bytes': 0}
+
+        path = self._path_for(key)
+        os.makedirs(path, exist_ok=True)
+        lock = open(os.path.join(path, _LOCK_NAME), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another process is downloading this very file right now
+            lock.close()
+            logger.info(f"Partial download {key} is busy, downloading without resume")
+            return {'key': key, 'path': tempfile.mkdtemp(dir=self.root), 'lock': None, 'resumed_bytes': 0}
+
+        resumed = _disk_usage(path)
+        now = time.time()
+        try:
+            self._transaction(lambda conn: conn.execute(
+                'INSERT INTO partials (key, url, format_id, path, attempts, resumed_bytes, created, updated) '
+                'VALUES (?, ?, ?, ?, 1, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET url = excluded.url, attempts = attempts + 1, '
+                'resumed_bytes = resumed_bytes + excluded.resumed_bytes, error = NULL, updated = excluded.updated',
+                (key, url, format_id, path, resumed, now, now)
+            ))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record partial download {key}: {str(e)}")
+        if resumed:
+            logger.info(f"Resuming {key} with {resumed} bytes already on disk")
+        return {'key': key, 'path': path, 'lock': lock, 'resumed_bytes': resumed}
+
+    def progress_hook(self, handle):
+        """yt-dlp progress hook that records how far the download got"""
+        if handle['lock'] is None:
+            return lambda d: None
+        last_write = [0.0]
+
+        def hook(d):
+            if d.get('status') != 'downloading':
+                return
+            # Throttled like job progress; losing the last half second only costs a re-check
+            now = time.monotonic()
+            if now - last_write[0] < 0.5:
+                return
+            last_write[0] = now
+            try:
+                self._connect().execute(
+                    'UPDATE partials SET output = ?, bytes_done = ?, total_bytes = ?, fragment_index = ?, '
+                    'fragment_count = ?, updated = ? WHERE key = ?',
+                    (d.get('tmpfilename') or d.get('filename'), d.get('downloaded_bytes') or 0,
+                     d.get('total_bytes') or d.get('total_bytes_estimate'), d.get('fragment_index'),
+                     d.get('fragment_count'), time.time(), handle['key'])
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Could not record download progress: {str(e)}")
+
+        return hook
+
+    def fail(self, handle, error):
+        """Remember why an attempt stopped; its files stay for the next one"""
+        if handle['lock'] is None:
+            return
+        try:
+            self._connect().execute(
+                'UPDATE partials SET error = ?, bytes_done = MAX(bytes_done, ?), updated = ? WHERE key = ?',
+                (str(error)[:500], _disk_usage(handle['path']), time.time(), handle['key'])
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record download error: {str(e)}")
+
+    def finish(self, handle):
+        """Forget a download whose result has been published"""
+        if handle['lock'] is not None:
+            try:
+                self._connect().execute('DELETE FROM partials WHERE key = ?', (handle['key'],))
+            except sqlite3.Error as e:
+                logger.warning(f"Could not clear partial download {handle['key']}: {str(e)}")
+        handle['finished'] = True
+
+    def release(self, handle):
+        """Unlock the directory; delete it when finished or when it was private"""
+        if handle.get('finished') or handle['lock'] is None:
+            shutil.rmtree(handle['path'], ignore_errors=True)
+        if handle['lock'] is not None:
+            handle['lock'].close()
+            handle['lock'] = None
+
+    def clean(self):
+        """Delete partial downloads nobody resumed within ttl seconds"""
+        cutoff = time.time() - self.ttl
+
+        def forget_stale(conn):
+            paths = [row[0] for row in conn.execute('SELECT path FROM partials WHERE updated < ?', (cutoff,))]
+            conn.execute('DELETE FROM partials WHERE updated < ?', (cutoff,))
+            return paths
+
+        try:
+            stale = self._transaction(forget_stale)
+        except sqlite3.Error as e:
+            logger.warning(f"Partial download cleanup failed: {str(e)}")
+            return
+        try:
+            known = {os.path.basename(p) for (p,) in self._connect().execute('SELECT path FROM partials')}
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                # Unindexed directories belong to private or crashed downloads
+                if os.path.isdir(path) and name not in known and os.path.getmtime(path) < cutoff:
+                    stale.append(path)
+        except (OSError, sqlite3.Error):
+            pass
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        """Partial downloads waiting to be resumed and the bytes they hold"""
+        try:
+            count, done, resumed = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes_done), 0), COALESCE(SUM(resumed_bytes), 0) FROM partials'
+            ).fetchone()
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        return {'enabled': self.enabled, 'partials': count, 'bytes': done, 'resumed_bytes': resumed}
@@ -0,0 +1,62 @@
+"""
+In-flight request coalescing
+When many requests ask for the same thing at once (a viral link being
+analyzed by dozens of users), only the first one does the work; the others
+wait for it and share its result or its exception.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Run func(*args, **kwargs) unless a call for key is already running"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        """Number of distinct keys currently being executed"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        return {'in_flight': self.in_flight(), 'executed': self.executed, 'shared': self.shared}
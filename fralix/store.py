@@ -0,0 +1,196 @@
+"""
+Content-addressed store for downloaded media
+Finished downloads are kept under a name derived from (platform, video ID,
+format) instead of the video title, so different videos with the same title
+never overwrite each other and a repeat request is served from disk. An
+SQLite index records size and last access; once the store exceeds its byte
+quota the least recently used artifacts are deleted.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from fralix.config import env_int
+from fralix.db import SQLiteBacked
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed);
+"""
+
+_COLUMNS = 'key, filename, title, size, created, accessed'
+
+# Leftovers of yt-dlp and the audio pool next to the finished file
+_PARTIAL_SUFFIXES = ('.part', '.ytdl', '.tmp')
+
+
+def artifact_key(platform, video_id, format_id):
+    """Key identifying one downloaded format of one video"""
+    return f"{platform}:{video_id}:{format_id}"
+
+
+def download_name(title, filename):
+    """Human friendly file name offered to the browser"""
+    ext = os.path.splitext(filename)[1]
+    safe_title = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '', title or '').strip() or 'video'
+    return f"{safe_title[:150]}{ext}"
+
+
+def artifact_result(entry):
+    """Describe a stored artifact in /api/download responses"""
+    return {
+        'success': True,
+        'filename': entry['filename'],
+        'filepath': entry['path'],
+        'download_name': entry['download_name'],
+        'filesize': entry['size'],
+        'title': entry['title'],
+    }
+
+
+class ArtifactStore(SQLiteBacked):
+    """Downloaded files indexed by video and format, bounded by a byte quota"""
+
+    schema = _SCHEMA
+
+    def __init__(self, root, quota_bytes):
+        super().__init__(os.path.join(root, '.index.sqlite3'))
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._init_db()
+
+    @classmethod
+    def from_env(cls, root, default_quota):
+        """Build the store from the DOWNLOAD_STORE_QUOTA_MB environment variable"""
+        quota_mb = env_int('DOWNLOAD_STORE_QUOTA_MB', default_quota // (1024 * 1024))
+        return cls(root, quota_mb * 1024 * 1024)
+
+    def _row_to_dict(self, row):
+        entry = dict(zip(('key', 'filename', 'title', 'size', 'created', 'accessed'), row))
+        entry['path'] = os.path.join(self.root, entry['filename'])
+        entry['download_name'] = download_name(entry['title'], entry['filename'])
+        return entry
+
+    def _find(self, column, value):
+        """Look up an artifact, touch its access time and drop it if the file is gone"""
+        try:
+            conn = self._connect()
+            row = conn.execute(f'SELECT {_COLUMNS} FROM artifacts WHERE {column} = ?', (value,)).fetchone()
+            if row is None:
+                return None
+            entry = self._row_to_dict(row)
+            if not os.path.exists(entry['path']):
+                conn.execute('DELETE FROM artifacts WHERE key = ?', (entry['key'],))
+                return None
+            conn.execute('UPDATE artifacts SET accessed = ? WHERE key = ?', (time.time(), entry['key']))
+            return entry
+        except sqlite3.Error as e:
+            logger.warning(f"Artifact index read failed: {str(e)}")
+            return None
+
+    def lookup(self, key):
+        """Return the stored artifact for key, or None"""
+        return self._find('key', key)
+
+    def resolve(self, filename):
+        """Return the stored artifact with the given file name, or None"""
+        return self._find('filename', filename)
+
+    def publish(self, key, src_path, title):
+        """Atomically move a finished download into the store and index it"""
+        ext = os.path.splitext(src_path)[1]
+        filename = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + ext
+        dest_path = os.path.join(self.root, filename)
+        # Same filesystem, so this is an atomic rename
+        os.replace(src_path, dest_path)
+        size = os.path.getsize(dest_path)
+        now = time.time()
+
+        def insert(conn):
+            previous = conn.execute('SELECT filename FROM artifacts WHERE key = ?', (key,)).fetchone()
+            conn.execute('DELETE FROM artifacts WHERE filename = ? AND key != ?', (filename, key))
+            conn.execute(
+                f'INSERT OR REPLACE INTO artifacts ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, filename, title or '', size, now, now)
+            )
+            return previous[0] if previous else None
+
+        previous = self._transaction(insert)
+        if previous and previous != filename:
+            # Same video and format re-published with another extension
+            try:
+                os.remove(os.path.join(self.root, previous))
+            except OSError:
+                pass
+        self.evict(keep=key)
+        return self.lookup(key)
+
+    def evict(self, keep=None):
+        """Delete least recently used artifacts until the store fits its quota"""
+        def select_victims(conn):
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+            victims = []
+            if total <= self.quota_bytes:
+                return victims
+            for key, filename, size in conn.execute(
+                'SELECT key, filename, size FROM artifacts ORDER BY accessed'
+            ).fetchall():
+                if total <= self.quota_bytes:
+                    break
+                if key == keep:
+                    continue
+                conn.execute('DELETE FROM artifacts WHERE key = ?', (key,))
+                victims.append(filename)
+                total -= size
+            return victims
+
+        try:
+            victims = self._transaction(select_victims)
+        except sqlite3.Error as e:
+            logger.warning(f"Artifact eviction failed: {str(e)}")
+            return []
+        for filename in victims:
+            try:
+                # Open handles (files being served) keep working after unlink
+                os.remove(os.path.join(self.root, filename))
+                logger.info(f"Evicted artifact {filename}")
+            except OSError:
+                pass
+        return victims
+
+    @staticmethod
+    def find_output(download_dir):
+        """Return the finished file in a download directory, or None when there are only partial files"""
+        candidates = []
+        for name in os.listdir(download_dir):
+            # Dotfiles include the resume lock; fragments are named media.mp4.part-Frag12(.part)
+            if name.startswith('.') or name.endswith(_PARTIAL_SUFFIXES) or '.part-Frag' in name:
+                continue
+            path = os.path.join(download_dir, name)
+            if os.path.isfile(path) and os.path.getsize(path) > 0:
+                candidates.append(path)
+        if not candidates:
+            return None
+        return max(candidates, key=os.path.getsize)
+
+    def stats(self):
+        """Return artifact count and disk usage"""
+        try:
+            count, total = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts'
+            ).fetchone()
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        return {'artifacts': count, 'bytes': total, 'quota_bytes': self.quota_bytes}
@@ -0,0 +1,135 @@
+"""
+Pass-through streaming of single-file formats
+Instead of downloading to disk and serving the file afterwards, the media
+URL selected by yt-dlp is fetched and piped straight into a chunked HTTP
+response. A reader thread fills a bounded queue; when the client reads
+slowly the queue fills up and the upstream read blocks, so memory stays at
+chunk_size * buffer_chunks no matter how large the video is.
+"""
+import logging
+import queue
+import threading
+from urllib.parse import quote
+
+from fralix.config import env_int
+
+logger = logging.getLogger(__name__)
+
+# Protocols yt-dlp serves as one plain HTTP body (no fragments, no merging)
+STREAMABLE_PROTOCOLS = ('http', 'https')
+
+_DONE = object()
+
+
+class StreamError(Exception):
+    """Streaming is not possible; status is the HTTP code to report"""
+
+    def __init__(self, message, status=409):
+        super().__init__(message)
+        self.status = status
+
+
+def stream_settings():
+    """Chunk size and buffer depth from STREAM_* environment variables"""
+    return {
+        'chunk_size': env_int('STREAM_CHUNK_KB', 64) * 1024,
+        'buffer_chunks': env_int('STREAM_BUFFER_CHUNKS', 16),
+    }
+
+
+def content_disposition(filename):
+    """Attachment header with an ASCII fallback and the UTF-8 name (RFC 6266)"""
+    fallback = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'video'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def streamable_format(info):
+    """Return (media_url, http_headers) for an extracted single-file format"""
+    if info.get('requested_formats'):
+        raise StreamError('This format needs audio and video merged; use the regular download instead')
+    protocol = info.get('protocol') or ''
+    if protocol not in STREAMABLE_PROTOCOLS or not info.get('url'):
+        raise StreamError(f"Format protocol '{protocol or 'unknown'}' cannot be streamed; use the regular download instead")
+    return info['url'], dict(info.get('http_headers') or {})
+
+
+class MediaStream:
+    """Upstream media response exposed as a bounded, back-pressured chunk iterator"""
+
+    def __init__(self, url, headers=None, chunk_size=64 * 1024, buffer_chunks=16, timeout=30, transfer=None):
+        self.chunk_size = chunk_size
+        self.bytes_sent = 0
+        # Upstream bandwidth share (fralix.bandwidth) the reader paces itself to
+        self._transfer = transfer
+        self._queue = queue.Queue(maxsize=max(buffer_chunks, 1))
+        self._stop = threading.Event()
+        # Imported here: urllib.request is slow to load and only streams need it
+        import urllib.request
+
+        # Open eagerly so upstream errors surface before the response starts
+        try:
+            self._upstream = urllib.request.urlopen(
+                urllib.request.Request(url, headers=headers or {}), timeout=timeout
+            )
+        except Exception as e:
+            if transfer is not None:
+                transfer.close()
+            raise StreamError(f'Could not open media stream: {str(e)}', 502)
+        length = self._upstream.headers.get('Content-Length')
+        self.content_length = int(length) if length and length.isdigit() else None
+        self.content_type = self._upstream.headers.get_content_type()
+
+    def _read_upstream(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._upstream.read(self.chunk_size)
+                if not chunk:
+                    break
+                if self._transfer is not None:
+                    self._transfer.consume(len(chunk))
+                # Blocks while the buffer is full: this is the backpressure
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(chunk, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            logger.error(f"Upstream media read failed: {str(e)}")
+            self._queue_final(e)
+            return
+        self._queue_final(_DONE)
+
+    def _queue_final(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        reader = threading.Thread(target=self._read_upstream, name='media-stream', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    # Headers are already sent; ending the body early is all we can do
+                    return
+                self.bytes_sent += len(item)
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """Release the upstream response and the bandwidth share, iterated or not; safe to call twice"""
+        self._stop.set()
+        if self._transfer is not None:
+            self._transfer.close()
+        try:
+            self._upstream.close()
+        except Exception:
+            pass
@@ -0,0 +1,267 @@
+"""
+Thumbnail proxy
+Platforms hand out full-size thumbnails (1280x720 JPEGs and up) on CDN URLs
+that may expire or refuse hotlinking, while the format picker shows a
+small preview. /api/analyze therefore returns /api/thumbnail/<id> instead:
+the source URL is recorded under an ID derived from the video, and the
+first request fetches it once, scales it down to the preview width and
+re-encodes it as WebP (JPEG when Pillow has no WebP support). Results stay
+on disk behind an SQLite index like the download store, bounded by a byte
+quota with least recently used files evicted, and are served with a long
+max-age and a content ETag.
+
+Without Pillow the original image is cached and served unchanged.
+"""
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+from fralix.config import env_bool, env_int
+from fralix.db import SQLiteBacked
+from fralix.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    id TEXT PRIMARY KEY,
+    platform TEXT NOT NULL,
+    source TEXT NOT NULL,
+    filename TEXT,
+    mimetype TEXT,
+    etag TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS thumbnails_accessed ON thumbnails (accessed);
+"""
+
+_COLUMNS = 'id, platform, source, filename, mimetype, etag, size, created, accessed'
+
+# Source images larger than this are refused rather than decoded
+_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+# Recorded sources nobody asked for in this long are forgotten
+_STALE_SECONDS = 30 * 24 * 3600
+
+_EXTENSIONS = {'image/webp': '.webp', 'image/jpeg': '.jpg', 'image/png': '.png'}
+
+# (PIL.Image, output encoding) once loaded, False when Pillow is not installed
+_pillow = None
+
+
+class ThumbnailError(Exception):
+    """The source thumbnail could not be fetched or decoded"""
+
+
+def load_pillow():
+    """Import Pillow on first use (it adds tens of milliseconds to a cold start); None when missing"""
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, features
+            _pillow = (Image, 'WEBP' if features.check('webp') else 'JPEG')
+        except ImportError:  # Pillow is optional: thumbnails are proxied without resizing
+            _pillow = False
+    return _pillow or None
+
+
+def thumbnail_id(platform, video_key):
+    """ID of a video's thumbnail in /api/thumbnail URLs"""
+    return hashlib.sha1(f"{platform}:{video_key}".encode('utf-8')).hexdigest()[:20]
+
+
+class ThumbnailCache(SQLiteBacked):
+    """Resized preview thumbnails fetched on first request, bounded by a byte quota"""
+
+    schema = _SCHEMA
+
+    def __init__(self, root, quota_bytes, width=640, quality=75, max_age=7 * 24 * 3600, enabled=True):
+        super().__init__(os.path.join(root, 'index.sqlite3'))
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.width = width
+        self.quality = quality
+        self.max_age = max_age
+        self.enabled = enabled
+        self._flight = SingleFlight()
+        os.makedirs(root, exist_ok=True)
+        self._init_db()
+
+    @classmethod
+    def from_env(cls, root, default_quota):
+        """Build the cache from the THUMBNAIL_* environment variables"""
+        quota_mb = env_int('THUMBNAIL_CACHE_MB', default_quota // (1024 * 1024))
+        return cls(
+            root,
+            quota_mb * 1024 * 1024,
+            width=env_int('THUMBNAIL_WIDTH', 640),
+            quality=env_int('THUMBNAIL_QUALITY', 75),
+            max_age=env_int('THUMBNAIL_MAX_AGE', 7 * 24 * 3600),
+            enabled=env_bool('THUMBNAIL_PROXY', True),
+        )
+
+    def register(self, platform, video_key, source):
+        """Record where a video's thumbnail comes from; returns its ID, or None when not proxied"""
+        if not self.enabled or not source or not source.startswith(('http://', 'https://')):
+            return None
+        thumb_id = thumbnail_id(platform, video_key)
+        now = time.time()
+
+        def upsert(conn):
+            row = conn.execute('SELECT source, filename FROM thumbnails WHERE id = ?', (thumb_id,)).fetchone()
+            if row is not None and row[0] == source:
+                conn.execute('UPDATE thumbnails SET accessed = ? WHERE id = ?', (now, thumb_id))
+                return None
+            conn.execute(
+                f'INSERT OR REPLACE INTO thumbnails ({_COLUMNS}) VALUES (?, ?, ?, NULL, NULL, NULL, 0, ?, ?)',
+                (thumb_id, platform, source, now, now)
+            )
+            # A new source invalidates the image rendered from the old one
+            return row[1] if row is not None else None
+
+        try:
+            outdated = self._transaction(upsert)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record thumbnail source: {str(e)}")
+            return None
+        if outdated:
+            self._remove(outdated)
+        return thumb_id
+
+    def _row_to_dict(self, row):
+        entry = dict(zip(('id', 'platform', 'source', 'filename', 'mimetype', 'etag', 'size', 'created',
+                          'accessed'), row))
+        entry['path'] = os.path.join(self.root, entry['filename']) if entry['filename'] else None
+        return entry
+
+    def lookup(self, thumb_id):
+        """Return the entry for a thumbnail ID ('path' is None until fetched), or None"""
+        try:
+            conn = self._connect()
+            row = conn.execute(f'SELECT {_COLUMNS} FROM thumbnails WHERE id = ?', (thumb_id,)).fetchone()
+            if row is None:
+                return None
+            entry = self._row_to_dict(row)
+            if entry['path'] is not None and not os.path.exists(entry['path']):
+                entry['path'] = None
+            conn.execute('UPDATE thumbnails SET accessed = ? WHERE id = ?', (time.time(), thumb_id))
+            return entry
+        except sqlite3.Error as e:
+            logger.warning(f"Thumbnail index read failed: {str(e)}")
+            return None
+
+    def fetch(self, entry):
+        """Download, resize and store a looked-up thumbnail; concurrent requests share one fetch"""
+        return self._flight.do(entry['id'], self._fetch, entry)
+
+    def _fetch(self, entry):
+        # Imported here like in MediaStream: only thumbnail misses need it
+        import urllib.request
+
+        try:
+            request = urllib.request.Request(entry['source'], headers={'User-Agent': 'Mozilla/5.0'})
+            with urllib.request.urlopen(request, timeout=15) as response:
+                data = response.read(_MAX_SOURCE_BYTES + 1)
+                mimetype = response.headers.get_content_type()
+        except Exception as e:
+            raise ThumbnailError(f"Could not fetch thumbnail: {str(e)}")
+        if len(data) > _MAX_SOURCE_BYTES:
+            raise ThumbnailError('Source thumbnail is too large')
+
+        data, mimetype = self._render(data, mimetype)
+        filename = entry['id'] + _EXTENSIONS.get(mimetype, '')
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.root, filename))
+
+        etag = hashlib.sha1(data).hexdigest()[:32]
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE thumbnails SET filename = ?, mimetype = ?, etag = ?, size = ?, created = ?, accessed = ? '
+            'WHERE id = ?',
+            (filename, mimetype, etag, len(data), now, now, entry['id'])
+        ))
+        self.evict(keep=entry['id'])
+        return dict(entry, filename=filename, path=os.path.join(self.root, filename), mimetype=mimetype,
+                    etag=etag, size=len(data), created=now)
+
+    def _render(self, data, mimetype):
+        """Scale an image down to the preview width and re-encode it; returns (bytes, mimetype)"""
+        pillow = load_pillow()
+        if pillow is None:
+            return data, mimetype
+        Image, encoding = pillow
+        try:
+            image = Image.open(io.BytesIO(data))
+            # Portrait videos (Shorts, reels) get the same box, so they are no taller than wide previews
+            image.thumbnail((self.width, self.width), Image.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA') or encoding == 'JPEG':
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            if encoding == 'WEBP':
+                image.save(output, 'WEBP', quality=self.quality, method=4)
+                return output.getvalue(), 'image/webp'
+            image.save(output, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+            return output.getvalue(), 'image/jpeg'
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ThumbnailError(f"Could not decode thumbnail: {str(e)}")
+
+    def _remove(self, filename):
+        try:
+            os.remove(os.path.join(self.root, filename))
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """Drop least recently used images beyond the quota and sources nobody asked for lately"""
+        def select_victims(conn):
+            conn.execute('DELETE FROM thumbnails WHERE accessed < ? AND filename IS NULL',
+                         (time.time() - _STALE_SECONDS,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails').fetchone()[0]
+            victims = []
+            for thumb_id, filename, size in conn.execute(
+                'SELECT id, filename, size FROM thumbnails WHERE filename IS NOT NULL ORDER BY accessed'
+            ).fetchall():
+                if total <= self.quota_bytes:
+                    break
+                if thumb_id == keep:
+                    continue
+                # The source stays recorded, so an evicted thumbnail is fetched again on demand
+                conn.execute('UPDATE thumbnails SET filename = NULL, etag = NULL, size = 0 WHERE id = ?',
+                             (thumb_id,))
+                victims.append(filename)
+                total -= size
+            return victims
+
+        try:
+            victims = self._transaction(select_victims)
+        except sqlite3.Error as e:
+            logger.warning(f"Thumbnail eviction failed: {str(e)}")
+            return []
+        for filename in victims:
+            self._remove(filename)
+        return victims
+
+    def stats(self):
+        """Return known and cached thumbnails and their disk usage"""
+        try:
+            known, cached, total = self._connect().execute(
+                'SELECT COUNT(*), COUNT(filename), COALESCE(SUM(size), 0) FROM thumbnails'
+            ).fetchone()
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        return {
+            'enabled': self.enabled,
+            'resize': load_pillow() is not None,
+            'thumbnails': known,
+            'cached': cached,
+            'bytes': total,
+            'quota_bytes': self.quota_bytes,
+        }
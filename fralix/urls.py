@@ -0,0 +1,151 @@
+"""
+URL canonicalization for supported platforms
+parse_video_url turns any of the URL shapes users paste (short links, mobile
+hosts, shorts, tracking parameters, timestamps...) into one
+(platform, video ID, canonical URL) triple. The canonical form is what
+yt-dlp receives and what caches and in-flight deduplication are keyed on.
+"""
+import re
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+# Registrable hosts of every supported platform; subdomains (www., m.,
+# mobile., music. ...) are matched by stripping leading labels
+PLATFORM_HOSTS = {
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'youtube-nocookie.com': 'youtube',
+    'linkedin.com': 'linkedin',
+    'lnkd.in': 'linkedin',
+    'twitter.com': 'twitter',
+    'x.com': 'twitter',
+    'instagram.com': 'instagram',
+    'instagr.am': 'instagram',
+}
+
+_YOUTUBE_ID = r'[A-Za-z0-9_-]{11}'
+_YOUTUBE_SHORT_PATH = re.compile(rf'^/({_YOUTUBE_ID})(?:[/?#]|$)')
+_YOUTUBE_ID_PATH = re.compile(rf'^/(?:shorts|embed|live|v|e)/({_YOUTUBE_ID})(?:[/?#]|$)')
+_YOUTUBE_ID_VALUE = re.compile(rf'^{_YOUTUBE_ID}$')
+_TWITTER_STATUS_PATH = re.compile(r'^/(?:(?:i/web|[^/]+)/status|statuses)/(\d+)')
+_INSTAGRAM_MEDIA_PATH = re.compile(r'^/(?:[^/]+/)?(p|tv|reels?)/([A-Za-z0-9_-]+)')
+_LINKEDIN_ACTIVITY = re.compile(r'urn:li:activity:(\d+)')
+_LINKEDIN_POST_PATH = re.compile(r'^/posts/[^/]+-(\d+)-\w{4}/?$')
+
+
+class VideoURL(namedtuple('VideoURL', ['platform', 'video_id', 'canonical_url'])):
+    """Result of parse_video_url"""
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """Stable identifier: the video ID, or the canonical URL when there is none"""
+        return self.video_id or self.canonical_url
+
+
+UNKNOWN = VideoURL('unknown', None, None)
+
+
+def _platform_for_host(host):
+    """Map a hostname onto a platform, accepting any subdomain"""
+    while host:
+        platform = PLATFORM_HOSTS.get(host)
+        if platform is not None:
+            return platform
+        dot = host.find('.')
+        if dot < 0:
+            return None
+        host = host[dot + 1:]
+    return None
+
+
+def _parse_youtube(host, path, query):
+    if host.endswith('youtu.be'):
+        match = _YOUTUBE_SHORT_PATH.match(path)
+        if match:
+            return match.group(1), f"https://www.youtube.com/watch?v={match.group(1)}"
+        return None, None
+
+    if path in ('/watch', '/watch/'):
+        video_id = parse_qs(query).get('v', [''])[0]
+        if _YOUTUBE_ID_VALUE.match(video_id):
+            return video_id, f"https://www.youtube.com/watch?v={video_id}"
+        return None, None
+
+    match = _YOUTUBE_ID_PATH.match(path)
+    if match:
+        return match.group(1), f"https://www.youtube.com/watch?v={match.group(1)}"
+
+    if path in ('/playlist', '/playlist/'):
+        playlist_id = parse_qs(query).get('list', [''])[0]
+        if playlist_id:
+            return None, f"https://www.youtube.com/playlist?list={playlist_id}"
+    return None, None
+
+
+def _parse_twitter(host, path, query):
+    match = _TWITTER_STATUS_PATH.match(path)
+    if match:
+        return match.group(1), f"https://twitter.com/i/status/{match.group(1)}"
+    return None, None
+
+
+def _parse_instagram(host, path, query):
+    match = _INSTAGRAM_MEDIA_PATH.match(path)
+    if match:
+        kind = 'reel' if match.group(1).startswith('reel') else match.group(1)
+        return match.group(2), f"https://www.instagram.com/{kind}/{match.group(2)}/"
+    return None, None
+
+
+def _parse_linkedin(host, path, query):
+    match = _LINKEDIN_ACTIVITY.search(unquote(path))
+    if match:
+        return match.group(1), f"https://www.linkedin.com/feed/update/urn:li:activity:{match.group(1)}/"
+    match = _LINKEDIN_POST_PATH.match(path)
+    if match:
+        return match.group(1), f"https://www.linkedin.com{path}"
+    return None, None
+
+
+_PARSERS = {
+    'youtube': _parse_youtube,
+    'twitter': _parse_twitter,
+    'instagram': _parse_instagram,
+    'linkedin': _parse_linkedin,
+}
+
+
+def parse_video_url(url):
+    """Return the (platform, video_id, canonical_url) of a URL in one pass"""
+    url = (url or '').strip()
+    if '://' not in url:
+        url = 'https://' + url
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').rstrip('.')
+    except ValueError:
+        return UNKNOWN
+    if parts.scheme not in ('http', 'https'):
+        return UNKNOWN
+
+    platform = _platform_for_host(host)
+    if platform is None:
+        return UNKNOWN
+
+    video_id, canonical_url = _PARSERS[platform](host, parts.path, parts.query)
+    if canonical_url is None:
+        # Known platform but unrecognised path: keep it, minus the fragment. The query stays: it may be
+        # all that identifies the video (attribution links), and it keeps such URLs apart as cache keys
+        canonical_url = f"https://{host}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+    return VideoURL(platform, video_id, canonical_url)
+
+
+def detect_platform(url):
+    """Detect which platform the URL belongs to"""
+    return parse_video_url(url).platform
+
+
+def video_key(url, platform=None):
+    """Return a stable identifier for the video behind a URL"""
+    return parse_video_url(url).key
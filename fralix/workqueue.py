@@ -0,0 +1,357 @@
+"""
+Durable download queue for a separate worker tier
+With WORKER_QUEUE on, the web processes only enqueue download jobs and
+report their status; worker.py processes, on this host or any other that
+mounts the same directories, run them. Scaling downloads then means adding
+workers instead of web processes, and a burst of downloads no longer slows
+down page loads.
+
+The queue is a directory of JSON files, one per job, so it needs nothing
+but a filesystem with atomic rename (local disk or NFS):
+  pending/<enqueued ns>-<job_id>.json   waiting, oldest first
+  leased/<job_id>.json                  taken by a worker
+A worker leases a job by renaming it from pending/ to leased/: exactly
+one rename succeeds, and the worker writes a fresh lease token into the
+entry. While the job runs, the worker touches the leased file every few
+seconds as a heartbeat; heartbeats and completion check the token, so a
+worker whose lease was reaped and handed to another one leaves it alone. A lease whose file has not been
+touched for lease_seconds belongs to a dead or hung worker; any worker
+moves it back to pending/ (again by a rename only one of them wins), where
+it keeps its place in line. After max_attempts leases the job is given up
+and fails with 503.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from fralix.config import env_bool, env_int, env_str
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+
+
+def _write_json(path, entry):
+    """Write entry to path atomically"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def worker_id():
+    """Name of this worker process in leases: host and pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Durable FIFO of jobs in a directory, leased to workers on any host that can see it"""
+
+    def __init__(self, directory, lease_seconds=60, max_attempts=3):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.pending_dir = os.path.join(directory, PENDING)
+        self.leased_dir = os.path.join(directory, LEASED)
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.leased_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_dir):
+        """Build the queue from the WORKER_* environment variables; None unless WORKER_QUEUE is set"""
+        if not env_bool('WORKER_QUEUE', False):
+            return None
+        return cls(
+            env_str('WORKER_QUEUE_DIR', default_dir),
+            lease_seconds=env_int('WORKER_LEASE_SECONDS', 60),
+            max_attempts=env_int('WORKER_MAX_ATTEMPTS', 3),
+        )
+
+    def _entries(self, directory):
+        try:
+            return sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+        except OSError:
+            return []
+
+    def _leased_path(self, job_id):
+        return os.path.join(self.leased_dir, f"{os.path.basename(job_id)}.json")
+
+    def put(self, job_id, task, args, kwargs, key=None):
+        """Append a job: task is the name of the function a worker runs with args and kwargs"""
+        enqueued = time.time_ns()
+        entry = {
+            'job_id': job_id,
+            'task': task,
+            'args': list(args),
+            'kwargs': kwargs,
+            'key': key,
+            'enqueued': enqueued,
+            'attempts': 0,
+            'owner': None,
+        }
+        _write_json(os.path.join(self.pending_dir, f"{enqueued:020d}-{job_id}.json"), entry)
+
+    def lease(self, owner):
+        """Take the oldest pending job for owner; returns its entry, or None when the queue is empty"""
+        for name in self._entries(self.pending_dir):
+            src = os.path.join(self.pending_dir, name)
+            dest = self._leased_path(name[:-5].split('-', 1)[1])
+            try:
+                # Fresh mtime first, so the lease does not look abandoned the moment it appears
+                os.utime(src)
+                os.rename(src, dest)
+            except FileNotFoundError:
+                # Another worker took it
+                continue
+            try:
+                entry = _read_json(dest)
+                entry['attempts'] = entry.get('attempts', 0) + 1
+                entry['owner'] = owner
+                entry['lease'] = uuid.uuid4().hex
+                entry['leased'] = time.time()
+                _write_json(dest, entry)
+            except (OSError, ValueError) as e:
+                logger.error(f"Dropping unreadable queue entry {name}: {str(e)}")
+                try:
+                    os.remove(dest)
+                except OSError:
+                    pass
+                continue
+            return entry
+        return None
+
+    def _holds(self, job_id, lease):
+        """Whether the leased file of job_id is still the lease given out with token lease"""
+        try:
+            return _read_json(self._leased_path(job_id)).get('lease') == lease
+        except (OSError, ValueError):
+            return False
+
+    def heartbeat(self, job_id, lease):
+        """Extend the lease of a running job; False when it was lost to the reaper"""
+        if not self._holds(job_id, lease):
+            return False
+        try:
+            os.utime(self._leased_path(job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job_id, lease):
+        """Drop a job whose run ended, successfully or not, unless its lease went to another worker"""
+        if not self._holds(job_id, lease):
+            return
+        try:
+            os.remove(self._leased_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def reap(self):
+        """Return abandoned leases to the queue; returns (entry, given_up) for each abandoned job"""
+        now = time.time()
+        abandoned = []
+        for name in self._entries(self.leased_dir):
+            path = os.path.join(self.leased_dir, name)
+            try:
+                if now - os.path.getmtime(path) < self.lease_seconds:
+                    continue
+                # Claimed by renaming, so two reapers never handle the same lease
+                claimed = f"{path}.reap-{uuid.uuid4().hex}"
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                entry = _read_json(claimed)
+            except (OSError, ValueError) as e:
+                logger.error(f"Dropping unreadable abandoned lease {name}: {str(e)}")
+                entry = None
+            if entry is not None:
+                given_up = entry.get('attempts', 0) >= self.max_attempts
+                abandoned.append((entry, given_up))
+                if given_up:
+                    logger.error(f"Job {entry['job_id']} abandoned {entry['attempts']} times, giving up")
+                else:
+                    logger.warning(f"Job {entry['job_id']} lease of {entry.get('owner')} expired, queueing it again")
+                    entry['owner'] = entry['lease'] = None
+                    _write_json(os.path.join(self.pending_dir, f"{entry['enqueued']:020d}-{entry['job_id']}.json"),
+                                entry)
+            os.remove(claimed)
+        return abandoned
+
+    def alive(self, job_id):
+        """Whether a job is waiting in the queue or held by a worker that is still heartbeating"""
+        job_id = os.path.basename(job_id)
+        try:
+            return time.time() - os.path.getmtime(self._leased_path(job_id)) < self.lease_seconds
+        except OSError:
+            pass
+        return any(name.endswith(f"-{job_id}.json") for name in self._entries(self.pending_dir))
+
+    def pending(self):
+        """Jobs waiting for a worker"""
+        return len(self._entries(self.pending_dir))
+
+    def depth(self):
+        """Jobs pending or leased, over all web and worker processes"""
+        return len(self._entries(self.pending_dir)) + len(self._entries(self.leased_dir))
+
+    def samples(self):
+        """Shared metric samples: queue depth by state"""
+        return [
+            ('fralix_queue_jobs', {'state': PENDING}, len(self._entries(self.pending_dir))),
+            ('fralix_queue_jobs', {'state': LEASED}, len(self._entries(self.leased_dir))),
+        ]
+
+    def stats(self):
+        now = time.time()
+        pending = self._entries(self.pending_dir)
+        oldest = int(pending[0].split('-', 1)[0]) / 1e9 if pending else None
+        return {
+            'directory': self.directory,
+            PENDING: len(pending),
+            LEASED: len(self._entries(self.leased_dir)),
+            'oldest_pending_seconds': round(now - oldest, 1) if oldest else None,
+            'lease_seconds': self.lease_seconds,
+            'max_attempts': self.max_attempts,
+        }
+
+
+class QueueWorker:
+    """Runs jobs leased from a WorkQueue on a few threads, heartbeating and reaping as it goes"""
+
+    def __init__(self, jobs, tasks, concurrency=2, poll_interval=1.0, metrics=None, drain=False):
+        self.jobs = jobs
+        self.queue = jobs.queue
+        self.tasks = tasks
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.metrics = metrics
+        # Exit once the queue is empty instead of waiting for more jobs
+        self.drain = drain
+        self.owner = worker_id()
+        # Lease token of each running job, None once the lease was lost
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # A lease being requeued is in neither directory; reaps wait for each other so none misses it
+        self._reap_lock = threading.Lock()
+
+    def _run_one(self):
+        entry = self.queue.lease(self.owner)
+        if entry is None:
+            return False
+        job_id = entry['job_id']
+        with self._lock:
+            self._running[job_id] = entry['lease']
+        try:
+            func = self.tasks.get(entry['task'])
+            if func is None:
+                logger.error(f"Job {job_id} names unknown task {entry['task']}")
+                self.jobs.fail_queued(entry, f"Unknown task {entry['task']}", 500)
+            else:
+                logger.info(f"Running job {job_id} ({entry['task']}, attempt {entry['attempts']})")
+                self.jobs.run_queued(entry, func)
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            self.queue.complete(job_id, entry['lease'])
+        return True
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                if self._run_one():
+                    continue
+                # Abandoned leases count as queued work too, also when the heartbeat thread requeued them
+                if self._reap() == 0 and self.drain and self.queue.pending() == 0:
+                    return
+            except Exception as e:
+                logger.error(f"Worker loop error: {str(e)}")
+            self._stopping.wait(self.poll_interval)
+
+    def _heartbeat_forever(self):
+        # A third of the lease: two missed beats still keep it
+        interval = max(self.queue.lease_seconds / 3, 0.5)
+        while True:
+            with self._lock:
+                idle = not self._running
+                running = [(job_id, lease) for job_id, lease in self._running.items() if lease is not None]
+            for job_id, lease in running:
+                if not self.queue.heartbeat(job_id, lease):
+                    logger.warning(f"Lost the lease of job {job_id}; another worker may run it too")
+                    # Its state file is the new lease holder's to keep fresh, or stale once the job is given up
+                    with self._lock:
+                        if job_id in self._running:
+                            self._running[job_id] = None
+                    continue
+                self.jobs.touch(job_id)
+            self._reap()
+            if self._stopping.is_set() and idle:
+                return
+            time.sleep(interval)
+
+    def _reap(self):
+        """Requeue or fail abandoned leases; returns how many were requeued"""
+        requeued = 0
+        try:
+            with self._reap_lock:
+                abandoned = self.queue.reap()
+            for entry, given_up in abandoned:
+                if given_up:
+                    self.jobs.fail_queued(entry, 'Download abandoned: the workers running it stopped responding', 503)
+                else:
+                    requeued += 1
+                self._count('failed' if given_up else 'retried')
+        except OSError as e:
+            logger.warning(f"Could not reap abandoned jobs: {str(e)}")
+        return requeued
+
+    def _count(self, result):
+        if self.metrics is not None:
+            self.metrics.inc('fralix_queue_abandoned_total', result=result)
+
+    def stop(self, *_):
+        """Stop leasing new jobs; running ones finish"""
+        if not self._stopping.is_set():
+            logger.info('Stopping: no new jobs are leased, running ones finish first')
+        self._stopping.set()
+
+    def run(self):
+        """Work until stop() (SIGTERM or SIGINT); a second signal exits at once and leaves the leases to expire"""
+        def second_signal(signum, frame):
+            raise KeyboardInterrupt
+
+        def first_signal(signum, frame):
+            self.stop()
+            signal.signal(signal.SIGTERM, second_signal)
+            signal.signal(signal.SIGINT, second_signal)
+
+        self.jobs.queue_workers = self.concurrency
+        signal.signal(signal.SIGTERM, first_signal)
+        signal.signal(signal.SIGINT, first_signal)
+        logger.info(f"Worker {self.owner} running {self.concurrency} job(s) at a time from {self.queue.directory}")
+        heartbeat = threading.Thread(target=self._heartbeat_forever, name='queue-heartbeat', daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._loop, name=f'queue-worker-{index}', daemon=True)
+                   for index in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            logger.warning('Exiting with jobs running; their leases expire and other workers retry them')
+            return 1
+        return 0
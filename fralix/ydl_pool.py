@@ -0,0 +1,126 @@
+"""
+Pool of warm YoutubeDL instances
+Building a YoutubeDL registers every extractor, sets up cookie jars and
+HTTP handlers; doing that per request is pure overhead. The pool keeps a few
+idle instances per key (platform plus any option that yt-dlp bakes in at
+construction time, such as the format selector) so their keep-alive
+connections and cookies carry over between requests.
+
+An instance is checked out by one request at a time, discarded when the
+request raises (e.g. bot detection, so the retry gets a fresh user agent)
+and recycled after max_uses requests.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from fralix.config import env_int
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.uses = 0
+
+
+class YDLPool:
+    """Per-key pool of reusable YoutubeDL objects"""
+
+    def __init__(self, factory, max_uses=50, max_idle=4, max_total_idle=16):
+        self.factory = factory
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.max_total_idle = max_total_idle
+        # Most recently used keys last, so the oldest keys are trimmed first
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @classmethod
+    def from_env(cls, factory):
+        """Build the pool from YDL_POOL_* environment variables"""
+        return cls(
+            factory,
+            max_uses=env_int('YDL_POOL_MAX_USES', 50),
+            max_idle=env_int('YDL_POOL_MAX_IDLE', 4),
+            max_total_idle=env_int('YDL_POOL_MAX_TOTAL_IDLE', 16),
+        )
+
+    def _close(self, entry):
+        self.discarded += 1
+        try:
+            entry.ydl.close()
+        except Exception as e:
+            logger.warning(f"Error closing pooled YoutubeDL: {str(e)}")
+
+    @contextmanager
+    def checkout(self, key, make_options):
+        """Borrow an instance for key, creating one from make_options() if none is idle"""
+        with self._lock:
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+            if entry is not None:
+                self.reused += 1
+        if entry is None:
+            entry = _Entry(self.factory(make_options()))
+            with self._lock:
+                self.created += 1
+
+        try:
+            yield entry.ydl
+        except BaseException:
+            # The instance may be in a bad state (or flagged by the platform)
+            self._close(entry)
+            raise
+
+        entry.uses += 1
+        if entry.uses >= self.max_uses:
+            self._close(entry)
+            return
+        evicted = [entry]
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.max_idle:
+                idle.append(entry)
+                evicted = self._trim()
+        for old in evicted:
+            self._close(old)
+
+    def _trim(self):
+        """Drop idle instances of the least recently used keys beyond max_total_idle"""
+        evicted = []
+        total = sum(len(v) for v in self._idle.values())
+        while total > self.max_total_idle and self._idle:
+            key, idle = next(iter(self._idle.items()))
+            if idle:
+                evicted.append(idle.pop(0))
+                total -= 1
+            if not idle:
+                del self._idle[key]
+        return evicted
+
+    def clear(self):
+        """Close every idle instance"""
+        with self._lock:
+            entries = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+        return {
+            'idle': idle,
+            'created': self.created,
+            'reused': self.reused,
+            'discarded': self.discarded,
+            'max_uses': self.max_uses,
+            'max_idle': self.max_idle,
+        }
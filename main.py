@@ -1,20 +1,370 @@
-import yt_dlp
+"""
+Batch downloader CLI
+Downloads every URL given on the command line, in a file (-i links.txt) or
+on stdin (-i -), with several downloads running at once. URLs are reduced to
+(platform, video ID) like the web app does, so duplicates in the list run
+once. Every finished video is appended to a download archive. A re-run skips
+archived videos before contacting any platform, and an interrupted nightly
+job picks up where it stopped.
+
+Aggregate progress goes to stderr. A JSON summary with per-item timings and
+throughput goes to stdout, or to --summary FILE. The exit status is 1 when
+any item failed. Ctrl+C drops the queued items and lets the running ones
+finish; a second Ctrl+C aborts those too, keeping their partial files for
+the next run.
+
+    python main.py -i links.txt -o downloads -j 8 --archive archive.txt --summary run.json
+    python main.py https://youtu.be/dQw4w9WgXcQ
+    python main.py        # asks for a link, like before
+"""
+import argparse
+import json
 import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import yt_dlp
+
+from fralix.audio import AUDIO_TARGETS, NEEDS_FFMPEG, audio_target, download_selector
+from fralix.ratelimit import is_bot_detection
+from fralix.urls import parse_video_url
+
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+class Aborted(Exception):
+    """Raised from the progress hook to stop a download after a second Ctrl+C"""
+
+
+# Seconds between progress lines when stderr is not a terminal (cron logs)
+_LOG_PROGRESS_EVERY = 10
+
+
+def read_urls(sources, input_path=None):
+    """URLs from the arguments and an input file ('-' for stdin); blank lines and # comments skipped"""
+    urls = list(sources)
+    if input_path is not None:
+        f = sys.stdin if input_path == '-' else open(input_path, encoding='utf-8')
+        try:
+            urls.extend(line.strip() for line in f)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return [url for url in urls if url and not url.startswith('#')]
+
+
+def archive_id(url):
+    """Archive entry of a URL: 'platform video_id', or the URL itself without a known video ID"""
+    parsed = parse_video_url(url)
+    if parsed.video_id is None:
+        # Playlists and other sites: canonical URLs drop the query that tells them apart
+        return f"url {url}"
+    return f"{parsed.platform} {parsed.video_id}"
+
+
+class DownloadArchive:
+    """Append-only file of finished archive IDs, shared by the download threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = set()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._ids.update(line.strip() for line in f if line.strip())
+
+    def __contains__(self, entry):
+        return entry in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, entry):
+        """Record a finished download; written at once so a killed run keeps it"""
+        with self._lock:
+            if entry in self._ids:
+                return
+            self._ids.add(entry)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(entry + '\n')
+
+
+class Progress:
+    """Aggregate progress of the run, printed to stderr"""
+
+    def __init__(self, total, stream=sys.stderr):
+        self.total = total
+        self.stream = stream
+        self.counts = {DOWNLOADED: 0, SKIPPED: 0, FAILED: 0}
+        self.bytes = 0
+        self.active = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._last_print = 0.0
+        self._interactive = stream.isatty()
+
+    def add_bytes(self, size):
+        with self._lock:
+            self.bytes += size
+        self.show()
+
+    def item_started(self):
+        with self._lock:
+            self.active += 1
+
+    def item_done(self, status, ran=True):
+        with self._lock:
+            if ran:
+                self.active -= 1
+            self.counts[status] = self.counts.get(status, 0) + 1
+        self.show(force=not self._interactive and status == FAILED)
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-6)
+        finished = sum(self.counts.values())
+        return (f"[{finished}/{self.total}] {self.counts[DOWNLOADED]} downloaded, {self.counts[SKIPPED]} skipped, "
+                f"{self.counts[FAILED]} failed, {self.active} active | {self.bytes / 1048576:.1f} MiB at "
+                f"{self.bytes / elapsed / 1048576:.2f} MiB/s")
+
+    def show(self, force=False):
+        now = time.monotonic()
+        interval = 0.5 if self._interactive else _LOG_PROGRESS_EVERY
+        with self._lock:
+            if not force and now - self._last_print < interval:
+                return
+            self._last_print = now
+        if self._interactive:
+            self.stream.write('\r' + self.line().ljust(100))
+        else:
+            self.stream.write(self.line() + '\n')
+        self.stream.flush()
+
+    def close(self):
+        self._last_print = 0.0
+        self.show(force=True)
+        if self._interactive:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def ydl_options(args, progress_hook):
+    """yt-dlp options of every download of the run"""
+    options = {
+        'format': download_selector(args.format),
+        'outtmpl': os.path.join(args.output, '%(title).150B [%(id)s].%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'continuedl': True,
+        'retries': 5,
+        'concurrent_fragment_downloads': args.fragments,
+        'merge_output_format': 'mp4/mkv',
+        'progress_hooks': [progress_hook],
+    }
+    target = audio_target(args.format)
+    if target is not None and shutil.which('ffmpeg'):
+        # No web workers to protect here: yt-dlp converts in the download thread
+        options['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': target}]
+    return options
+
+
+def download_one(url, args, progress, abort):
+    """Download one URL, giving up once abort is set; returns its summary item"""
+    started = time.perf_counter()
+    item = {'url': url, 'status': FAILED, 'attempts': 0}
+    # Bytes per file: adaptive formats download video and audio one after the other
+    downloaded = {}
+
+    def hook(d):
+        if abort.is_set():
+            raise Aborted('Aborted')
+        # Bytes since the last call, so parallel downloads add up in the aggregate
+        if d.get('status') in ('downloading', 'finished'):
+            current = d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            previous = downloaded.get(d.get('filename'), 0)
+            if current > previous:
+                progress.add_bytes(current - previous)
+                downloaded[d.get('filename')] = current
+
+    for attempt in range(args.retries + 1):
+        if abort.is_set():
+            item.update(status=CANCELLED, error='Aborted')
+            break
+        item['attempts'] = attempt + 1
+        try:
+            with yt_dlp.YoutubeDL(ydl_options(args, hook)) as ydl:
+                info = ydl.extract_info(url, download=True)
+            requested = (info.get('requested_downloads') or [{}])[-1]
+            filename = requested.get('filepath') or requested.get('_filename')
+            item.update({
+                'status': DOWNLOADED,
+                'id': info.get('id'),
+                'title': info.get('title'),
+                'filename': filename,
+                'bytes': os.path.getsize(filename) if filename and os.path.exists(filename) else sum(downloaded.values()),
+            })
+            item.pop('error', None)
+            break
+        except Exception as e:
+            item['error'] = str(e)
+            if abort.is_set():
+                # yt-dlp may wrap the hook's exception; the event says what happened
+                item.update(status=CANCELLED, error='Aborted')
+                break
+            if attempt < args.retries:
+                # Platforms blocking automated access need longer than a flaky connection
+                abort.wait(args.retry_wait * (4 if is_bot_detection(str(e)) else 1) * (attempt + 1))
+    item['seconds'] = round(time.perf_counter() - started, 3)
+    if item['status'] == DOWNLOADED and item['seconds'] > 0:
+        item['bytes_per_second'] = round(item['bytes'] / item['seconds'])
+    return item
+
+
+def run(urls, args, stream=sys.stderr):
+    """Download urls with args.jobs workers; returns the run summary"""
+    archive = DownloadArchive(args.archive)
+    started_at = time.time()
+
+    # The same video listed twice (or under two URL shapes) is downloaded once
+    entries = {}
+    for url in urls:
+        entries.setdefault(archive_id(url), url)
+
+    progress = Progress(len(entries), stream)
+    # Set by a second Ctrl+C: running downloads stop at their next progress update
+    abort = threading.Event()
+    items = []
+    pending = []
+    for entry, url in entries.items():
+        if entry in archive:
+            items.append({'url': url, 'status': SKIPPED, 'archive_id': entry, 'seconds': 0})
+            progress.item_done(SKIPPED, ran=False)
+        else:
+            pending.append((entry, url))
+
+    def work(entry, url):
+        progress.item_started()
+        item = download_one(url, args, progress, abort)
+        item['archive_id'] = entry
+        if item['status'] == DOWNLOADED:
+            archive.add(entry)
+        progress.item_done(item['status'])
+        return item
+
+    executor = ThreadPoolExecutor(max_workers=max(args.jobs, 1), thread_name_prefix='download')
+    futures = [executor.submit(work, entry, url) for entry, url in pending]
+    interrupted = False
+    try:
+        for future in as_completed(futures):
+            future.result()
+    except KeyboardInterrupt:
+        # Queued items are dropped; running ones finish and are archived (press again to abort them)
+        interrupted = True
+        stream.write('\nInterrupted, finishing the downloads already running...\n')
+        for future in futures:
+            future.cancel()
+    try:
+        executor.shutdown(wait=True)
+    except KeyboardInterrupt:
+        # Interrupted again: the worker threads cannot be killed, so their downloads are made to fail
+        interrupted = True
+        abort.set()
+        stream.write('\nAborting the running downloads...\n')
+        # Not shutdown() again: a join interrupted once may return before its thread is done
+        wait(futures)
+    progress.close()
+    for future, (entry, url) in zip(futures, pending):
+        if future.done() and not future.cancelled():
+            items.append(future.result())
+        else:
+            items.append({'url': url, 'status': CANCELLED, 'archive_id': entry})
+
+    order = {entry: index for index, entry in enumerate(entries)}
+    items.sort(key=lambda item: order[item['archive_id']])
+    seconds = time.time() - started_at
+    total_bytes = sum(item.get('bytes', 0) for item in items if item['status'] == DOWNLOADED)
+    counts = {status: sum(item['status'] == status for item in items)
+              for status in (DOWNLOADED, SKIPPED, FAILED, CANCELLED)}
+    return {
+        'started': started_at,
+        'seconds': round(seconds, 3),
+        'jobs': args.jobs,
+        'format': args.format,
+        'output': os.path.abspath(args.output),
+        'total': len(items),
+        'duplicates': len(urls) - len(entries),
+        **counts,
+        'bytes': total_bytes,
+        'bytes_per_second': round(total_bytes / seconds) if seconds > 0 else None,
+        'interrupted': interrupted,
+        'items': items,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Download videos from YouTube, X (Twitter), Instagram and '
+                                                 'LinkedIn, many at a time.')
+    parser.add_argument('urls', nargs='*', help='video or playlist URLs')
+    parser.add_argument('-i', '--input', help="file with one URL per line, '-' for stdin")
+    parser.add_argument('-o', '--output', default=os.getcwd(), help='download directory (default: current)')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='downloads running at once (default: 4)')
+    parser.add_argument('-f', '--format', default='best',
+                        help="format_id as in /api/download: 'best', a yt-dlp selector, or "
+                             f"audio:{{{','.join(AUDIO_TARGETS)}}} (default: best)")
+    parser.add_argument('--archive', help='download archive file; archived videos are skipped')
+    parser.add_argument('--summary', help="write the JSON summary here instead of stdout ('-' for stdout)")
+    parser.add_argument('--fragments', type=int, default=4,
+                        help='DASH/HLS fragments fetched at once within each download (default: 4)')
+    parser.add_argument('--retries', type=int, default=1, help='extra attempts per failed item (default: 1)')
+    parser.add_argument('--retry-wait', type=float, default=5.0,
+                        help='seconds before the first retry, growing with each attempt (default: 5)')
+    return parser.parse_args(argv)
+
 
-Video_url = input("Enter youtube link: ")
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        target = audio_target(args.format)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if target in NEEDS_FFMPEG and shutil.which('ffmpeg') is None:
+        # Same as the web API: without ffmpeg this would save the source container under the target's name
+        print(f'{target} needs ffmpeg, which is not installed on this machine', file=sys.stderr)
+        return 2
+    if target is not None:
+        args.format = f"audio:{target}"
+    urls = read_urls(args.urls, args.input)
+    if not urls and args.input is None and sys.stdin.isatty():
+        urls = read_urls([input("Enter video link: ").strip()])
+    if not urls:
+        print('No URLs given', file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    print(f"Downloading {len(urls)} URL(s) into {os.path.abspath(args.output)} with {args.jobs} worker(s)",
+          file=sys.stderr)
 
-# Get the current working directory (download location)
-download_dir = os.getcwd()
-print(f"\nDownload directory: {download_dir}\n")
+    summary = run(urls, args)
+    payload = json.dumps(summary, indent=2)
+    if args.summary and args.summary != '-':
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(payload + '\n')
+        print(f"Summary written to {args.summary}", file=sys.stderr)
+    else:
+        print(payload)
+    for item in summary['items']:
+        if item['status'] == FAILED:
+            print(f"Failed: {item['url']}: {item.get('error')}", file=sys.stderr)
+    if summary['interrupted']:
+        return 130
+    return 1 if summary[FAILED] else 0
 
-ydl_opts = {
-    'format': 'best[ext=mp4]/best',
-}
 
-try:
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([Video_url])
-    print(f"\nVideo Download Complete!")
-    print(f"File saved in: {download_dir}")
-except Exception as e:
-    print(f"An error occurred: {e}")
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 // Global state
 let currentVideoInfo = null;
 let selectedFormat = null;
+// Job of the server's speculative download of the likely format, until it is used or cancelled
+let prefetchJob = null;
+let prefetchFormat = null;
 
 // DOM Elements
 const videoUrlInput = document.getElementById('videoUrl');
@@ -30,6 +33,9 @@ document.addEventListener('keydown', (e) => {
     }
 });
 
+// Leaving the page with the modal open cancels the prefetch too
+window.addEventListener('pagehide', cancelPrefetch);
+
 // Handle Enter key in input
 videoUrlInput.addEventListener('keypress', (e) => {
     if (e.key === 'Enter') {
@@ -89,8 +95,13 @@ function showVideoModal(videoInfo) {
     // Show video preview
     if (videoInfo.thumbnail) {
         videoPreview.innerHTML = `
-            <img src="${videoInfo.thumbnail}" alt="Video thumbnail" />
+            <img src="${videoInfo.thumbnail}" alt="Video thumbnail" decoding="async" />
         `;
+        // The proxied preview can be gone (cache evicted, another instance); use the platform's image then
+        if (videoInfo.thumbnail_source && videoInfo.thumbnail_source !== videoInfo.thumbnail) {
+            const img = videoPreview.querySelector('img');
+            img.addEventListener('error', () => { img.src = videoInfo.thumbnail_source; }, { once: true });
+        }
     } else {
         videoPreview.innerHTML = `
             <div style="padding: 2rem; text-align: center; background: var(--surface); border-radius: 12px;">
@@ -121,6 +132,23 @@ function showVideoModal(videoInfo) {
         formatList.appendChild(formatItem);
     }
 
+    // Audio-only choices (M4A, MP3, Opus) download just the audio stream
+    (videoInfo.audio_formats || []).forEach(format => {
+        const formatItem = createFormatItem(format, formatList.children.length);
+        formatList.appendChild(formatItem);
+    });
+
+    // The server is already fetching its guess; preselect it so one click downloads it
+    prefetchJob = videoInfo.prefetch ? videoInfo.prefetch.job_id : null;
+    prefetchFormat = videoInfo.prefetch ? videoInfo.prefetch.format_id : null;
+    if (videoInfo.prefetch) {
+        const guessed = Array.from(formatList.children)
+            .find(el => el.dataset.formatId === videoInfo.prefetch.format_id);
+        if (guessed) {
+            guessed.click();
+        }
+    }
+
     // Show modal
     videoModal.style.display = 'flex';
     document.body.style.overflow = 'hidden';
@@ -133,14 +161,17 @@ function createFormatItem(format, index) {
     item.dataset.formatId = format.format_id;
     item.dataset.index = index;
 
+    // Estimated sizes (from bitrate x duration) are marked with ~
     const sizeText = format.filesize 
-        ? `(${(format.filesize / (1024 * 1024)).toFixed(2)} MB)`
+        ? `(${format.filesize_estimated ? '~' : ''}${(format.filesize / (1024 * 1024)).toFixed(2)} MB)`
         : '';
+    const codec = format.vcodec || (format.format_id.startsWith('audio') ? format.acodec : null);
+    const codecText = codec ? ` ${codec.toUpperCase()}` : '';
 
     item.innerHTML = `
         <div class="format-item-info">
             <span class="format-item-label">${format.resolution || 'Best Quality'}</span>
-            <span class="format-item-details">${format.ext.toUpperCase()} ${sizeText}</span>
+            <span class="format-item-details">${format.ext.toUpperCase()}${codecText} ${sizeText}</span>
         </div>
     `;
 
@@ -153,14 +184,28 @@ function createFormatItem(format, index) {
         // Add selection to clicked item
         item.classList.add('selected');
         selectedFormat = format.format_id;
+        // Another format was chosen: the guess is only using bandwidth now
+        if (selectedFormat !== prefetchFormat) {
+            cancelPrefetch();
+        }
         confirmDownload.disabled = false;
     });
 
     return item;
 }
 
+// Stop the server's prefetch nobody wants; sendBeacon still goes out while the page is being left
+function cancelPrefetch() {
+    if (prefetchJob) {
+        navigator.sendBeacon(`/api/prefetch/${prefetchJob}/cancel`);
+        prefetchJob = null;
+        prefetchFormat = null;
+    }
+}
+
 // Close video modal
 function closeVideoModal() {
+    cancelPrefetch();
     videoModal.style.display = 'none';
     document.body.style.overflow = '';
     currentVideoInfo = null;
@@ -174,6 +219,8 @@ async function handleConfirmDownload() {
     }
 
     const url = videoUrlInput.value.trim();
+    // The server adopts the prefetch of this format, or stops it when another one was chosen
+    prefetchJob = null;
     confirmDownload.disabled = true;
     confirmDownload.innerHTML = '<span class="spinner"></span> Downloading...';
 
@@ -189,12 +236,16 @@ async function handleConfirmDownload() {
             }),
         });
 
-        const data = await response.json();
+        let job = await response.json();
 
         if (!response.ok) {
-            throw new Error(data.error || 'Download failed');
+            throw new Error(job.error || 'Download failed');
         }
 
+        // The download runs in the background; wait for the job to finish
+        job = await waitForJob(job);
+        const data = job.result || {};
+
         // Success - trigger download
         if (data.filename) {
             window.location.href = `/api/download-file/${encodeURIComponent(data.filename)}`;
@@ -215,6 +266,44 @@ async function handleConfirmDownload() {
     }
 }
 
+// Poll a download job until it finishes, showing its progress
+async function waitForJob(job) {
+    while (job.state === 'queued' || job.state === 'running') {
+        confirmDownload.innerHTML = `<span class="spinner"></span> ${formatJobProgress(job)}`;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+
+        const response = await fetch(`/api/jobs/${job.job_id}`);
+        job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Download failed');
+        }
+    }
+
+    if (job.state === 'error') {
+        throw new Error(job.error || 'Download failed');
+    }
+    return job;
+}
+
+// Describe job progress for the download button
+function formatJobProgress(job) {
+    if (job.state === 'queued') {
+        return 'Waiting...';
+    }
+    if (job.progress === null || job.progress === undefined) {
+        return 'Downloading...';
+    }
+
+    let text = `Downloading ${Math.round(job.progress)}%`;
+    if (job.speed) {
+        text += ` · ${(job.speed / (1024 * 1024)).toFixed(1)} MB/s`;
+    }
+    if (job.eta) {
+        text += ` · ${job.eta}s left`;
+    }
+    return text;
+}
+
 // Set loading state
 function setLoading(loading) {
     const btnText = downloadBtn.querySelector('.btn-text');
@@ -0,0 +1,54 @@
+"""
+Standalone download worker
+Runs the download jobs that the web tier enqueues when WORKER_QUEUE is on,
+so download capacity scales apart from page serving. Start as many workers
+as needed, on this host or on others that mount the same cache/ and
+downloads/ directories (or set WORKER_QUEUE_DIR). A worker that dies or
+hangs loses its leases after WORKER_LEASE_SECONDS, and another worker runs
+those jobs again, resuming their partial files.
+
+SIGTERM or Ctrl+C stops leasing new jobs and exits once the running ones
+have finished. A second signal exits at once.
+
+    WORKER_QUEUE=true gunicorn app:app                 # web tier: only enqueues
+    WORKER_QUEUE=true python worker.py -j 4            # worker tier
+    python worker.py --drain                           # run what is queued, then exit
+"""
+import argparse
+import logging
+import os
+import sys
+
+from fralix.config import env_int
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run queued download jobs for the web tier.')
+    parser.add_argument('-j', '--concurrency', type=int, default=env_int('WORKER_CONCURRENCY', 2),
+                        help='jobs run at once (default: WORKER_CONCURRENCY or 2)')
+    parser.add_argument('--poll', type=float, default=1.0, help='seconds between looks at an empty queue (default: 1)')
+    parser.add_argument('--drain', action='store_true', help='exit once the queue is empty')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # A worker always consumes the queue, whatever the rest of the environment says
+    os.environ['WORKER_QUEUE'] = 'true'
+    import app as backend
+    from fralix.workqueue import QueueWorker
+
+    tasks = {func.__name__: func for func in (
+        backend.perform_download, backend.perform_bulk_download, backend.perform_prefetch)}
+    worker = QueueWorker(backend.download_jobs, tasks, concurrency=max(args.concurrency, 1),
+                         poll_interval=args.poll, metrics=backend.metrics, drain=args.drain)
+    try:
+        return worker.run()
+    finally:
+        backend.metrics.flush()
+        backend.audio_pool.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())